@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet
+from telethon import errors
+from telethon.tl.types import ChannelParticipantsAdmins
+
+from .config import get_settings
+from .governor import RateGovernor
+from .peers import is_channel_peer
+from .utils import ensure_utc
+from .models import async_session
+from .writer import write_in_background
+from . import crud
+
+
+async def fetch_admin_ids(client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> FrozenSet[int] | None:
+    """从 Telegram 获取群管理员ID；失败返回 None（与“没有管理员”区分，失败结果不缓存）"""
+    try:
+        if entity is None:
+            from .collectors import resolve_group_entity
+            entity = await resolve_group_entity(client, chat_id, governor)
+        if not entity:
+            return None
+        if not is_channel_peer(entity):
+            # For Chat, Telethon doesn't provide admin list easily; skip.
+            return frozenset()
+        if governor is None:
+            admins = await client.get_participants(entity, filter=ChannelParticipantsAdmins())
+        else:
+            admins = await governor.call(client.get_participants, entity, filter=ChannelParticipantsAdmins())
+        return frozenset(int(a.id) for a in admins)
+    except errors.FloodWaitError as e:
+        if governor is None:
+            await asyncio.sleep(e.seconds + 1)
+        return None
+    except Exception as e:
+        print(f"  ⚠️ 获取群 {chat_id} 管理员列表失败: {e}")
+        return None
+
+
+class AdminCache:
+    """群管理员集合缓存：内存 + chat_admins 表
+
+    - 命中且未过期：直接返回，不发请求
+    - 已过期：先返回旧集合，同时在后台刷新
+    - 没有记录：同步获取一次
+    采集和监听共用，is_admin 只查内存，O(1)。
+    """
+
+    def __init__(self, ttl: int | None = None):
+        self.ttl = ttl if ttl is not None else get_settings().admin_cache_ttl
+        self._mem: Dict[int, tuple[FrozenSet[int], float]] = {}  # chat_id -> (管理员ID, 获取时间戳)
+        self._refreshing: Dict[int, asyncio.Task] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    async def _lookup(self, chat_id: int) -> tuple[FrozenSet[int], float] | None:
+        entry = self._mem.get(chat_id)
+        if entry is not None:
+            return entry
+        async with async_session() as db:
+            row = await db.run_sync(crud.get_chat_admins, chat_id)
+        if row is None:
+            return None
+        entry = (frozenset(json.loads(row.admin_ids)), ensure_utc(row.fetched_at).timestamp())
+        self._mem[chat_id] = entry
+        return entry
+
+    def _fresh(self, entry: tuple[FrozenSet[int], float]) -> bool:
+        return time.time() - entry[1] < self.ttl
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        entry = self._mem.get(chat_id)
+        return entry is not None and user_id in entry[0]
+
+    async def get(self, client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> FrozenSet[int]:
+        entry = await self._lookup(chat_id)
+        if entry is not None:
+            if self._fresh(entry):
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                self.schedule_refresh(client, chat_id, governor, entity)
+            return entry[0]
+        self.stats["misses"] += 1
+        return await self.refresh(client, chat_id, governor, entity)
+
+    def schedule_refresh(self, client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> None:
+        """后台刷新；同一个群同时只有一个刷新任务"""
+        task = self._refreshing.get(chat_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self.refresh(client, chat_id, governor, entity))
+        self._refreshing[chat_id] = task
+        task.add_done_callback(lambda _t: self._refreshing.pop(chat_id, None))
+
+    async def ensure(self, client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> None:
+        """载入缓存；缺失或过期时后台刷新（监听启动时预热用）"""
+        entry = await self._lookup(chat_id)
+        if entry is None or not self._fresh(entry):
+            self.schedule_refresh(client, chat_id, governor, entity)
+
+    async def refresh(self, client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> FrozenSet[int]:
+        ids = await fetch_admin_ids(client, chat_id, governor, entity)
+        if ids is None:
+            self.stats["errors"] += 1
+            entry = self._mem.get(chat_id)
+            return entry[0] if entry is not None else frozenset()
+        self.stats["refreshes"] += 1
+        now = time.time()
+        self._mem[chat_id] = (ids, now)
+        # 内存中已是最新值，落库交给写线程在后台完成
+        write_in_background(crud.save_chat_admins, chat_id, ids, datetime.fromtimestamp(now, timezone.utc))
+        return ids
+
+    def snapshot(self) -> dict:
+        return {"ttl": self.ttl, "chats": len(self._mem), "refreshing": len(self._refreshing), **self.stats}
+
+
+admin_cache = AdminCache()
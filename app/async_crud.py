@@ -0,0 +1,70 @@
+"""只在异步路径上使用的查询和写入（AsyncSession），供采集、监听和异步接口使用
+
+同步、异步两边都用到的查询只在 crud 中实现一份，异步代码通过 await db.run_sync(crud.xxx, ...) 调用，
+在同一个异步连接上执行，不阻塞事件循环；这里只保留没有同步调用方的任务、断点和会话实体查询。
+"""
+from __future__ import annotations
+
+import json
+from typing import Iterable
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import CollectionJob, CollectionCheckpoint, PeerEntity
+from .crud import JOB_PENDING_STATUSES
+
+
+# Peers
+async def get_peers(db: AsyncSession, account_id: int, peer_ids: Iterable[int]) -> dict[int, PeerEntity]:
+    ids = list(peer_ids)
+    if not ids:
+        return {}
+    q = select(PeerEntity).where(PeerEntity.account_id == account_id, PeerEntity.peer_id.in_(ids))
+    return {int(p.peer_id): p for p in (await db.execute(q)).scalars()}
+
+
+# Jobs
+async def create_job(db: AsyncSession, account_ids: list[int], days: int, dedup_key: str) -> CollectionJob:
+    job = CollectionJob(account_ids=json.dumps(sorted(account_ids)), days=days, dedup_key=dedup_key, status="queued")
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def find_pending_job(db: AsyncSession, dedup_key: str) -> CollectionJob | None:
+    q = select(CollectionJob).where(
+        CollectionJob.dedup_key == dedup_key,
+        CollectionJob.status.in_(JOB_PENDING_STATUSES),
+    ).order_by(CollectionJob.id)
+    return (await db.execute(q)).scalars().first()
+
+
+async def list_jobs_by_status(db: AsyncSession, statuses: Iterable[str]) -> list[CollectionJob]:
+    q = select(CollectionJob).where(CollectionJob.status.in_(list(statuses))).order_by(CollectionJob.id)
+    return list((await db.execute(q)).scalars())
+
+
+async def update_job(db: AsyncSession, job_id: int, **fields) -> CollectionJob | None:
+    job = await db.get(CollectionJob, job_id)
+    if not job:
+        return None
+    for k, v in fields.items():
+        if hasattr(job, k):
+            setattr(job, k, v)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+# Checkpoints
+async def list_checkpoints(db: AsyncSession, job_id: int, account_id: int) -> list[CollectionCheckpoint]:
+    q = select(CollectionCheckpoint).where(CollectionCheckpoint.job_id == job_id, CollectionCheckpoint.account_id == account_id)
+    return list((await db.execute(q)).scalars())
+
+
+async def delete_checkpoints(db: AsyncSession, job_id: int) -> int:
+    res = await db.execute(delete(CollectionCheckpoint).where(CollectionCheckpoint.job_id == job_id))
+    await db.commit()
+    return res.rowcount or 0
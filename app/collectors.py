@@ -1,15 +1,52 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List
-from telethon import types, errors
-from telethon.tl.types import Channel, Chat, ChannelParticipantsAdmins
+from typing import Dict, FrozenSet, List
+from telethon import types, errors, functions
+from telethon.utils import get_input_peer, get_peer_id
+from telethon.tl.types import Channel, Chat
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from .config import get_settings
 from .tele_client import get_client_for_account
-from .models import Account, SelectedGroup, CollectionProgress
-from . import crud
+from .models import Account, SelectedGroup, CollectionProgress, async_session
+from .ingest import IngestBuffer
+from .pipeline import AccountPipeline
+from .senders import get_sender_resolver
+from .governor import RateGovernor, get_governor
+from .concurrency import get_limiter
+from .admins import admin_cache
+from .peers import peer_store, canonical_peer_id, is_channel_peer
+from .planner import estimate_chat_costs, plan_collection
+from .quarantine import filter_blocked, is_access_error, record_failure, record_success
+from .utils import ensure_utc
+from .writer import run_read, run_write, write_in_background, BACKFILL
+from . import async_crud, crud
+
+# 与 Telethon 单次 GetHistory / GetDialogs 的条数一致
+PAGE_SIZE = 100
+DIALOG_PAGE_SIZE = 100
+# FloodWait 按方法计，按这两个方法名向调节器申请配额/暂停
+HISTORY_METHOD = "GetHistoryRequest"
+DIALOGS_METHOD = "GetDialogsRequest"
+# messages.GetPeerDialogs 单次最多查询的群数
+PEER_DIALOGS_BATCH = 100
+# 单个群一次采集中最多容忍的 FloodWait 次数
+MAX_FLOOD_RETRIES = 5
+# 估算日消息量所需的最短观测时长（天）
+MIN_RATE_SPAN_DAYS = 1 / 24
+# 采集过程中进度写库的最短间隔（秒）
+PROGRESS_INTERVAL = 2.0
+
+def _new_sync_session() -> Session:
+    from . import models
+    models._init_engine_and_session()
+    return models.SessionLocal()
+
 
 # 全局进度跟踪（保留用于向后兼容）
 collection_progress: Dict[str, Dict] = {}
@@ -18,10 +55,25 @@ def get_progress_key(account_id: int) -> str:
     """获取进度跟踪的键"""
     return f"account_{account_id}"
 
-def update_progress(account_id: int, current_group: int, total_groups: int, group_name: str = "", status: str = "collecting"):
-    """更新采集进度 - 同时更新内存和数据库"""
+def update_progress(
+    account_id: int,
+    current_group: int,
+    total_groups: int,
+    group_name: str = "",
+    status: str = "collecting",
+    cost_done: float | None = None,
+    cost_total: float | None = None,
+    eta_seconds: int | None = None,
+):
+    """更新采集进度 - 同时更新内存和数据库
+
+    给出 cost_done/cost_total（按预计消息量）时百分比按消息量计算，而不是按群个数。
+    """
     key = get_progress_key(account_id)
-    percentage = int((current_group / total_groups) * 100) if total_groups > 0 else 0
+    if cost_total:
+        percentage = min(100, int(cost_done * 100 / cost_total))
+    else:
+        percentage = int((current_group / total_groups) * 100) if total_groups > 0 else 0
     
     # 更新内存状态（向后兼容）
     collection_progress[key] = {
@@ -31,53 +83,51 @@ def update_progress(account_id: int, current_group: int, total_groups: int, grou
         "percentage": percentage,
         "group_name": group_name,
         "status": status,
+        "cost_done": round(cost_done, 1) if cost_done is not None else None,
+        "cost_total": round(cost_total, 1) if cost_total is not None else None,
+        "eta_seconds": eta_seconds,
         "updated_at": datetime.now().isoformat()
     }
     
     # 更新数据库状态
-    update_progress_db(account_id, current_group, total_groups, group_name, status)
+    update_progress_db(account_id, current_group, total_groups, group_name, status, percentage)
 
-def update_progress_db(account_id: int, current_group: int, total_groups: int, group_name: str = "", status: str = "collecting"):
-    """更新数据库中的采集进度"""
-    from .models import _init_engine_and_session, SessionLocal
-    
+def update_progress_db(account_id: int, current_group: int, total_groups: int, group_name: str = "", status: str = "collecting", percentage: int | None = None):
+    """更新数据库中的采集进度（交给写线程的后台队列，不阻塞事件循环）"""
+    if percentage is None:
+        percentage = int((current_group / total_groups) * 100) if total_groups > 0 else 0
     try:
-        # 确保数据库引擎已初始化
-        _init_engine_and_session()
-        db = SessionLocal()
-        
-        try:
-            percentage = int((current_group / total_groups) * 100) if total_groups > 0 else 0
-            
-            # 查找或创建进度记录
-            progress = db.query(CollectionProgress).filter(CollectionProgress.account_id == account_id).first()
-            
-            if progress:
-                # 更新现有记录
-                progress.current_group = current_group
-                progress.total_groups = total_groups
-                progress.percentage = percentage
-                progress.group_name = group_name
-                progress.status = status
-                progress.updated_at = datetime.now(timezone.utc)
-            else:
-                # 创建新记录
-                progress = CollectionProgress(
-                    account_id=account_id,
-                    current_group=current_group,
-                    total_groups=total_groups,
-                    percentage=percentage,
-                    group_name=group_name,
-                    status=status
-                )
-                db.add(progress)
-            
-            db.commit()
-        finally:
-            db.close()
+        write_in_background(_save_progress, account_id, current_group, total_groups, group_name, status, percentage)
     except Exception as e:
         print(f"❌ 更新数据库进度失败: {e}")
 
+
+def _save_progress(db: Session, account_id: int, current_group: int, total_groups: int, group_name: str, status: str, percentage: int) -> None:
+    # 查找或创建进度记录
+    progress = db.query(CollectionProgress).filter(CollectionProgress.account_id == account_id).first()
+    
+    if progress:
+        # 更新现有记录
+        progress.current_group = current_group
+        progress.total_groups = total_groups
+        progress.percentage = percentage
+        progress.group_name = group_name
+        progress.status = status
+        progress.updated_at = datetime.now(timezone.utc)
+    else:
+        # 创建新记录
+        progress = CollectionProgress(
+            account_id=account_id,
+            current_group=current_group,
+            total_groups=total_groups,
+            percentage=percentage,
+            group_name=group_name,
+            status=status
+        )
+        db.add(progress)
+    
+    db.commit()
+
 def get_progress(account_id: int) -> Dict:
     """获取采集进度 - 优先从数据库获取"""
     from .models import _init_engine_and_session, SessionLocal
@@ -91,7 +141,7 @@ def get_progress(account_id: int) -> Dict:
             progress = db.query(CollectionProgress).filter(CollectionProgress.account_id == account_id).first()
             
             if progress:
-                return {
+                data = {
                     "account_id": progress.account_id,
                     "current_group": progress.current_group,
                     "total_groups": progress.total_groups,
@@ -100,6 +150,11 @@ def get_progress(account_id: int) -> Dict:
                     "status": progress.status,
                     "updated_at": progress.updated_at.isoformat()
                 }
+                # 预计消息量与剩余时间只保存在内存中
+                mem = collection_progress.get(get_progress_key(account_id)) or {}
+                for k in ("cost_done", "cost_total", "eta_seconds"):
+                    data[k] = mem.get(k)
+                return data
         finally:
             db.close()
     except Exception as e:
@@ -127,91 +182,389 @@ def clear_progress(account_id: int):
     clear_progress_db(account_id)
 
 def clear_progress_db(account_id: int):
-    """清除数据库中的采集进度"""
-    from .models import _init_engine_and_session, SessionLocal
-    
+    """清除数据库中的采集进度（与进度更新同一队列，保证在其之后执行）"""
     try:
-        # 确保数据库引擎已初始化
-        _init_engine_and_session()
-        db = SessionLocal()
-        
-        try:
-            progress = db.query(CollectionProgress).filter(CollectionProgress.account_id == account_id).first()
-            if progress:
-                db.delete(progress)
-                db.commit()
-        finally:
-            db.close()
+        write_in_background(_delete_progress, account_id)
     except Exception as e:
         print(f"❌ 清除数据库进度失败: {e}")
 
 
-async def refresh_groups_for_account(account_id: int, db: Session) -> dict:
-    acc = db.get(Account, account_id)
+def _delete_progress(db: Session, account_id: int) -> None:
+    progress = db.query(CollectionProgress).filter(CollectionProgress.account_id == account_id).first()
+    if progress:
+        db.delete(progress)
+        db.commit()
+
+
+def record_dialog_metadata(db: Session, chat_id: int, ent, top_msg) -> None:
+    """刷新群组时记录成员数和最新消息；超级群按两次刷新间最新消息ID的增量估算日消息量"""
+    is_channel = isinstance(ent, Channel)
+    top_id = int(top_msg.id) if top_msg is not None and getattr(top_msg, "id", None) else None
+    top_date = ensure_utc(top_msg.date) if top_id and getattr(top_msg, "date", None) else None
+    rate = None
+    if is_channel and top_id and top_date:
+        prev = crud.get_chat_metadata(db, [chat_id]).get(chat_id)
+        if prev is not None and prev.top_message_id and prev.top_message_date and top_id > prev.top_message_id:
+            span = (top_date - ensure_utc(prev.top_message_date)).total_seconds() / 86400
+            if span >= MIN_RATE_SPAN_DAYS:
+                rate = (top_id - prev.top_message_id) / span
+    crud.upsert_chat_metadata(
+        db,
+        chat_id,
+        is_channel=is_channel,
+        participants_count=getattr(ent, "participants_count", None),
+        # 普通群的消息ID是每个账号各自的，不记录
+        top_message_id=top_id if is_channel else None,
+        top_message_date=top_date if is_channel else None,
+        observed_rate=rate,
+    )
+
+
+def observed_rate(cov, start_utc: datetime, run_started: datetime, counts: Dict[str, int], completed: set[str]) -> float | None:
+    """由本次完整扫描的区间计算日消息量：整窗区间按整个窗口，向后增量按上次覆盖终点到现在"""
+    if "full" in completed:
+        span_start, n = start_utc, counts.get("full", 0)
+    elif "forward" in completed and cov is not None:
+        span_start, n = ensure_utc(cov.covered_until), counts.get("forward", 0)
+    else:
+        return None
+    span = (run_started - span_start).total_seconds() / 86400
+    if span < MIN_RATE_SPAN_DAYS:
+        return None
+    return n / span
+
+
+async def refresh_groups_for_account(account_id: int, db: AsyncSession) -> dict:
+    acc = await db.get(Account, account_id)
     if not acc:
         return {"error": "account not found"}
     client = await get_client_for_account(acc)
+    governor = get_governor(account_id)
     inserted = 0
     titles: List[str] = []
-    async for d in client.iter_dialogs():
-        # 仅保留真正的群/大群对话，避免误收录浏览过的公开频道
-        if not getattr(d, "is_group", False):
-            continue
-        ent = d.entity
-        # 排除已离开的群
-        if hasattr(ent, "left") and getattr(ent, "left"):
-            continue
-        chat_id = getattr(ent, "id", None)
-        title = getattr(ent, "title", "")
-        if chat_id is None:
-            continue
-        crud.upsert_group(db, account_id=acc.id, chat_id=int(chat_id), title=title or str(chat_id))
-        inserted += 1
-        titles.append(title)
-        await asyncio.sleep(0.05)
+    seen: set[int] = set()
+    # 旧版本保存的是未标记的正数ID，刷新时改写为带标记的ID
+    legacy_ids = {int(g.chat_id) for g in await db.run_sync(crud.list_groups_for_account, account_id) if int(g.chat_id) > 0}
+    for attempt in range(2):
+        try:
+            await governor.acquire(method=DIALOGS_METHOD)
+            dialog_count = 0
+            async for d in client.iter_dialogs():
+                dialog_count += 1
+                if dialog_count % DIALOG_PAGE_SIZE == 0:
+                    # iter_dialogs 每页 100 个对话，按页向调节器申请配额
+                    governor.on_success()
+                    await governor.acquire(method=DIALOGS_METHOD)
+                # 仅保留真正的群/大群对话，避免误收录浏览过的公开频道
+                if not getattr(d, "is_group", False):
+                    continue
+                ent = d.entity
+                # 排除已离开的群
+                if hasattr(ent, "left") and getattr(ent, "left"):
+                    continue
+                raw_id = getattr(ent, "id", None)
+                title = getattr(ent, "title", "")
+                if raw_id is None:
+                    continue
+                chat_id = canonical_peer_id(ent)
+                if chat_id in seen:
+                    continue
+                # 保存类型和 access_hash，之后解析该群只查本地
+                await peer_store.remember(account_id, ent)
+                if int(raw_id) in legacy_ids:
+                    await run_write(crud.migrate_chat_id, acc.id, int(raw_id), chat_id, priority=BACKFILL)
+                    legacy_ids.discard(int(raw_id))
+                await run_write(crud.upsert_group, acc.id, chat_id, title or str(chat_id), priority=BACKFILL)
+                try:
+                    await run_write(record_dialog_metadata, chat_id, ent, getattr(d, "message", None), priority=BACKFILL)
+                except Exception as e:
+                    print(f"⚠️ 记录群 {chat_id} 元数据失败: {e}")
+                seen.add(chat_id)
+                inserted += 1
+                titles.append(title)
+            governor.on_success()
+            break
+        except errors.FloodWaitError as e:
+            # 已写入的群保留，等待限流结束后重新遍历一次
+            governor.on_flood_wait(e.seconds, e, DIALOGS_METHOD)
+            if attempt > 0:
+                raise
     return {"count": inserted, "titles": titles}
 
 
-async def list_admin_user_ids(client, chat_id: int) -> set[int]:
+async def resolve_group_entity(client, chat_id: int, governor: RateGovernor | None = None, account_id: int | None = None):
+    """按 chat_id 获取群组实体
+
+    指定 account_id 时先查该账号的实体表（peer_store），命中直接返回 InputPeer，不发网络请求；
+    未命中再联网获取（正数ID失败时尝试Channel的负数ID格式），成功后写入实体表。
+    """
+    if account_id is not None:
+        peer = await peer_store.lookup(account_id, chat_id)
+        if peer is not None:
+            return peer
+    entity = await _fetch_group_entity(client, chat_id, governor)
+    if entity is not None and account_id is not None:
+        await peer_store.remember(account_id, entity)
+    return entity
+
+
+async def _fetch_group_entity(client, chat_id: int, governor: RateGovernor | None = None):
+    """联网获取群组实体；两种ID格式都确认无权访问或不存在时返回 None，网络错误等临时错误直接抛出"""
+    async def get_entity(peer_id: int):
+        if governor is None:
+            return await client.get_entity(peer_id)
+        return await governor.call(client.get_entity, peer_id)
+
+    if chat_id <= 0:
+        # 负数ID直接访问
+        return await get_entity(chat_id)
     try:
-        # 对于正数ID，尝试使用负数格式访问Channel类型群组
-        entity = None
-        if chat_id > 0:
-            try:
-                # 先尝试直接访问
-                entity = await client.get_entity(chat_id)
-            except Exception:
-                # 如果失败，尝试使用Channel的负数ID格式
-                try:
-                    negative_id = -1000000000000 - chat_id
-                    entity = await client.get_entity(negative_id)
-                except Exception:
-                    pass
-        else:
-            # 负数ID直接访问
-            entity = await client.get_entity(chat_id)
-            
-        if not entity:
-            return set()
-    except Exception:
-        return set()
-    admin_ids: set[int] = set()
+        # 先尝试直接访问
+        return await get_entity(chat_id)
+    except Exception as e:
+        if not is_access_error(e):
+            raise
+        print(f"  ❌ 直接访问 {chat_id} 失败: {e}")
+    # 如果失败，尝试使用Channel的负数ID格式
+    negative_id = -1000000000000 - chat_id
     try:
-        if isinstance(entity, Channel):
-            admins = await client.get_participants(entity, filter=ChannelParticipantsAdmins())
-            for a in admins:
-                admin_ids.add(int(a.id))
-        # For Chat, Telethon doesn't provide admin list easily; skip.
-    except errors.FloodWaitError as e:
-        await asyncio.sleep(e.seconds + 1)
-    except Exception:
-        pass
-    return admin_ids
-
-
-async def collect_for_account(account_id: int, days: int, db: Session) -> dict:
+        return await get_entity(negative_id)
+    except Exception as e:
+        if not is_access_error(e):
+            raise
+        print(f"  ❌ 负数ID {negative_id} 访问也失败: {e}")
+    return None
+
+
+async def list_admin_user_ids(client, chat_id: int, governor: RateGovernor | None = None, entity=None) -> FrozenSet[int]:
+    """群管理员ID集合，经由 admin_cache（内存 + 表，过期后台刷新）"""
+    return await admin_cache.get(client, chat_id, governor, entity)
+
+
+def plan_missing_ranges(cov, start_utc: datetime) -> List[tuple[str, dict]]:
+    """根据已覆盖区间计算本次需要拉取的区间（均按消息ID升序遍历）
+
+    - 无覆盖记录，或上次覆盖已早于本次窗口起点：整窗采集
+    - 窗口起点早于已覆盖起点：向前补采 [start_utc, min_message_id)
+    - 总是向后增量采集 (max_message_id, 最新]
+    """
+    if cov is None or cov.max_message_id is None or ensure_utc(cov.covered_until) < start_utc:
+        return [("full", {"offset_date": start_utc})]
+    ranges: List[tuple[str, dict]] = []
+    if start_utc < ensure_utc(cov.covered_from) and cov.min_message_id:
+        ranges.append(("backfill", {"offset_date": start_utc, "max_id": int(cov.min_message_id)}))
+    ranges.append(("forward", {"min_id": int(cov.max_message_id)}))
+    return ranges
+
+
+def update_coverage(
+    db: Session,
+    account_id: int,
+    chat_id: int,
+    cov,
+    start_utc: datetime,
+    run_started: datetime,
+    scanned: Dict[str, list],
+    completed: set[str],
+) -> None:
+    """把本次采集结果合并进覆盖区间
+
+    scanned: 区间名 -> [最小消息ID, 最大消息ID, 最大消息时间]
+    升序遍历被中断时，已遍历的部分仍是从区间起点开始的连续前缀，可以记录到最后一条消息为止；
+    只有向前补采被中断时会与已有区间之间留下空洞，此时不扩展起点。
+    """
+    if "full" in scanned or "full" in completed:
+        lo, hi, hi_date = scanned.get("full", [None, None, None])
+        until = run_started if "full" in completed else hi_date
+        crud.save_coverage(db, account_id, chat_id, lo, hi, start_utc, until)
+        return
+    if cov is None:
+        return
+    lo = cov.min_message_id
+    hi = cov.max_message_id
+    covered_from = ensure_utc(cov.covered_from)
+    covered_until = ensure_utc(cov.covered_until)
+    if "backfill" in completed:
+        covered_from = start_utc
+        if "backfill" in scanned:
+            lo = scanned["backfill"][0]
+    if "forward" in completed:
+        covered_until = run_started
+    if "forward" in scanned:
+        hi = max(hi or 0, scanned["forward"][1])
+        if "forward" not in completed:
+            covered_until = max(covered_until, scanned["forward"][2])
+    crud.save_coverage(db, account_id, chat_id, lo, hi, covered_from, covered_until)
+
+
+def dump_checkpoint_state(scanned: Dict[str, list], completed: set[str]) -> str:
+    return json.dumps({
+        "scanned": {name: [lo, hi, hi_date.isoformat()] for name, (lo, hi, hi_date) in scanned.items()},
+        "completed": sorted(completed),
+    })
+
+
+def load_checkpoint_state(state: str | None) -> tuple[Dict[str, list], set[str]]:
+    if not state:
+        return {}, set()
+    data = json.loads(state)
+    scanned = {name: [lo, hi, ensure_utc(datetime.fromisoformat(d))] for name, (lo, hi, d) in data.get("scanned", {}).items()}
+    return scanned, set(data.get("completed", []))
+
+
+def resume_kwargs(kwargs: dict, last_id: int) -> dict:
+    """区间从 last_id 之后继续；按 min_id 升序遍历时不再需要 offset_date（窗口由过滤阶段判断）"""
+    kwargs = dict(kwargs)
+    kwargs["min_id"] = max(int(kwargs.get("min_id") or 0), int(last_id))
+    kwargs.pop("offset_date", None)
+    return kwargs
+
+
+def resume_ranges(ranges: List[tuple[str, dict]], scanned: Dict[str, list], completed: set[str]) -> List[tuple[str, dict]]:
+    """按断点裁剪待采集区间：跳过已完成的区间，未完成的区间从最后一条已落库消息之后继续"""
+    resumed: List[tuple[str, dict]] = []
+    for name, kwargs in ranges:
+        if name in completed:
+            continue
+        if name in scanned:
+            kwargs = resume_kwargs(kwargs, scanned[name][1])
+        resumed.append((name, kwargs))
+    return resumed
+
+
+def cached_input_peer(client, chat_id: int, is_channel: bool | None = None):
+    """只从会话缓存里取群的 InputPeer，不发网络请求；取不到返回 None"""
+    if chat_id < 0:
+        peers = [chat_id]
+    else:
+        peers = [types.PeerChannel(chat_id), types.PeerChat(chat_id)]
+        if is_channel is False:
+            peers.reverse()
+    for peer in peers:
+        try:
+            return client.session.get_input_entity(peer)
+        except (ValueError, TypeError, KeyError):
+            continue
+    return None
+
+
+async def prefilter_unchanged_chats(
+    client,
+    account_id: int,
+    chat_ids: List[int],
+    start_utc: datetime,
+    run_started: datetime,
+    governor: RateGovernor,
+) -> tuple[List[int], List[int]]:
+    """用 messages.GetPeerDialogs（每次最多 100 个群）批量取最新消息ID，跳过没有新消息的群
+
+    只有覆盖区间已包含本次窗口、只需向后增量、且最新消息ID不超过已入库最大消息ID的群会被跳过；
+    被跳过的群把覆盖终点推进到本次开始时间。会话缓存里取不到 InputPeer 的群照常采集。
+    返回 (需要采集的群, 跳过的群)。
+    """
+    # 只在查询期间占用连接，联网请求前归还
+    async with async_session() as db:
+        metadata = await db.run_sync(crud.get_chat_metadata, chat_ids)
+        coverage = {chat_id: await db.run_sync(crud.get_coverage, account_id, chat_id) for chat_id in chat_ids}
+    candidates: Dict[int, tuple] = {}  # 带标记的 peer id -> (chat_id, InputPeer, 覆盖区间)
+    for chat_id in chat_ids:
+        cov = coverage[chat_id]
+        if cov is None or [name for name, _ in plan_missing_ranges(cov, start_utc)] != ["forward"]:
+            continue
+        meta = metadata.get(chat_id)
+        peer = await peer_store.lookup(account_id, chat_id) or cached_input_peer(client, chat_id, meta.is_channel if meta is not None else None)
+        if peer is None:
+            continue
+        candidates[get_peer_id(peer)] = (chat_id, peer, cov)
+
+    skipped: List[int] = []
+    items = list(candidates.values())
+    for i in range(0, len(items), PEER_DIALOGS_BATCH):
+        chunk = items[i:i + PEER_DIALOGS_BATCH]
+        request = functions.messages.GetPeerDialogsRequest(peers=[types.InputDialogPeer(peer=p) for _, p, _ in chunk])
+        try:
+            result = await governor.call(client, request, retries=0, flood_sleep_threshold=0)
+        except Exception as e:
+            print(f"⚠️ 批量获取群最新消息失败，这些群照常采集: {e}")
+            continue
+        top_dates = {(get_peer_id(m.peer_id), m.id): m.date for m in result.messages if getattr(m, "peer_id", None) is not None}
+        for dialog in result.dialogs:
+            key = get_peer_id(dialog.peer)
+            if key not in candidates:
+                continue
+            chat_id, _, cov = candidates[key]
+            top_id = int(dialog.top_message)
+            if isinstance(dialog.peer, types.PeerChannel):
+                top_date = top_dates.get((key, top_id))
+                await run_write(
+                    crud.upsert_chat_metadata, chat_id, is_channel=True, top_message_id=top_id,
+                    top_message_date=ensure_utc(top_date) if top_date else None, priority=BACKFILL,
+                )
+            if top_id <= int(cov.max_message_id):
+                await run_write(crud.save_coverage, account_id, chat_id, cov.min_message_id, cov.max_message_id, ensure_utc(cov.covered_from), run_started, priority=BACKFILL)
+                skipped.append(chat_id)
+    skipped_set = set(skipped)
+    return [c for c in chat_ids if c not in skipped_set], skipped
+
+
+class FetchSource:
+    """抓取某个群历史消息所用的账号连接；故障转移时换成另一个账号的"""
+
+    def __init__(self, account_id: int, client, governor: RateGovernor, resolver, entity, input_chat):
+        self.account_id = account_id
+        self.client = client
+        self.governor = governor
+        self.resolver = resolver
+        self.entity = entity
+        self.input_chat = input_chat
+
+
+async def find_failover_source(chat_id: int, exclude: set[int]) -> FetchSource | None:
+    """找一个同在该群、GetHistory 没有被长时间限流的启用账号
+
+    只用于超级群/频道（Channel）：消息ID在群内全局一致，换账号后可以按 min_id 接着抓。
+    普通群的消息ID是每个账号各自的，不能转交。
+    """
+    settings = get_settings()
+    async with async_session() as db:
+        members = await db.run_sync(crud.list_member_accounts, chat_id)
+    candidates = [a for a in members if a.id not in exclude]
+    candidates.sort(key=lambda a: get_governor(a.id).remaining_pause(HISTORY_METHOD))
+    for acc in candidates:
+        governor = get_governor(acc.id)
+        if governor.remaining_pause(HISTORY_METHOD) >= settings.failover_min_wait:
+            break
+        try:
+            client = await get_client_for_account(acc)
+            entity = await resolve_group_entity(client, chat_id, governor, acc.id)
+        except Exception as e:
+            print(f"  ⚠️ 账号 {acc.id} 无法接管群 {chat_id}: {e}")
+            continue
+        if not is_channel_peer(entity):
+            continue
+        return FetchSource(acc.id, client, governor, get_sender_resolver(acc.id, client), entity, get_input_peer(entity))
+    return None
+
+
+async def collect_for_account(
+    account_id: int,
+    days: int,
+    control=None,
+    job_id: int | None = None,
+    chat_ids: List[int] | None = None,
+) -> dict:
+    """采集一个账号
+
+    数据库查询各用一个短暂的异步会话，查完即归还连接，联网期间不占用连接；写入都交给写线程。
+    control: 可选的任务控制对象（见 jobs.JobControl），每页抓取前等待其暂停状态解除
+    job_id: 所属采集任务；指定时按 (任务, 账号, 群) 记录断点，任务重跑时跳过已完成的群并从断点继续
+    chat_ids: 由采集规划分配给该账号的群；不指定时采集该账号选中的全部群
+    """
     print(f"🚀 开始采集账号 {account_id}，天数: {days}")
-    acc = db.get(Account, account_id)
+    async with async_session() as db:
+        acc = await db.get(Account, account_id)
+        if acc is not None and chat_ids is None:
+            chat_ids = [int(s.chat_id) for s in await db.run_sync(crud.list_selected_groups, account_id)]
     if not acc:
         print(f"❌ 账号 {account_id} 不存在")
         return {"error": "account not found"}
@@ -219,148 +572,375 @@ async def collect_for_account(account_id: int, days: int, db: Session) -> dict:
     print(f"📱 账号信息: {acc.name} ({acc.phone})")
     
     # 初始化进度
-    selected = crud.list_selected_groups(db, account_id)
-    total_groups = len(selected)
-    print(f"📊 找到 {total_groups} 个选中的群组")
+    total_groups = len(chat_ids)
+    print(f"📊 找到 {total_groups} 个待采集的群组")
     update_progress(account_id, 0, total_groups, "准备中...", "preparing")
     
     print(f"🔗 获取Telegram客户端...")
     client = await get_client_for_account(acc)
-    start_utc = datetime.now(timezone.utc) - timedelta(days=days)
+    run_started = datetime.now(timezone.utc)
+    start_utc = run_started - timedelta(days=days)
     print(f"📅 采集时间范围: {start_utc} 到现在")
     stats: Dict[str, int] = {"new_users": 0, "new_speaks": 0}
     per_group: Dict[int, int] = {}
+    # 写入阶段在写线程中执行；DB_WRITER 关闭时在线程池中使用这个独立的同步会话
+    write_db = _new_sync_session()
+    buffer = IngestBuffer(write_db, account_id)
+    pipeline = AccountPipeline(account_id, buffer)
+    governor = get_governor(account_id)
+    resolver = get_sender_resolver(account_id, client)
+    settings = get_settings()
+    group_sem = asyncio.Semaphore(max(1, settings.group_concurrency))
+    done_groups = 0
+    failovers: List[dict] = []
+    print(f"⚙️ 群组并发数: {settings.group_concurrency}")
+    async with async_session() as db:
+        checkpoints = {int(cp.chat_id): cp for cp in await async_crud.list_checkpoints(db, job_id, account_id)} if job_id is not None else {}
+        # 退避中或已隔离的群不再尝试；隔离到期的群在本次自动重试一次
+        chat_ids, blocked = await db.run_sync(filter_blocked, account_id, chat_ids, run_started)
+        failing = set(await db.run_sync(crud.get_chat_failures, account_id, chat_ids))
+        # 实体表命中时只有 InputPeer，没有标题，标题取刷新群组时保存的记录
+        titles = {int(g.chat_id): g.title for g in await db.run_sync(crud.list_groups_for_account, account_id)}
+    if checkpoints:
+        print(f"♻️ 从断点恢复: {sum(1 for cp in checkpoints.values() if cp.is_done)} 个群已完成，{sum(1 for cp in checkpoints.values() if not cp.is_done)} 个群未完成")
+
+    if blocked:
+        total_groups = len(chat_ids)
+        print(f"🚫 {len(blocked)} 个群访问失败后处于退避/隔离中，跳过；剩余 {total_groups} 个群")
+
+    skipped_unchanged: List[int] = []
+    if settings.prefilter_unchanged and chat_ids:
+        # 有断点的群上次未完成，不参与预筛
+        pending = [c for c in chat_ids if c not in checkpoints]
+        try:
+            _, skipped_unchanged = await prefilter_unchanged_chats(client, account_id, pending, start_utc, run_started, governor)
+        except Exception as e:
+            print(f"⚠️ 预筛无新消息的群失败，全部照常采集: {e}")
+        if skipped_unchanged:
+            skip = set(skipped_unchanged)
+            chat_ids = [c for c in chat_ids if c not in skip]
+            total_groups = len(chat_ids)
+            print(f"⏭️ {len(skipped_unchanged)} 个群没有新消息，跳过；剩余 {total_groups} 个群")
 
-    for i, s in enumerate(selected):
-        chat_id = int(s.chat_id)
+    # 按预计消息量从大到小开始，避免最大的群最后才开始、拖长整体完成时间
+    # 估算会并行查询各分片，在线程中执行，不阻塞事件循环
+    costs = await run_read(estimate_chat_costs, account_id, chat_ids, days, run_started)
+    chat_ids = sorted(chat_ids, key=lambda c: costs[c], reverse=True)
+    total_cost = sum(costs.values())
+    cost_done: Dict[int, float] = {}
+    last_report = 0.0
+
+    def report(group_name: str, force: bool = True) -> None:
+        """按已完成的预计消息量更新进度与剩余时间；采集过程中的更新限频"""
+        nonlocal last_report
+        now = time.monotonic()
+        if not force and now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        done = sum(cost_done.values())
+        elapsed = (datetime.now(timezone.utc) - run_started).total_seconds()
+        eta = int(elapsed * (total_cost - done) / done) if done > 0 else None
+        update_progress(account_id, done_groups, total_groups, group_name, "collecting", done, total_cost, eta)
+
+    async def collect_group(i: int, chat_id: int):
+        nonlocal done_groups
+        cp = checkpoints.get(chat_id)
+        if cp is not None and cp.is_done:
+            done_groups += 1
+            cost_done[chat_id] = costs[chat_id]
+            report(f"群组 {chat_id}")
+            return
+        async with group_sem:
+            try:
+                await collect_one_group(i, chat_id, cp)
+            except Exception as e:
+                # 单个群出错（如数据库连接超时）只跳过该群，不中止整个账号
+                print(f"  ❌ 群 {chat_id} 采集失败，跳过: {e}")
+            finally:
+                done_groups += 1
+                cost_done[chat_id] = costs[chat_id]
+                report(f"群组 {chat_id}")
+
+    async def collect_one_group(i: int, chat_id: int, cp=None):
         group_name = f"群组 {chat_id}"
-        
-        print(f"🔄 处理群组 {i+1}/{total_groups}: {chat_id}")
-        
+        print(f"🔄 处理群组 {i+1}/{total_groups}: {chat_id}（预计 {costs[chat_id]:.0f} 条）")
+
         # 更新进度
-        update_progress(account_id, i, total_groups, group_name, "collecting")
-        
+        report(group_name)
+
         try:
             print(f"🔍 尝试获取群组实体: {chat_id}")
-            # 对于正数ID，尝试使用负数格式访问Channel类型群组
-            entity = None
-            if chat_id > 0:
-                try:
-                    # 先尝试直接访问
-                    print(f"  📞 直接访问 {chat_id}")
-                    entity = await client.get_entity(chat_id)
-                    print(f"  ✅ 直接访问成功")
-                except Exception as e:
-                    print(f"  ❌ 直接访问失败: {e}")
-                    # 如果失败，尝试使用Channel的负数ID格式
-                    try:
-                        negative_id = -1000000000000 - chat_id
-                        print(f"  📞 尝试负数ID: {negative_id}")
-                        entity = await client.get_entity(negative_id)
-                        print(f"  ✅ 负数ID访问成功")
-                    except Exception as e2:
-                        print(f"  ❌ 负数ID访问也失败: {e2}")
-                        pass
-            else:
-                # 负数ID直接访问
-                print(f"  📞 负数ID直接访问: {chat_id}")
-                entity = await client.get_entity(chat_id)
-                print(f"  ✅ 负数ID访问成功")
-            
+            entity = await resolve_group_entity(client, chat_id, governor, account_id)
             if not entity:
                 print(f"  ⚠️ 无法获取群组实体，跳过")
-                # 减少群组访问失败时的等待时间
-                await asyncio.sleep(0.02)
-                continue
-                
+                await run_write(record_failure, account_id, chat_id, "无法解析群组实体", priority=BACKFILL)
+                return
+            if getattr(entity, "left", False):
+                print(f"  ⚠️ 账号已退出该群，跳过")
+                await run_write(record_failure, account_id, chat_id, "账号已退出该群", priority=BACKFILL)
+                return
+
             # 尝试获取群组标题
-            if hasattr(entity, 'title') and entity.title:
-                group_name = entity.title
+            title = getattr(entity, "title", None) or titles.get(chat_id)
+            if title:
+                group_name = title
                 print(f"  📝 群组标题: {group_name}")
-                update_progress(account_id, i, total_groups, group_name, "collecting")
+                report(group_name)
+        except errors.FloodWaitError as e:
+            print(f"  ⏳ 获取群组实体触发 FloodWait {e.seconds} 秒，跳过该群")
+            return
         except Exception as e:
+            # 只有确认无权访问才计入失败；网络错误等临时问题本次跳过，下次照常采集
             print(f"  ❌ 获取群组信息失败: {e}")
-            # 减少群组标题获取失败时的等待时间
-            await asyncio.sleep(0.02)
-            continue
-        
+            if is_access_error(e):
+                await run_write(record_failure, account_id, chat_id, str(e) or type(e).__name__, priority=BACKFILL)
+            return
+
         print(f"  👥 获取管理员列表...")
-        admin_ids = await list_admin_user_ids(client, chat_id)
+        admin_ids = await list_admin_user_ids(client, chat_id, governor, entity)
         print(f"  👥 找到 {len(admin_ids)} 个管理员")
         per_group[chat_id] = 0
 
-        try:
-            print(f"  📨 开始遍历消息...")
-            message_count = 0
-            async for msg in client.iter_messages(entity, offset_date=start_utc, reverse=True):
-                message_count += 1
-                if message_count % 100 == 0:
-                    print(f"    📊 已处理 {message_count} 条消息")
-                
-                if not msg:
-                    continue
-                # ensure date in window
-                if msg.date is None:
-                    continue
+        async with async_session() as db:
+            cov = await db.run_sync(crud.get_coverage, account_id, chat_id)
+        ranges = plan_missing_ranges(cov, start_utc)
+        print(f"  🧭 待采集区间: {[name for name, _ in ranges] or '无'}")
+        scanned: Dict[str, list] = {}  # 区间名 -> [最小消息ID, 最大消息ID, 最大消息时间]
+        completed: set[str] = set()
+        cp_scanned, cp_completed = load_checkpoint_state(cp.state) if cp is not None else ({}, set())
+        # 断点中的区间须与本次规划一致；覆盖区间已在中断前更新时断点作废，按新规划采集
+        if (cp_scanned or cp_completed) and set(cp_scanned) | cp_completed <= {name for name, _ in ranges}:
+            scanned, completed = cp_scanned, cp_completed
+            ranges = resume_ranges(ranges, scanned, completed)
+            print(f"  ♻️ 从断点继续: 消息ID {cp.last_message_id}，剩余区间 {[name for name, _ in ranges] or '无'}")
+        since_checkpoint = 0
+        range_counts: Dict[str, int] = {}
+
+        source = FetchSource(account_id, client, governor, resolver, entity, get_input_peer(entity))
+        tried: set[int] = {account_id}
+        access_error: tuple[int, str] | None = None  # (账号, 错误)：抓取时发现账号已无权访问该群
+
+        async def fetch_pages():
+            """抓取阶段：按区间升序拉取历史消息，每 PAGE_SIZE 条产出一页
+
+            FloodWait 后从最后一条已抓取的消息继续该区间，不放弃剩余部分；
+            限流时间较长时把剩余区间交给同在该群的其他账号抓取（见 find_failover_source）。
+            """
+            nonlocal source, access_error
+            floods = 0
+            for range_name, range_kwargs in ranges:
+                kwargs = dict(range_kwargs)
+                print(f"  📨 开始遍历消息 ({range_name})...")
+                while True:
+                    src = source
+                    page: list = []
+                    last_id = None
+                    try:
+                        message_count = 0
+                        # 每页历史消息是一次 GetHistory 请求，先向调节器申请配额
+                        if control is not None:
+                            await control.wait_if_paused()
+                        await src.governor.acquire(method=HISTORY_METHOD)
+                        async for msg in src.client.iter_messages(src.entity, reverse=True, **kwargs):
+                            message_count += 1
+                            if not msg:
+                                continue
+                            # ensure date in window
+                            if msg.date is None:
+                                continue
+                            page.append(msg)
+                            last_id = int(msg.id)
+                            if len(page) < PAGE_SIZE:
+                                continue
+                            print(f"    📊 已处理 {message_count} 条消息")
+                            yield ("page", range_name, page, src)
+                            page = []
+                            src.governor.on_success()
+                            # 申请下一页的配额；账号的 GetHistory 被限流时该账号所有群都在这里暂停
+                            if control is not None:
+                                await control.wait_if_paused()
+                            await src.governor.acquire(method=HISTORY_METHOD)
+                        if page:
+                            yield ("page", range_name, page, src)
+                        src.governor.on_success()
+                        yield ("range_done", range_name, None, src)
+                        break
+                    except errors.FloodWaitError as e:
+                        src.governor.on_flood_wait(e.seconds, e, HISTORY_METHOD)
+                        if page:
+                            yield ("page", range_name, page, src)
+                        if last_id is not None:
+                            kwargs = resume_kwargs(kwargs, last_id)
+                        floods += 1
+                        if floods > MAX_FLOOD_RETRIES:
+                            print(f"  ❌ 群 {chat_id} 多次触发 FloodWait，停止本次采集")
+                            return
+                        if settings.floodwait_failover and e.seconds >= settings.failover_min_wait and is_channel_peer(entity):
+                            substitute = await find_failover_source(chat_id, tried)
+                            if substitute is not None:
+                                print(f"  🔀 群 {chat_id} 的剩余区间 ({range_name}) 从账号 {src.account_id} 转交账号 {substitute.account_id}，自消息ID {kwargs.get('min_id')} 继续")
+                                tried.add(substitute.account_id)
+                                failovers.append({"chat_id": chat_id, "from": src.account_id, "to": substitute.account_id, "range": range_name, "min_id": kwargs.get("min_id")})
+                                source = substitute
+                                continue
+                        await src.governor.wait(HISTORY_METHOD)
+                    except Exception as e:
+                        # swallow per group errors to continue others
+                        print(f"  ❌ 遍历消息失败 ({range_name}): {e}")
+                        if is_access_error(e):
+                            access_error = (src.account_id, str(e) or type(e).__name__)
+                        return
+
+        async def process_page(item) -> List[dict]:
+            """过滤阶段：整页解析发送者（页内实体 -> LRU -> 批量 GetUsers），过滤机器人/管理员/窗口外消息"""
+            nonlocal since_checkpoint
+            kind, range_name, page, src = item
+            if kind == "range_done":
+                completed.add(range_name)
+                since_checkpoint = settings.checkpoint_every
+                return []
+            since_checkpoint += len(page)
+            range_counts[range_name] = range_counts.get(range_name, 0) + len(page)
+            # 群内进度按已扫描消息数推进，群结束前不超过该群预计量
+            cost_done[chat_id] = min(costs[chat_id] * 0.95, cost_done.get(chat_id, 0.0) + len(page))
+            report(group_name, force=False)
+            senders = await src.resolver.resolve(page, src.input_chat)
+            rows: List[dict] = []
+            for msg in page:
+                msg_id = int(getattr(msg, "id", 0))
                 msg_date = msg.date.astimezone(timezone.utc)
+                bounds = scanned.setdefault(range_name, [msg_id, msg_id, msg_date])
+                bounds[0] = min(bounds[0], msg_id)
+                if msg_id >= bounds[1]:
+                    bounds[1], bounds[2] = msg_id, msg_date
                 if msg_date < start_utc:
                     continue
-                try:
-                    sender = await msg.get_sender()
-                except Exception:
-                    continue
+                sender = senders.get(getattr(msg, "sender_id", None))
                 if not isinstance(sender, types.User):
                     continue
                 if bool(getattr(sender, "bot", False)):
                     continue
                 if int(sender.id) in admin_ids:
                     continue
-                username = sender.username
                 # 允许没有用户名的用户，不再跳过
-                # upsert user & insert speak
-                u = crud.upsert_user(
-                    db,
-                    tg_user_id=int(sender.id),
-                    username=username,  # 可以为None
-                    first_name=getattr(sender, "first_name", None),
-                    last_name=getattr(sender, "last_name", None),
-                    is_bot=bool(getattr(sender, "bot", False)),
-                )
-                inserted = crud.insert_speak(
-                    db,
-                    account_id=account_id,
-                    chat_id=chat_id,
-                    tg_user_id=int(sender.id),
-                    message_id=int(getattr(msg, "id", 0)),
-                    message_date=msg_date,
-                )
-                if inserted:
-                    stats["new_speaks"] += 1
-                    per_group[chat_id] += 1
+                rows.append({
+                    "chat_id": chat_id,
+                    "tg_user_id": int(sender.id),
+                    "username": sender.username,  # 可以为None
+                    "first_name": getattr(sender, "first_name", None),
+                    "last_name": getattr(sender, "last_name", None),
+                    "is_bot": bool(getattr(sender, "bot", False)),
+                    "message_id": msg_id,
+                    "message_date": msg_date,
+                })
                 stats["new_users"] += 1  # count seen user occurrences (approx)
-                # 减少消息处理间隔，提升采集速度
-                await asyncio.sleep(0.01)
-        except errors.FloodWaitError as e:
-            await asyncio.sleep(e.seconds + 1)
-        except Exception:
-            # swallow per group errors to continue others
-            await asyncio.sleep(0.05)
+            return rows
+
+        def checkpoint() -> dict | None:
+            """每扫描 checkpoint_every 条消息或完成一个区间时产出断点，随该页发言一起落库"""
+            nonlocal since_checkpoint
+            if job_id is None or since_checkpoint < settings.checkpoint_every or not scanned:
+                return None
+            since_checkpoint = 0
+            last_id = max(bounds[1] for bounds in scanned.values())
+            return {"job_id": job_id, "chat_id": chat_id, "last_message_id": last_id, "state": dump_checkpoint_state(scanned, completed)}
+
+        await pipeline.run_group(chat_id, fetch_pages(), process_page, checkpoint)
+
+        # 等待本群已提交的发言全部落库后再记录覆盖区间，保证区间内的消息都已入库
+        persisted = True
+        try:
+            await pipeline.barrier(chat_id)
+        except Exception as e:
+            # 有发言未能落库：不记录覆盖区间和完成断点，下次采集重新拉取这些消息
+            persisted = False
+            print(f"  ❌ 群 {chat_id} 有发言写入失败，不记录覆盖区间: {e}")
+        if persisted:
+            try:
+                await run_write(update_coverage, account_id, chat_id, cov, start_utc, run_started, scanned, completed, priority=BACKFILL)
+                # 断点续跑时本次只扫描了部分区间，不用于估算日消息量
+                rate = observed_rate(cov, start_utc, run_started, range_counts, completed) if cp is None else None
+                reached_top = bool({"full", "forward"} & completed)
+                top = max((scanned[name] for name in ("full", "forward") if name in scanned), key=lambda b: b[1], default=None)
+                is_channel = is_channel_peer(entity)
+                await run_write(
+                    crud.upsert_chat_metadata,
+                    chat_id,
+                    is_channel=is_channel,
+                    # InputPeer 和未带成员数的实体不更新已保存的成员数
+                    participants_count=getattr(entity, "participants_count", None) or None,
+                    top_message_id=top[1] if top and reached_top and is_channel else None,
+                    top_message_date=top[2] if top and reached_top and is_channel else None,
+                    observed_rate=rate,
+                    priority=BACKFILL,
+                )
+                if job_id is not None:
+                    done = all(name in completed for name, _ in ranges)
+                    last_id = max((bounds[1] for bounds in scanned.values()), default=None)
+                    await run_write(crud.save_checkpoints, [{
+                        "job_id": job_id,
+                        "account_id": account_id,
+                        "chat_id": chat_id,
+                        "last_message_id": last_id,
+                        "state": dump_checkpoint_state(scanned, completed),
+                        "is_done": done,
+                    }], priority=BACKFILL)
+            except Exception as e:
+                print(f"  ⚠️ 记录采集区间失败: {e}")
+
+        try:
+            if access_error is not None:
+                await run_write(record_failure, access_error[0], chat_id, access_error[1], priority=BACKFILL)
+            elif chat_id in failing:
+                await run_write(record_success, account_id, chat_id, priority=BACKFILL)
+        except Exception as e:
+            print(f"  ⚠️ 记录群 {chat_id} 访问状态失败: {e}")
+
+    pipeline.start()
+    try:
+        await asyncio.gather(*(collect_group(i, chat_id) for i, chat_id in enumerate(chat_ids)))
+    finally:
+        await pipeline.close()
+        write_db.close()
 
     # 完成进度
     update_progress(account_id, total_groups, total_groups, "采集完成", "completed")
     
+    stats["new_speaks"] = buffer.new_speaks
+    for cid in per_group:
+        per_group[cid] = buffer.per_chat.get(cid, 0)
     stats["per_group"] = per_group
+    stats["sender_resolution"] = dict(resolver.stats)
+    stats["seen_users"] = buffer.seen_users.snapshot()
+    stats["peers"] = peer_store.snapshot()
+    stats["governor"] = governor.snapshot()
+    stats["pipeline"] = pipeline.snapshot()
+    stats["failovers"] = failovers
+    stats["skipped_unchanged"] = skipped_unchanged
+    stats["blocked"] = blocked
     return stats
 
 
-async def collect_multi(accounts: List[int], days: int, db: Session, max_concurrency: int) -> dict:
-    sem = asyncio.Semaphore(max_concurrency)
+async def collect_multi(accounts: List[int], days: int, max_concurrency: int, control=None, job_id: int | None = None) -> dict:
+    # 同时采集的账号数由自适应控制器决定，max_concurrency 作为初始值
+    limiter = get_limiter(max_concurrency)
     results: Dict[int, dict] = {}
+    # 多个账号选中同一个群时只由一个账号采集，按预计消息量均衡分配
+    plan = None
+    if get_settings().plan_shared_chats:
+        plan = await run_read(plan_collection, accounts, days, job_id)
+    if plan is not None:
+        snap = plan.snapshot()
+        print(f"🗺️ 采集规划: {snap['chats']} 个群（{snap['shared_chats']} 个多账号共享），各账号预计负载 {snap['load']}")
 
     async def run_one(acc_id: int):
-        async with sem:
+        chat_ids = plan.chats_for(acc_id) if plan is not None else None
+        if plan is not None and not chat_ids:
+            results[acc_id] = {"new_users": 0, "new_speaks": 0, "per_group": {}}
+            return
+        async with limiter.slot():
             try:
-                res = await collect_for_account(acc_id, days, db)
+                res = await collect_for_account(acc_id, days, control, job_id, chat_ids)
                 results[acc_id] = res
             except Exception as e:
                 results[acc_id] = {"error": str(e)}
@@ -368,5 +948,10 @@ async def collect_multi(accounts: List[int], days: int, db: Session, max_concurr
                 # 清理进度信息
                 clear_progress(acc_id)
 
-    await asyncio.gather(*(run_one(a) for a in accounts))
-    return {"results": results}
\ No newline at end of file
+    async with limiter.running():
+        await asyncio.gather(*(run_one(a) for a in accounts))
+    return {
+        "results": results,
+        "concurrency": limiter.snapshot(),
+        "plan": plan.snapshot() if plan is not None else None,
+    }
\ No newline at end of file
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Deque, Dict, List
+
+from .config import get_settings
+
+# 事件循环延迟的采样间隔（秒）
+LAG_SAMPLE_INTERVAL = 0.5
+
+
+class AdaptiveLimiter:
+    """跨账号采集并发的自适应控制器
+
+    替代固定的 asyncio.Semaphore(MAX_CONCURRENCY)。每隔 interval 秒根据三个信号调整同时采集的账号数：
+    - 数据库批量写入延迟（p95）超过目标：乘性下降
+    - 事件循环延迟超过目标：乘性下降
+    - FloodWait 频率超过阈值：乘性下降
+    三者都健康且有账号在排队时加一。每次调整的原因记录在 history 中，供 API 查询。
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int | None = None,
+        max_limit: int | None = None,
+        interval: float | None = None,
+        adaptive: bool | None = None,
+    ):
+        settings = get_settings()
+        self.min_limit = max(1, min_limit if min_limit is not None else settings.concurrency_min)
+        self.max_limit = max(self.min_limit, max_limit if max_limit is not None else settings.concurrency_max)
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.interval = interval if interval is not None else settings.concurrency_adjust_interval
+        self.adaptive = settings.adaptive_concurrency if adaptive is None else adaptive
+        self.write_latency_target = settings.db_write_latency_target_ms / 1000
+        self.loop_lag_target = settings.loop_lag_target_ms / 1000
+        self.flood_wait_limit = settings.flood_wait_rate_limit
+        self.active = 0
+        self.waiting = 0
+        self._cond = asyncio.Condition()
+        self._write_latencies: List[float] = []
+        self._flood_waits = 0
+        self._max_lag = 0.0
+        self.last_signals: Dict = {}
+        self.history: Deque[Dict] = deque(maxlen=100)
+        self._task: asyncio.Task | None = None
+        self._runs = 0
+
+    # 信号上报
+    def record_write_latency(self, seconds: float) -> None:
+        self._write_latencies.append(seconds)
+
+    def record_flood_wait(self) -> None:
+        self._flood_waits += 1
+
+    # 并发槽位
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            self.waiting += 1
+            try:
+                await self._cond.wait_for(lambda: self.active < self.limit)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    async def set_limit(self, new_limit: int, reason: str) -> None:
+        new_limit = min(self.max_limit, max(self.min_limit, new_limit))
+        if new_limit == self.limit:
+            return
+        self.history.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "from": self.limit,
+            "to": new_limit,
+            "reason": reason,
+        })
+        print(f"🎚️ 采集并发 {self.limit} -> {new_limit}: {reason}")
+        async with self._cond:
+            self.limit = new_limit
+            self._cond.notify_all()
+
+    # 控制循环
+    @asynccontextmanager
+    async def running(self):
+        """采集批次期间运行控制循环；多个批次并存时共享一个循环"""
+        self._runs += 1
+        self.start()
+        try:
+            yield self
+        finally:
+            self._runs -= 1
+            if self._runs == 0:
+                await self.stop()
+
+    def start(self) -> None:
+        if self.adaptive and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_adjust = loop.time() + self.interval
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            self._max_lag = max(self._max_lag, loop.time() - start - LAG_SAMPLE_INTERVAL)
+            if loop.time() >= next_adjust:
+                next_adjust = loop.time() + self.interval
+                await self._adjust()
+
+    def _collect_signals(self) -> Dict:
+        latencies = sorted(self._write_latencies)
+        p95 = latencies[min(len(latencies) - 1, math.ceil(len(latencies) * 0.95) - 1)] if latencies else 0.0
+        floods_per_min = self._flood_waits * 60 / self.interval if self.interval else 0.0
+        signals = {
+            "db_write_p95_ms": round(p95 * 1000, 1),
+            "db_writes": len(latencies),
+            "loop_lag_ms": round(self._max_lag * 1000, 1),
+            "flood_waits_per_min": round(floods_per_min, 2),
+        }
+        self._write_latencies = []
+        self._flood_waits = 0
+        self._max_lag = 0.0
+        return signals
+
+    async def _adjust(self) -> None:
+        signals = self._collect_signals()
+        self.last_signals = signals
+        shrink = max(self.min_limit, int(self.limit * 0.75))
+        if signals["db_write_p95_ms"] > self.write_latency_target * 1000:
+            await self.set_limit(shrink, f"数据库写入 p95 {signals['db_write_p95_ms']}ms 超过目标 {self.write_latency_target * 1000:.0f}ms")
+        elif signals["loop_lag_ms"] > self.loop_lag_target * 1000:
+            await self.set_limit(shrink, f"事件循环延迟 {signals['loop_lag_ms']}ms 超过目标 {self.loop_lag_target * 1000:.0f}ms")
+        elif signals["flood_waits_per_min"] > self.flood_wait_limit:
+            await self.set_limit(shrink, f"FloodWait 频率 {signals['flood_waits_per_min']}/分钟 超过阈值 {self.flood_wait_limit}")
+        elif self.waiting > 0 and self.active >= self.limit:
+            await self.set_limit(self.limit + 1, f"各项指标正常且有 {self.waiting} 个账号排队")
+
+    def snapshot(self) -> Dict:
+        return {
+            "adaptive": self.adaptive,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "last_signals": self.last_signals,
+            "last_change": self.history[-1] if self.history else None,
+            "history": list(self.history),
+        }
+
+
+_limiter: AdaptiveLimiter | None = None
+
+
+def get_limiter(initial: int | None = None) -> AdaptiveLimiter:
+    """全局唯一的采集并发控制器；所有 collect_multi 调用共享"""
+    global _limiter
+    if _limiter is None:
+        _limiter = AdaptiveLimiter(initial if initial is not None else get_settings().max_concurrency)
+    return _limiter
+
+
+def get_concurrency_status() -> Dict:
+    if _limiter is None:
+        settings = get_settings()
+        return {"adaptive": settings.adaptive_concurrency, "limit": settings.max_concurrency, "active": 0, "waiting": 0, "history": []}
+    return _limiter.snapshot()
+
+
+def record_write_latency(seconds: float) -> None:
+    if _limiter is not None:
+        _limiter.record_write_latency(seconds)
+
+
+def record_flood_wait() -> None:
+    if _limiter is not None:
+        _limiter.record_flood_wait()
@@ -12,11 +12,63 @@ class Settings:
     host: str
     port: int
     max_concurrency: int
+    group_concurrency: int
+    adaptive_concurrency: bool
+    concurrency_min: int
+    concurrency_max: int
+    concurrency_adjust_interval: float
+    db_write_latency_target_ms: float
+    loop_lag_target_ms: float
+    flood_wait_rate_limit: float
     jwt_secret_key: str
     jwt_algorithm: str
     jwt_expire_minutes: int
     admin_username: str
     admin_password: str
+    ingest_batch_size: int
+    ingest_flush_interval: float
+    sender_cache_size: int
+    seen_users_cache_size: int
+    db_writer: bool
+    pipeline_page_queue: int
+    pipeline_write_queue: int
+    job_workers: int
+    checkpoint_every: int
+    plan_shared_chats: bool
+    admin_cache_ttl: int
+    prefilter_unchanged: bool
+    floodwait_failover: bool
+    failover_min_wait: int
+    chat_failure_backoff: int
+    chat_quarantine_after: int
+    chat_quarantine_recheck: int
+    governor_rate: float
+    governor_min_rate: float
+    governor_max_rate: float
+    governor_burst: float
+    governor_increase: float
+    tg_flood_sleep_threshold: int
+    sqlite_tuning: bool
+    sqlite_journal_mode: str
+    sqlite_synchronous: str
+    sqlite_busy_timeout_ms: int
+    sqlite_mmap_size: int
+    sqlite_cache_size: int
+    sqlite_temp_store: str
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_pre_ping: bool
+    db_pool_recycle: int
+    pg_copy_ingest: bool
+    pg_copy_min_rows: int
+    db_read_url: str
+    db_read_pool_size: int
+    read_query_timeout: float
+    speak_shards: bool
+    shard_dir: str
+    shard_read_workers: int
+    speak_daily_compact: bool
+    seen_messages_cache_size: int
 
 
 _settings: Settings | None = None
@@ -34,11 +86,68 @@ def get_settings() -> Settings:
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
     max_concurrency = int(os.getenv("MAX_CONCURRENCY", "2"))
+    group_concurrency = int(os.getenv("GROUP_CONCURRENCY", "4"))  # 单账号内同时采集的群数
+    # 跨账号并发自适应：MAX_CONCURRENCY 为初始值，在 [CONCURRENCY_MIN, CONCURRENCY_MAX] 内调整
+    adaptive_concurrency = os.getenv("ADAPTIVE_CONCURRENCY", "1").lower() in ("1", "true", "yes")
+    concurrency_min = int(os.getenv("CONCURRENCY_MIN", "1"))
+    concurrency_max = int(os.getenv("CONCURRENCY_MAX", "16"))
+    concurrency_adjust_interval = float(os.getenv("CONCURRENCY_ADJUST_INTERVAL", "10"))  # seconds
+    db_write_latency_target_ms = float(os.getenv("DB_WRITE_LATENCY_TARGET_MS", "250"))
+    loop_lag_target_ms = float(os.getenv("LOOP_LAG_TARGET_MS", "100"))
+    flood_wait_rate_limit = float(os.getenv("FLOOD_WAIT_RATE_LIMIT", "2"))  # 每分钟 FloodWait 次数上限
     jwt_secret_key = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
     jwt_algorithm = os.getenv("JWT_ALGORITHM", "HS256")
     jwt_expire_minutes = int(os.getenv("JWT_EXPIRE_MINUTES", "1440"))  # 24 hours
     admin_username = os.getenv("ADMIN_USERNAME", "admin")
     admin_password = os.getenv("ADMIN_PASSWORD", "9999")
+    ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    ingest_flush_interval = float(os.getenv("INGEST_FLUSH_INTERVAL", "2.0"))  # seconds
+    sender_cache_size = int(os.getenv("SENDER_CACHE_SIZE", "50000"))  # 每个账号缓存的发送者数
+    db_writer = os.getenv("DB_WRITER", "1").lower() in ("1", "true", "yes")  # 采集/监听/进度写入交给单独的写线程，按优先级串行执行
+    seen_users_cache_size = int(os.getenv("SEEN_USERS_CACHE_SIZE", "50000"))  # 每个账号记住的已落库用户数，未变化的用户不再写库
+    pipeline_page_queue = int(os.getenv("PIPELINE_PAGE_QUEUE", "4"))  # 每个群预取的历史页数
+    pipeline_write_queue = int(os.getenv("PIPELINE_WRITE_QUEUE", "16"))  # 每个账号待写入的批次数
+    plan_shared_chats = os.getenv("PLAN_SHARED_CHATS", "1").lower() in ("1", "true", "yes")  # 多账号共享的群每次只由一个账号采集
+    admin_cache_ttl = int(os.getenv("ADMIN_CACHE_TTL", "86400"))  # 群管理员列表缓存有效期（秒）
+    prefilter_unchanged = os.getenv("PREFILTER_UNCHANGED", "1").lower() in ("1", "true", "yes")  # 采集前批量检查最新消息ID，跳过没有新消息的群
+    floodwait_failover = os.getenv("FLOODWAIT_FAILOVER", "1").lower() in ("1", "true", "yes")  # 长时间 FloodWait 时把群的剩余区间转交其他账号
+    failover_min_wait = int(os.getenv("FAILOVER_MIN_WAIT", "60"))  # 触发转交的最短 FloodWait 秒数，更短的原地等待
+    chat_failure_backoff = int(os.getenv("CHAT_FAILURE_BACKOFF", "600"))  # 群访问失败后的首次重试间隔（秒），之后每次翻倍
+    chat_quarantine_after = int(os.getenv("CHAT_QUARANTINE_AFTER", "3"))  # 连续失败多少次后隔离该群（不再采集/监听）
+    chat_quarantine_recheck = int(os.getenv("CHAT_QUARANTINE_RECHECK", "604800"))  # 隔离的群多久后自动重试一次（秒），0 表示只能手动重试
+    checkpoint_every = int(os.getenv("CHECKPOINT_EVERY", "300"))  # 每扫描多少条消息记录一次采集断点
+    job_workers = int(os.getenv("JOB_WORKERS", "1"))  # 同时执行的采集任务数（账号有交集的任务不会并行）
+    # 每账号请求速率调节（次/秒），FloodWait 后减半、成功后缓慢回升
+    governor_rate = float(os.getenv("GOVERNOR_RATE", "5"))
+    governor_min_rate = float(os.getenv("GOVERNOR_MIN_RATE", "0.2"))
+    governor_max_rate = float(os.getenv("GOVERNOR_MAX_RATE", "30"))
+    governor_burst = float(os.getenv("GOVERNOR_BURST", "5"))
+    governor_increase = float(os.getenv("GOVERNOR_INCREASE", "0.05"))  # 每秒回升的速率
+    # Telethon 自动等待的 FloodWait 上限（秒）；经调节器的批量请求单独为 0，由调节器处理
+    tg_flood_sleep_threshold = int(os.getenv("TG_FLOOD_SLEEP_THRESHOLD", "60"))
+    # SQLite 每个连接的 PRAGMA，对其他数据库无效
+    sqlite_tuning = os.getenv("SQLITE_TUNING", "1").lower() in ("1", "true", "yes")
+    sqlite_journal_mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    sqlite_synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    sqlite_busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", "268435456"))  # bytes，0 表示关闭
+    sqlite_cache_size = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 负数为 KiB，正数为页数
+    sqlite_temp_store = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+    # 连接池（SQLite 不使用）
+    db_pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+    db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds，-1 表示不重建
+    pg_copy_ingest = os.getenv("PG_COPY_INGEST", "1").lower() in ("1", "true", "yes")  # Postgres 批量写入走 COPY
+    pg_copy_min_rows = int(os.getenv("PG_COPY_MIN_ROWS", "500"))  # 更小的批次用多行 INSERT
+    db_read_url = os.getenv("DB_READ_URL", "")  # 导出/统计用的只读库，为空时读主库
+    db_read_pool_size = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+    read_query_timeout = float(os.getenv("READ_QUERY_TIMEOUT", "30"))  # seconds，0 表示不限制
+    speak_shards = os.getenv("SPEAK_SHARDS", "0").lower() in ("1", "true", "yes")  # 按账号分片存储发言（仅 SQLite）
+    shard_dir = os.getenv("SHARD_DIR", "./data/shards")
+    shard_read_workers = int(os.getenv("SHARD_READ_WORKERS", "8"))  # 并行查询的分片数
+    speak_daily_compact = os.getenv("SPEAK_DAILY_COMPACT", "0").lower() in ("1", "true", "yes")  # 每个账号/群/用户/自然日只记一行
+    seen_messages_cache_size = int(os.getenv("SEEN_MESSAGES_CACHE_SIZE", "200000"))  # 每个账号记住的已计数消息数
     _settings = Settings(
         api_id=api_id,
         api_hash=api_hash,
@@ -47,10 +156,62 @@ def get_settings() -> Settings:
         host=host,
         port=port,
         max_concurrency=max_concurrency,
+        group_concurrency=group_concurrency,
+        adaptive_concurrency=adaptive_concurrency,
+        concurrency_min=concurrency_min,
+        concurrency_max=concurrency_max,
+        concurrency_adjust_interval=concurrency_adjust_interval,
+        db_write_latency_target_ms=db_write_latency_target_ms,
+        loop_lag_target_ms=loop_lag_target_ms,
+        flood_wait_rate_limit=flood_wait_rate_limit,
         jwt_secret_key=jwt_secret_key,
         jwt_algorithm=jwt_algorithm,
         jwt_expire_minutes=jwt_expire_minutes,
         admin_username=admin_username,
         admin_password=admin_password,
+        ingest_batch_size=ingest_batch_size,
+        ingest_flush_interval=ingest_flush_interval,
+        sender_cache_size=sender_cache_size,
+        seen_users_cache_size=seen_users_cache_size,
+        db_writer=db_writer,
+        pipeline_page_queue=pipeline_page_queue,
+        pipeline_write_queue=pipeline_write_queue,
+        job_workers=job_workers,
+        checkpoint_every=checkpoint_every,
+        plan_shared_chats=plan_shared_chats,
+        admin_cache_ttl=admin_cache_ttl,
+        prefilter_unchanged=prefilter_unchanged,
+        floodwait_failover=floodwait_failover,
+        failover_min_wait=failover_min_wait,
+        chat_failure_backoff=chat_failure_backoff,
+        chat_quarantine_after=chat_quarantine_after,
+        chat_quarantine_recheck=chat_quarantine_recheck,
+        governor_rate=governor_rate,
+        governor_min_rate=governor_min_rate,
+        governor_max_rate=governor_max_rate,
+        governor_burst=governor_burst,
+        governor_increase=governor_increase,
+        tg_flood_sleep_threshold=tg_flood_sleep_threshold,
+        sqlite_tuning=sqlite_tuning,
+        sqlite_journal_mode=sqlite_journal_mode,
+        sqlite_synchronous=sqlite_synchronous,
+        sqlite_busy_timeout_ms=sqlite_busy_timeout_ms,
+        sqlite_mmap_size=sqlite_mmap_size,
+        sqlite_cache_size=sqlite_cache_size,
+        sqlite_temp_store=sqlite_temp_store,
+        db_pool_size=db_pool_size,
+        db_max_overflow=db_max_overflow,
+        db_pool_pre_ping=db_pool_pre_ping,
+        db_pool_recycle=db_pool_recycle,
+        pg_copy_ingest=pg_copy_ingest,
+        pg_copy_min_rows=pg_copy_min_rows,
+        db_read_url=db_read_url,
+        db_read_pool_size=db_read_pool_size,
+        read_query_timeout=read_query_timeout,
+        speak_shards=speak_shards,
+        shard_dir=shard_dir,
+        shard_read_workers=shard_read_workers,
+        speak_daily_compact=speak_daily_compact,
+        seen_messages_cache_size=seen_messages_cache_size,
     )
     return _settings
\ No newline at end of file
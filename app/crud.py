@@ -1,9 +1,16 @@
 from __future__ import annotations
 
+import heapq
+import json
+from datetime import timedelta
 from typing import Iterable, Sequence
-from sqlalchemy.orm import Session
-from sqlalchemy import select, delete, and_, func
-from .models import Account, Group, SelectedGroup, User, Speak
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import select, delete, and_, or_, func, case, union_all, type_coerce, String
+from .models import Account, Group, SelectedGroup, User, Speak, SpeakDay, CollectionCoverage, CollectionJob, CollectionCheckpoint, ChatMetadata, ChatAdmins, PeerEntity, ChatFailure
+from .config import get_settings
+from .shards import get_shards
+from .speak_migration import legacy_speaks_pending
+from .utils import ensure_utc, local_day
 
 
 # Accounts
@@ -81,6 +88,101 @@ def list_selected_groups(db: Session, account_id: int) -> list[SelectedGroup]:
 
 
 # Users & Speaks
+def list_chat_candidates(db: Session, account_ids: Iterable[int]) -> tuple[dict[int, set[int]], dict[int, set[int]]]:
+    """返回 (选中关系, 成员关系)，均为 {chat_id: {account_id}}；成员关系来自 groups 表"""
+    ids = list(account_ids)
+    selected: dict[int, set[int]] = {}
+    members: dict[int, set[int]] = {}
+    if not ids:
+        return selected, members
+    for acc_id, chat_id in db.execute(select(SelectedGroup.account_id, SelectedGroup.chat_id).where(SelectedGroup.account_id.in_(ids))):
+        selected.setdefault(int(chat_id), set()).add(int(acc_id))
+    for acc_id, chat_id in db.execute(select(Group.account_id, Group.chat_id).where(Group.account_id.in_(ids))):
+        members.setdefault(int(chat_id), set()).add(int(acc_id))
+    return selected, members
+
+
+def list_member_accounts(db: Session, chat_id: int) -> list[Account]:
+    """在该群中（groups 表）的启用账号"""
+    q = (
+        select(Account)
+        .join(Group, Group.account_id == Account.id)
+        .where(Group.chat_id == chat_id, Account.is_enabled.is_(True))
+        .order_by(Account.id)
+    )
+    return list(db.execute(q).scalars())
+
+
+# 迁移前 SQLAlchemy 在 SQLite 中保存 DateTime 的文本格式（UTC 时间）
+LEGACY_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _speak_date_window(start_utc=None, end_utc=None):
+    """speaks.message_date 在 [start_utc, end_utc) 内的条件
+
+    还有库没迁移完（legacy_speaks_pending，只有 SQLite 会出现）时，按 typeof 区分两种存储格式，
+    尚未转换的旧行按文本比较。SQLite 中文本总是大于整数，只有下界时不区分会把所有旧行都算进来。
+    """
+    conds, legacy = [], []
+    as_text = type_coerce(Speak.message_date, String)
+    if start_utc is not None:
+        conds.append(Speak.message_date >= start_utc)
+        legacy.append(as_text >= ensure_utc(start_utc).strftime(LEGACY_DATE_FORMAT))
+    if end_utc is not None:
+        conds.append(Speak.message_date < end_utc)
+        legacy.append(as_text < ensure_utc(end_utc).strftime(LEGACY_DATE_FORMAT))
+    if not legacy_speaks_pending():
+        return and_(*conds)
+    stored = func.typeof(Speak.message_date)
+    return or_(and_(stored == "integer", *conds), and_(stored == "text", *legacy))
+
+
+def _count_recent_messages_by_chat(db: Session, ids: list[int], since) -> dict[int, int]:
+    q = (
+        select(Speak.chat_id, func.count(func.distinct(Speak.message_id)))
+        .where(Speak.chat_id.in_(ids), _speak_date_window(since))
+        .group_by(Speak.chat_id)
+    )
+    counts = {int(chat_id): int(n) for chat_id, n in db.execute(q)}
+    # 紧凑模式的按日计数：since 所在的自然日整天计入；同一个群的多个账号各自计数，取最大值
+    days = (
+        select(SpeakDay.chat_id, SpeakDay.account_id, func.sum(SpeakDay.message_count))
+        .where(SpeakDay.chat_id.in_(ids), SpeakDay.day >= local_day(since, get_settings().tz))
+        .group_by(SpeakDay.chat_id, SpeakDay.account_id)
+    )
+    day_counts: dict[int, int] = {}
+    for chat_id, _account_id, n in db.execute(days):
+        day_counts[int(chat_id)] = max(day_counts.get(int(chat_id), 0), int(n))
+    for chat_id, n in day_counts.items():
+        counts[chat_id] = counts.get(chat_id, 0) + n
+    return counts
+
+
+def count_recent_messages_by_chat(db: Session, chat_ids: Iterable[int], since) -> dict[int, int]:
+    """按群统计 since 之后已入库的消息数（跨账号按 message_id 去重）
+
+    分片模式下不同账号的发言在不同库中，无法跨库去重，取各库中的最大值作为估计。
+    分片模式下会同步等待各分片的查询，异步代码须经 writer.run_read 在线程中调用，不要放进 run_sync。
+    """
+    ids = list(chat_ids)
+    if not ids:
+        return {}
+    counts = _count_recent_messages_by_chat(db, ids, since)
+    shards = get_shards()
+    if shards is not None:
+        for part in shards.map_read(_count_recent_messages_by_chat, ids, since):
+            for chat_id, n in part.items():
+                counts[chat_id] = max(counts.get(chat_id, 0), n)
+    return counts
+
+
+def list_coverage_for_chats(db: Session, chat_ids: Iterable[int]) -> list[CollectionCoverage]:
+    ids = list(chat_ids)
+    if not ids:
+        return []
+    return list(db.execute(select(CollectionCoverage).where(CollectionCoverage.chat_id.in_(ids))).scalars())
+
+
 def upsert_user(db: Session, tg_user_id: int, username: str | None, first_name: str | None, last_name: str | None, is_bot: bool) -> User:
     q = select(User).where(User.tg_user_id == tg_user_id)
     u = db.execute(q).scalars().first()
@@ -109,6 +211,15 @@ def upsert_user(db: Session, tg_user_id: int, username: str | None, first_name:
 
 
 def insert_speak(db: Session, account_id: int, chat_id: int, tg_user_id: int, message_id: int, message_date) -> bool:
+    shards = get_shards()
+    if shards is not None:
+        # 分片模式写入账号自己的分片库
+        with shards.write_session(account_id) as shard_db:
+            return _insert_speak(shard_db, account_id, chat_id, tg_user_id, message_id, message_date)
+    return _insert_speak(db, account_id, chat_id, tg_user_id, message_id, message_date)
+
+
+def _insert_speak(db: Session, account_id: int, chat_id: int, tg_user_id: int, message_id: int, message_date) -> bool:
     try:
         s = Speak(
             account_id=account_id,
@@ -125,6 +236,516 @@ def insert_speak(db: Session, account_id: int, chat_id: int, tg_user_id: int, me
         return False
 
 
+def _dialect_insert(db: Session, model):
+    """按当前数据库方言返回支持 ON CONFLICT 的 insert 构造"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"bulk ingest not supported for dialect: {dialect}")
+    return insert(model)
+
+
+def bulk_upsert_users(db: Session, rows: Sequence[dict]) -> None:
+    """多行 upsert 用户（不提交事务）
+
+    与 upsert_user 语义一致：username 仅在非空时覆盖，昵称只在新建时写入，is_bot 总是更新。
+    同一批次内的 tg_user_id 需由调用方去重（Postgres 不允许一条语句两次更新同一行）。
+    """
+    if not rows:
+        return
+    from .models import utcnow
+    now = utcnow()
+    values = [
+        {
+            "tg_user_id": r["tg_user_id"],
+            "username": r.get("username"),
+            "first_name": r.get("first_name"),
+            "last_name": r.get("last_name"),
+            "is_bot": bool(r.get("is_bot", False)),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for r in rows
+    ]
+    stmt = _dialect_insert(db, User).values(values)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tg_user_id],
+        set_={
+            "username": func.coalesce(func.nullif(excluded.username, ""), User.username),
+            "is_bot": excluded.is_bot,
+            "updated_at": excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
+
+
+def bulk_insert_speaks(db: Session, rows: Sequence[dict]) -> dict[int, int]:
+    """多行 INSERT ... ON CONFLICT DO NOTHING 写入发言（不提交事务）
+
+    返回 {chat_id: 实际新插入条数}，重复记录不计入。由 ingest_batch 调用（分片模式下经 insert_speaks_sharded）。
+    """
+    if not rows:
+        return {}
+    stmt = _dialect_insert(db, Speak).on_conflict_do_nothing().returning(Speak.chat_id)
+    inserted: dict[int, int] = {}
+    for chat_id in db.execute(stmt, list(rows)).scalars():
+        inserted[int(chat_id)] = inserted.get(int(chat_id), 0) + 1
+    return inserted
+
+
+def speak_day_row(speak: dict, tz: str | None = None) -> dict:
+    """逐条发言 -> speak_days 的一行（计数 1），自然日按 TZ 时区划分"""
+    return {
+        "account_id": speak["account_id"],
+        "chat_id": speak["chat_id"],
+        "tg_user_id": speak["tg_user_id"],
+        "day": local_day(speak["message_date"], tz or get_settings().tz),
+        "message_id": speak["message_id"],
+        "message_date": speak["message_date"],
+        "message_count": speak.get("message_count", 1),
+    }
+
+
+def merge_speak_day(rows: dict, row: dict) -> None:
+    """把 row 归并进以 (账号, 群, 用户, 日) 为键的 rows：保留当天最早的一条，累加计数"""
+    key = (row["account_id"], row["chat_id"], row["tg_user_id"], row["day"])
+    prev = rows.get(key)
+    if prev is None:
+        rows[key] = dict(row)
+        return
+    prev["message_count"] += row["message_count"]
+    if row["message_date"] < prev["message_date"]:
+        prev["message_id"] = row["message_id"]
+        prev["message_date"] = row["message_date"]
+
+
+def bulk_upsert_speak_days(db: Session, rows: Sequence[dict]) -> dict[int, int]:
+    """多行 upsert 按日发言（不提交事务）：已有的行累加计数，并在更早时替换当天首条消息
+
+    每个区间按消息ID升序采集，但向前补采的区间和实时监听会让同一天更早的消息晚于更新的消息写入，
+    所以首条消息按时间比较而不依赖写入顺序。
+    同一批次内的键需由调用方归并（见 merge_speak_day）。返回 {chat_id: 计入的消息数}。
+    """
+    if not rows:
+        return {}
+    stmt = _dialect_insert(db, SpeakDay)
+    excluded = stmt.excluded
+    earlier = excluded.message_date < SpeakDay.message_date
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SpeakDay.account_id, SpeakDay.chat_id, SpeakDay.tg_user_id, SpeakDay.day],
+        set_={
+            "message_id": case((earlier, excluded.message_id), else_=SpeakDay.message_id),
+            "message_date": case((earlier, excluded.message_date), else_=SpeakDay.message_date),
+            "message_count": SpeakDay.message_count + excluded.message_count,
+        },
+    )
+    db.execute(stmt, list(rows))
+    counted: dict[int, int] = {}
+    for r in rows:
+        counted[int(r["chat_id"])] = counted.get(int(r["chat_id"]), 0) + int(r["message_count"])
+    return counted
+
+
+def upsert_speak_days(db: Session, rows: Sequence[dict]) -> dict[int, int]:
+    """写入并提交按日发言；分片模式下写入各账号的分片库"""
+    if get_shards() is not None:
+        return insert_speaks_sharded(rows, write=bulk_upsert_speak_days)
+    try:
+        counted = bulk_upsert_speak_days(db, rows)
+        db.commit()
+        return counted
+    except Exception:
+        db.rollback()
+        raise
+
+
+def bulk_upsert_checkpoints(db: Session, rows: Sequence[dict]) -> None:
+    """按 (job_id, account_id, chat_id) 覆盖写入采集断点；不提交"""
+    if not rows:
+        return
+    from .models import utcnow
+    now = utcnow()
+    stmt = _dialect_insert(db, CollectionCheckpoint).values([{**r, "updated_at": now} for r in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CollectionCheckpoint.job_id, CollectionCheckpoint.account_id, CollectionCheckpoint.chat_id],
+        set_={
+            "last_message_id": stmt.excluded.last_message_id,
+            "state": stmt.excluded.state,
+            "is_done": stmt.excluded.is_done,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
+
+
+def use_copy_ingest(db: Session, rows: int) -> bool:
+    """Postgres 上较大的批次改用 COPY 写入（PG_COPY_INGEST / PG_COPY_MIN_ROWS）"""
+    settings = get_settings()
+    return (
+        settings.pg_copy_ingest
+        and rows >= settings.pg_copy_min_rows
+        and db.get_bind().dialect.name == "postgresql"
+    )
+
+
+def insert_speaks_sharded(rows: Sequence[dict], write) -> dict[int, int]:
+    """分片模式：按账号把发言写入各自的分片库并提交，返回 {chat_id: 实际新插入条数}
+
+    write 为每个分片上执行的批量写入函数（bulk_insert_speaks 或 bulk_upsert_speak_days）。
+    """
+    shards = get_shards()
+    by_account: dict[int, list[dict]] = {}
+    for r in rows:
+        by_account.setdefault(int(r["account_id"]), []).append(r)
+    inserted: dict[int, int] = {}
+    for account_id, part in by_account.items():
+        with shards.write_session(account_id) as shard_db:
+            try:
+                counts = write(shard_db, part)
+                shard_db.commit()
+            except Exception:
+                shard_db.rollback()
+                raise
+        for chat_id, n in counts.items():
+            inserted[chat_id] = inserted.get(chat_id, 0) + n
+    return inserted
+
+
+def ingest_batch(
+    db: Session,
+    users: Sequence[dict],
+    speaks: Sequence[dict],
+    checkpoints: Sequence[dict] = (),
+    copy: bool | None = None,
+    daily: bool = False,
+) -> dict[int, int]:
+    """在一个事务内写入一批用户、发言和断点，返回每个群新插入的发言数
+
+    断点与其之前的发言同事务提交，断点记录的进度一定已经落库。
+    copy 为 None 时按配置决定是否走 Postgres COPY 路径。
+    分片模式下发言先写入分片库并提交，再在主库事务中写入用户和断点，断点仍然不会先于发言落库。
+    daily=True 时 speaks 是已归并的 speak_days 行，返回每个群计入的消息数。
+    """
+    write = bulk_upsert_speak_days if daily else bulk_insert_speaks
+    if copy is None:
+        copy = not daily and use_copy_ingest(db, len(speaks))
+    try:
+        if get_shards() is not None:
+            inserted = insert_speaks_sharded(speaks, write=write)
+            bulk_upsert_users(db, users)
+        elif copy:
+            from .pg_copy import copy_users_and_speaks
+            inserted = copy_users_and_speaks(db, users, speaks)
+        else:
+            bulk_upsert_users(db, users)
+            inserted = write(db, speaks)
+        bulk_upsert_checkpoints(db, checkpoints)
+        db.commit()
+        return inserted
+    except Exception:
+        db.rollback()
+        raise
+
+
+# Peers
+def upsert_peers(db: Session, account_id: int, rows: Sequence[dict]) -> None:
+    """按 (account_id, peer_id) 覆盖写入会话实体"""
+    if not rows:
+        return
+    from .models import utcnow
+    now = utcnow()
+    stmt = _dialect_insert(db, PeerEntity).values([{**r, "account_id": account_id, "updated_at": now} for r in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PeerEntity.account_id, PeerEntity.peer_id],
+        set_={
+            "peer_type": stmt.excluded.peer_type,
+            "access_hash": stmt.excluded.access_hash,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def _migrate_speaks(db: Session, account_id: int, old_chat_id: int, new_chat_id: int) -> None:
+    newer = aliased(Speak)
+    db.execute(
+        delete(Speak).where(
+            Speak.account_id == account_id,
+            Speak.chat_id == old_chat_id,
+            select(newer.id).where(
+                newer.account_id == account_id,
+                newer.chat_id == new_chat_id,
+                newer.tg_user_id == Speak.tg_user_id,
+                newer.message_id == Speak.message_id,
+            ).exists(),
+        )
+    )
+    db.execute(Speak.__table__.update().where(Speak.account_id == account_id, Speak.chat_id == old_chat_id).values(chat_id=new_chat_id))
+    newer_day = aliased(SpeakDay)
+    db.execute(
+        delete(SpeakDay).where(
+            SpeakDay.account_id == account_id,
+            SpeakDay.chat_id == old_chat_id,
+            select(newer_day.id).where(
+                newer_day.account_id == account_id,
+                newer_day.chat_id == new_chat_id,
+                newer_day.tg_user_id == SpeakDay.tg_user_id,
+                newer_day.day == SpeakDay.day,
+            ).exists(),
+        )
+    )
+    db.execute(SpeakDay.__table__.update().where(SpeakDay.account_id == account_id, SpeakDay.chat_id == old_chat_id).values(chat_id=new_chat_id))
+
+
+def _migrate_speaks_and_commit(db: Session, account_id: int, old_chat_id: int, new_chat_id: int) -> None:
+    _migrate_speaks(db, account_id, old_chat_id, new_chat_id)
+    db.commit()
+
+
+def migrate_chat_id(db: Session, account_id: int, old_chat_id: int, new_chat_id: int) -> None:
+    """把账号下旧的未标记群ID改成带标记的ID
+
+    按账号的表（群组、选中、发言、覆盖区间、断点、访问失败）直接改写；目标ID已存在的行视为重复并删除，
+    访问失败记录以新ID上的为准。全部改写在同一个事务中提交。
+    按群的表（元数据、管理员）在目标ID没有记录时改写，否则保留给仍使用旧ID的其他账号。
+    """
+    if old_chat_id == new_chat_id:
+        return
+    for model in (Group, SelectedGroup, CollectionCoverage, ChatFailure):
+        exists = db.execute(select(model.id).where(model.account_id == account_id, model.chat_id == new_chat_id)).first()
+        if exists:
+            db.execute(delete(model).where(model.account_id == account_id, model.chat_id == old_chat_id))
+        else:
+            db.execute(model.__table__.update().where(model.account_id == account_id, model.chat_id == old_chat_id).values(chat_id=new_chat_id))
+    # 发言和断点的唯一键包含更多列，先删除改写后会冲突的行
+    _migrate_speaks(db, account_id, old_chat_id, new_chat_id)
+    shards = get_shards()
+    if shards is not None:
+        shards.map_write(_migrate_speaks_and_commit, account_id, old_chat_id, new_chat_id, account_ids=[account_id])
+    db.execute(
+        delete(CollectionCheckpoint).where(
+            CollectionCheckpoint.account_id == account_id,
+            CollectionCheckpoint.chat_id == old_chat_id,
+            CollectionCheckpoint.job_id.in_(
+                select(CollectionCheckpoint.job_id).where(CollectionCheckpoint.account_id == account_id, CollectionCheckpoint.chat_id == new_chat_id)
+            ),
+        )
+    )
+    db.execute(CollectionCheckpoint.__table__.update().where(CollectionCheckpoint.account_id == account_id, CollectionCheckpoint.chat_id == old_chat_id).values(chat_id=new_chat_id))
+    for model in (ChatMetadata, ChatAdmins):
+        if db.execute(select(model.id).where(model.chat_id == new_chat_id)).first() is None:
+            row = db.execute(select(model).where(model.chat_id == old_chat_id)).scalars().first()
+            if row is not None:
+                values = {c.name: getattr(row, c.name) for c in model.__table__.columns if c.name != "id"}
+                db.add(model(**{**values, "chat_id": new_chat_id}))
+    db.commit()
+
+
+# Chat failures
+def get_chat_failures(db: Session, account_id: int, chat_ids: Iterable[int] | None = None) -> dict[int, ChatFailure]:
+    q = select(ChatFailure).where(ChatFailure.account_id == account_id)
+    if chat_ids is not None:
+        q = q.where(ChatFailure.chat_id.in_(list(chat_ids)))
+    return {int(f.chat_id): f for f in db.execute(q).scalars()}
+
+
+def list_chat_failures(db: Session, account_id: int | None = None, quarantined_only: bool = True) -> list[ChatFailure]:
+    q = select(ChatFailure)
+    if account_id is not None:
+        q = q.where(ChatFailure.account_id == account_id)
+    if quarantined_only:
+        q = q.where(ChatFailure.is_quarantined.is_(True))
+    return list(db.execute(q.order_by(ChatFailure.account_id, ChatFailure.last_failure_at.desc())).scalars())
+
+
+def list_blocked_chats(db: Session, account_ids: Iterable[int], now) -> set[tuple[int, int]]:
+    """仍在退避或隔离中的 (account_id, chat_id)"""
+    ids = list(account_ids)
+    if not ids:
+        return set()
+    q = select(ChatFailure.account_id, ChatFailure.chat_id).where(
+        ChatFailure.account_id.in_(ids),
+        (ChatFailure.next_retry_at.is_(None) & ChatFailure.is_quarantined.is_(True)) | (ChatFailure.next_retry_at > now),
+    )
+    return {(int(a), int(c)) for a, c in db.execute(q)}
+
+
+def save_chat_failure(db: Session, account_id: int, chat_id: int, **fields) -> ChatFailure:
+    row = db.execute(select(ChatFailure).where(ChatFailure.account_id == account_id, ChatFailure.chat_id == chat_id)).scalars().first()
+    if row is None:
+        row = ChatFailure(account_id=account_id, chat_id=chat_id)
+        db.add(row)
+    for k, v in fields.items():
+        setattr(row, k, v)
+    db.commit()
+    return row
+
+
+def delete_chat_failures(db: Session, account_id: int, chat_ids: Iterable[int]) -> int:
+    ids = list(chat_ids)
+    if not ids:
+        return 0
+    res = db.execute(delete(ChatFailure).where(ChatFailure.account_id == account_id, ChatFailure.chat_id.in_(ids)))
+    db.commit()
+    return res.rowcount or 0
+
+
+def unselect_groups(db: Session, account_id: int, chat_ids: Iterable[int]) -> int:
+    ids = list(chat_ids)
+    if not ids:
+        return 0
+    res = db.execute(delete(SelectedGroup).where(SelectedGroup.account_id == account_id, SelectedGroup.chat_id.in_(ids)))
+    db.commit()
+    return res.rowcount or 0
+
+
+# Chat metadata
+def get_chat_metadata(db: Session, chat_ids: Iterable[int]) -> dict[int, ChatMetadata]:
+    ids = list(chat_ids)
+    if not ids:
+        return {}
+    q = select(ChatMetadata).where(ChatMetadata.chat_id.in_(ids))
+    return {int(m.chat_id): m for m in db.execute(q).scalars()}
+
+
+def upsert_chat_metadata(
+    db: Session,
+    chat_id: int,
+    is_channel: bool | None = None,
+    participants_count: int | None = None,
+    top_message_id: int | None = None,
+    top_message_date=None,
+    observed_rate: float | None = None,
+) -> ChatMetadata:
+    """更新群元数据；None 表示不修改。observed_rate 与已有日消息量做滑动平均"""
+    meta = db.execute(select(ChatMetadata).where(ChatMetadata.chat_id == chat_id)).scalars().first()
+    if meta is None:
+        meta = ChatMetadata(chat_id=chat_id)
+        db.add(meta)
+    if is_channel is not None:
+        meta.is_channel = is_channel
+    if participants_count is not None:
+        meta.participants_count = participants_count
+    if top_message_id is not None and top_message_id >= (meta.top_message_id or 0):
+        meta.top_message_id = top_message_id
+        if top_message_date is not None:
+            meta.top_message_date = top_message_date
+    if observed_rate is not None:
+        old = meta.messages_per_day
+        meta.messages_per_day = observed_rate if old is None else 0.5 * old + 0.5 * observed_rate
+    db.commit()
+    return meta
+
+
+# Chat admins
+def get_chat_admins(db: Session, chat_id: int) -> ChatAdmins | None:
+    return db.execute(select(ChatAdmins).where(ChatAdmins.chat_id == chat_id)).scalars().first()
+
+
+def save_chat_admins(db: Session, chat_id: int, admin_ids: Iterable[int], fetched_at) -> ChatAdmins:
+    row = get_chat_admins(db, chat_id)
+    if row is None:
+        row = ChatAdmins(chat_id=chat_id)
+        db.add(row)
+    row.admin_ids = json.dumps(sorted(int(i) for i in admin_ids))
+    row.fetched_at = fetched_at
+    db.commit()
+    return row
+
+
+# Coverage
+def get_coverage(db: Session, account_id: int, chat_id: int) -> CollectionCoverage | None:
+    q = select(CollectionCoverage).where(CollectionCoverage.account_id == account_id, CollectionCoverage.chat_id == chat_id)
+    return db.execute(q).scalars().first()
+
+
+def save_coverage(
+    db: Session,
+    account_id: int,
+    chat_id: int,
+    min_message_id: int | None,
+    max_message_id: int | None,
+    covered_from,
+    covered_until,
+) -> CollectionCoverage:
+    cov = get_coverage(db, account_id, chat_id)
+    if cov is None:
+        cov = CollectionCoverage(account_id=account_id, chat_id=chat_id)
+        db.add(cov)
+    cov.min_message_id = min_message_id
+    cov.max_message_id = max_message_id
+    cov.covered_from = covered_from
+    cov.covered_until = covered_until
+    db.commit()
+    db.refresh(cov)
+    return cov
+
+
+# Jobs
+JOB_PENDING_STATUSES = ("queued", "running")
+
+
+def get_job(db: Session, job_id: int) -> CollectionJob | None:
+    return db.get(CollectionJob, job_id)
+
+
+def list_jobs(db: Session, status: str | None = None, limit: int = 50) -> list[CollectionJob]:
+    q = select(CollectionJob)
+    if status:
+        q = q.where(CollectionJob.status == status)
+    return list(db.execute(q.order_by(CollectionJob.id.desc()).limit(limit)).scalars())
+
+
+# Checkpoints
+def save_checkpoints(db: Session, rows: Sequence[dict]) -> None:
+    try:
+        bulk_upsert_checkpoints(db, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def list_job_checkpoints(db: Session, job_id: int) -> list[CollectionCheckpoint]:
+    return list(db.execute(select(CollectionCheckpoint).where(CollectionCheckpoint.job_id == job_id)).scalars())
+
+
+def _usernames_in_window(db: Session, start_utc, end_utc, account_id: int | None, chat_id: int | None) -> list[str]:
+    # 先在 speaks / speak_days 的时间索引上取窗口内的用户ID（去重），每个用户只回查一次 users
+    def active(model, *conds):
+        conds = list(conds)
+        if account_id is not None:
+            conds.append(model.account_id == account_id)
+        if chat_id is not None:
+            conds.append(model.chat_id == chat_id)
+        return select(model.tg_user_id).where(and_(*conds))
+
+    # speak_days 只有自然日粒度：与窗口有交集的自然日整天计入，整天的窗口与逐条记录结果相同
+    tz = get_settings().tz
+    first_day = local_day(start_utc, tz)
+    last_day = local_day(end_utc - timedelta(microseconds=1), tz)
+    q = select(User.username).where(User.tg_user_id.in_(union_all(
+        active(Speak, _speak_date_window(start_utc, end_utc)),
+        active(SpeakDay, SpeakDay.day >= first_day, SpeakDay.day <= last_day),
+    )))
+    rows = db.execute(q).scalars().all()
+    usernames = sorted({r for r in rows if r})
+    return usernames
+
+
+def _merge_sorted_unique(parts: Iterable[list[str]]) -> list[str]:
+    merged: list[str] = []
+    for name in heapq.merge(*parts):
+        if not merged or merged[-1] != name:
+            merged.append(name)
+    return merged
+
+
 def get_usernames_in_window(
     db: Session,
     start_utc,
@@ -132,18 +753,54 @@ def get_usernames_in_window(
     account_id: int | None = None,
     chat_id: int | None = None,
 ) -> list[str]:
-    # join speaks -> users and filter window
-    from sqlalchemy import and_, join
-    j = join(Speak, User, Speak.tg_user_id == User.tg_user_id)
-    conds = [Speak.message_date >= start_utc, Speak.message_date < end_utc]
-    if account_id is not None:
-        conds.append(Speak.account_id == account_id)
-    if chat_id is not None:
-        conds.append(Speak.chat_id == chat_id)
-    q = select(User.username).select_from(j).where(and_(*conds))
-    rows = db.execute(q).scalars().all()
-    usernames = sorted({r for r in rows if r})
-    return usernames
+    """窗口内发过言的用户名（去重、排序）
+
+    分片模式下主库（分片前的历史发言）和各账号分片并行查询，各自排好序后多路归并去重。
+    """
+    parts = [_usernames_in_window(db, start_utc, end_utc, account_id, chat_id)]
+    shards = get_shards()
+    if shards is not None:
+        parts += shards.map_read(
+            _usernames_in_window, start_utc, end_utc, account_id, chat_id,
+            account_ids=[account_id] if account_id is not None else None,
+        )
+    return _merge_sorted_unique(parts)
+
+
+def _speak_stats_by_account(db: Session) -> dict[int, tuple[int, int]]:
+    # 发言数 = speaks 行数 + speak_days 的消息计数；用户在两张表中合并去重
+    ids = union_all(select(Speak.account_id, Speak.tg_user_id), select(SpeakDay.account_id, SpeakDay.tg_user_id)).subquery()
+    users = select(ids.c.account_id, func.count(func.distinct(ids.c.tg_user_id))).group_by(ids.c.account_id)
+    speaks = select(Speak.account_id, func.count(Speak.id)).group_by(Speak.account_id)
+    days = select(SpeakDay.account_id, func.sum(SpeakDay.message_count)).group_by(SpeakDay.account_id)
+    counts: dict[int, int] = {}
+    for a, n in [*db.execute(speaks), *db.execute(days)]:
+        counts[int(a)] = counts.get(int(a), 0) + int(n)
+    return {int(a): (int(n), counts.get(int(a), 0)) for a, n in db.execute(users)}
+
+
+def speak_stats_by_account(db: Session) -> dict[int, tuple[int, int]]:
+    """每个账号的 (发言用户数, 发言数)
+
+    分片模式下按库相加；同一账号分片前后都有发言的用户会各计一次。
+    """
+    stats = _speak_stats_by_account(db)
+    shards = get_shards()
+    if shards is not None:
+        for part in shards.map_read(_speak_stats_by_account):
+            for account_id, (users, speaks) in part.items():
+                prev_users, prev_speaks = stats.get(account_id, (0, 0))
+                stats[account_id] = (prev_users + users, prev_speaks + speaks)
+    return stats
+
+
+def _delete_orphaned_speaks(db: Session) -> int:
+    """删除对应用户不存在的发言并提交，返回删除行数；主库和各分片库共用"""
+    from sqlalchemy import text
+    res = db.execute(text("DELETE FROM speaks WHERE tg_user_id NOT IN (SELECT tg_user_id FROM users)"))
+    days = db.execute(text("DELETE FROM speak_days WHERE tg_user_id NOT IN (SELECT tg_user_id FROM users)"))
+    db.commit()
+    return (res.rowcount or 0) + (days.rowcount or 0)
 
 
 def cleanup_database(db: Session) -> dict:
@@ -154,7 +811,7 @@ def cleanup_database(db: Session) -> dict:
     3. 确保所有username都以@开头
     4. 删除孤立的speak记录（对应的用户不存在）
     """
-    from sqlalchemy import and_, func, text
+    from sqlalchemy import and_, func
     
     result = {
         "deleted_users_without_username": 0,
@@ -176,6 +833,7 @@ def cleanup_database(db: Session) -> dict:
         for user in users_without_username:
             # 先删除相关的speak记录
             db.execute(delete(Speak).where(Speak.tg_user_id == user.tg_user_id))
+            db.execute(delete(SpeakDay).where(SpeakDay.tg_user_id == user.tg_user_id))
             # 再删除用户记录
             db.delete(user)
             result["deleted_users_without_username"] += 1
@@ -216,21 +874,17 @@ def cleanup_database(db: Session) -> dict:
             user.username = '@' + user.username
             result["updated_username_format"] += 1
         
-        # 4. 删除孤立的speak记录（对应的用户不存在）
-        orphaned_speaks = db.execute(
-            text("""
-                DELETE FROM speaks 
-                WHERE tg_user_id NOT IN (SELECT tg_user_id FROM users)
-            """)
-        )
-        result["deleted_orphaned_speaks"] = orphaned_speaks.rowcount
+        # 4. 删除孤立的speak记录（对应的用户不存在），并提交所有更改
+        result["deleted_orphaned_speaks"] = _delete_orphaned_speaks(db)
         
-        # 提交所有更改
-        db.commit()
+        # 分片库中的发言：主库用户删除后再清理（分片连接上的 users 指向只读挂载的主库）
+        shards = get_shards()
+        if shards is not None:
+            result["deleted_orphaned_speaks"] += sum(shards.map_write(_delete_orphaned_speaks))
         
         # 统计剩余记录数
         result["remaining_users"] = db.execute(select(func.count(User.id))).scalar()
-        result["remaining_speaks"] = db.execute(select(func.count(Speak.id))).scalar()
+        result["remaining_speaks"] = sum(speaks for _, speaks in speak_stats_by_account(db).values())
         
         return result
         
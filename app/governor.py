@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict
+from telethon import errors
+from telethon.tl.tlobject import TLRequest
+
+from .config import get_settings
+from .concurrency import record_flood_wait
+
+
+class RateGovernor:
+    """单个 Telegram 账号的请求速率调节器
+
+    令牌桶限速，速率按 AIMD 调整：
+    - 收到 FloodWait：速率立即减半（不低于下限），并让该账号所有调用方一起暂停到限流结束；
+      能从异常中识别出请求方法时只暂停该方法（FloodWait 按方法计），其他请求照常进行
+    - 请求成功：速率缓慢线性回升，每秒最多增加 increase 次/秒
+    采集、监听的发送者解析、刷新群组、测试会话共用同一个账号的实例。
+    """
+
+    def __init__(
+        self,
+        account_id: int,
+        rate: float | None = None,
+        min_rate: float | None = None,
+        max_rate: float | None = None,
+        burst: float | None = None,
+        increase: float | None = None,
+    ):
+        settings = get_settings()
+        self.account_id = account_id
+        self.min_rate = min_rate if min_rate is not None else settings.governor_min_rate
+        self.max_rate = max_rate if max_rate is not None else settings.governor_max_rate
+        self.rate = min(self.max_rate, max(self.min_rate, rate if rate is not None else settings.governor_rate))
+        self.burst = max(1.0, burst if burst is not None else settings.governor_burst)
+        self.increase = increase if increase is not None else settings.governor_increase
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._resume_at = 0.0
+        self._method_resume_at: Dict[str, float] = {}
+        self.stats = {"requests": 0, "flood_waits": 0, "flood_wait_seconds": 0, "last_flood_wait": None}
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def remaining_pause(self, method: str | None = None) -> float:
+        resume_at = self._resume_at
+        if method is not None:
+            resume_at = max(resume_at, self._method_resume_at.get(method, 0.0))
+        return max(0.0, resume_at - time.monotonic())
+
+    async def wait(self, method: str | None = None) -> None:
+        """等待 FloodWait 暂停结束（不消耗令牌）"""
+        while (delay := self.remaining_pause(method)) > 0:
+            await asyncio.sleep(delay)
+
+    async def acquire(self, cost: float = 1.0, method: str | None = None) -> None:
+        """在发起一次 Telegram 请求前调用；method 为请求类名，用于按方法暂停"""
+        while True:
+            await self.wait(method)
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= cost:
+                self._tokens -= cost
+                self.stats["requests"] += 1
+                return
+            await asyncio.sleep((cost - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        # 每次成功增加 increase / rate，相当于每秒回升 increase 次/秒
+        self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1e-6))
+
+    def on_flood_wait(self, seconds: int | float, error: Exception | None = None, method: str | None = None) -> str | None:
+        """记录一次 FloodWait，返回被暂停的方法名（None 表示整个账号暂停）"""
+        if method is None and error is not None:
+            request = getattr(error, "request", None)
+            method = type(request).__name__ if request is not None else None
+        # 同一个异常可能被 call() 和外层调用方各处理一次，只反馈一次
+        if error is not None:
+            if getattr(error, "_governor_seen", False):
+                return method
+            error._governor_seen = True
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        resume_at = time.monotonic() + float(seconds) + 1
+        if method is None:
+            self._resume_at = max(self._resume_at, resume_at)
+        else:
+            self._method_resume_at[method] = max(self._method_resume_at.get(method, 0.0), resume_at)
+        self.stats["flood_waits"] += 1
+        record_flood_wait()
+        self.stats["flood_wait_seconds"] += int(seconds)
+        self.stats["last_flood_wait"] = time.time()
+        print(f"⏳ 账号 {self.account_id} 触发 FloodWait {seconds} 秒（{method or '全部请求'}），速率降至 {self.rate:.2f} 次/秒")
+        return method
+
+    async def call(self, fn, *args, retries: int = 1, method: str | None = None, **kwargs):
+        """限速执行一次请求；遇到 FloodWait 时反馈给调节器，等待后最多重试 retries 次
+
+        method: 请求类名，第一次请求前就检查该方法是否仍在暂停；
+        未指定时从原始 TL 请求（client(request)）的类型推断。
+        """
+        if method is None and args and isinstance(args[0], TLRequest):
+            method = type(args[0]).__name__
+        attempt = 0
+        while True:
+            await self.acquire(method=method)
+            try:
+                result = await fn(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                method = self.on_flood_wait(e.seconds, e)
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                continue
+            self.on_success()
+            return result
+
+    def snapshot(self) -> dict:
+        return {
+            "account_id": self.account_id,
+            "rate": round(self.rate, 3),
+            "min_rate": self.min_rate,
+            "max_rate": self.max_rate,
+            "paused_seconds": round(self.remaining_pause(), 1),
+            "paused_methods": {m: round(self.remaining_pause(m), 1) for m in self._method_resume_at if self.remaining_pause(m) > 0},
+            **self.stats,
+        }
+
+
+_governors: Dict[int, RateGovernor] = {}
+
+
+def get_governor(account_id: int) -> RateGovernor:
+    gov = _governors.get(account_id)
+    if gov is None:
+        gov = RateGovernor(account_id)
+        _governors[account_id] = gov
+    return gov
+
+
+def get_all_governors_status() -> Dict:
+    return {account_id: gov.snapshot() for account_id, gov in _governors.items()}
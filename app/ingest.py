@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from .concurrency import record_write_latency
+from .writer import db_writer, BACKFILL
+from .shards import get_shards
+from . import crud
+
+
+class SeenUsers:
+    """账号内已落库用户的 (username, is_bot)，有界 LRU
+
+    用户只有在缓存中没有、或 username / is_bot 与上次落库的不同时才需要写库；
+    与 upsert_user 一致，空 username 不会覆盖已有值，因此不算变化。
+    """
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max(1, max_size or get_settings().seen_users_cache_size)
+        self._cache: OrderedDict[int, Tuple[str | None, bool]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "changed": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def needs_write(self, tg_user_id: int, username: str | None, is_bot: bool) -> bool:
+        cached = self._cache.get(tg_user_id)
+        if cached is None:
+            self.stats["misses"] += 1
+            return True
+        self._cache.move_to_end(tg_user_id)
+        if (username and username != cached[0]) or bool(is_bot) != cached[1]:
+            self.stats["changed"] += 1
+            return True
+        self.stats["hits"] += 1
+        return False
+
+    def mark_persisted(self, rows: Iterable[dict]) -> None:
+        """事务提交后调用，记录库中的最新值"""
+        for r in rows:
+            uid = int(r["tg_user_id"])
+            prev = self._cache.get(uid)
+            username = r.get("username") or (prev[0] if prev is not None else None)
+            self._cache[uid] = (username, bool(r.get("is_bot", False)))
+            self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["changed"]
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+        }
+
+
+_seen_users: Dict[int, SeenUsers] = {}
+
+
+def get_seen_users(account_id: int) -> SeenUsers:
+    seen = _seen_users.get(account_id)
+    if seen is None:
+        seen = SeenUsers()
+        _seen_users[account_id] = seen
+    return seen
+
+
+def get_seen_users_status() -> Dict[int, dict]:
+    return {account_id: seen.snapshot() for account_id, seen in _seen_users.items()}
+
+
+def clear_seen_users() -> None:
+    """库中的用户被批量修改或删除后（如整理数据库）调用，之后所有用户重新写库一次"""
+    for seen in _seen_users.values():
+        seen.clear()
+
+
+class SeenMessages:
+    """账号内最近已计数的消息 (chat_id, message_id)，有界 LRU
+
+    紧凑采集模式（SPEAK_DAILY_COMPACT）下重复的消息（重叠的采集区间、监听与采集同时收到）
+    在落库前丢弃，不会重复累加 speak_days 的计数。
+    """
+
+    def __init__(self, max_size: int | None = None):
+        self.max_size = max(1, max_size or get_settings().seen_messages_cache_size)
+        self._cache: OrderedDict[Tuple[int, int], None] = OrderedDict()
+        self.stats = {"added": 0, "duplicates": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def add(self, chat_id: int, message_id: int) -> bool:
+        """记录一条消息，已经见过时返回 False"""
+        key = (chat_id, message_id)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["duplicates"] += 1
+            return False
+        self._cache[key] = None
+        self.stats["added"] += 1
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+        return True
+
+    def snapshot(self) -> dict:
+        return {"size": len(self._cache), "max_size": self.max_size, **self.stats}
+
+
+_seen_messages: Dict[int, SeenMessages] = {}
+
+
+def get_seen_messages(account_id: int) -> SeenMessages:
+    seen = _seen_messages.get(account_id)
+    if seen is None:
+        seen = SeenMessages()
+        _seen_messages[account_id] = seen
+    return seen
+
+
+def get_seen_messages_status() -> Dict[int, dict]:
+    return {account_id: seen.snapshot() for account_id, seen in _seen_messages.items()}
+
+
+class IngestBuffer:
+    """采集写入缓冲区
+
+    按账号收集用户和发言，达到行数阈值或距上次写入超过时间阈值时，
+    用一条多行 upsert + 一条 INSERT ... ON CONFLICT DO NOTHING 批量落库。
+    采集断点随同一事务写入，每个群只保留最新的一条。
+    new_speaks / per_chat 只统计真正新插入的发言，用于 stats["new_speaks"] 和 per_group。
+    用户先经账号的 SeenUsers 过滤，上次落库后没有变化的用户不再 upsert。
+    紧凑采集模式下发言在缓冲区内按 (群, 用户, 自然日) 归并为 speak_days 行，重复的消息经 SeenMessages 丢弃；
+    new_speaks / per_chat 此时统计计入的消息数。
+    """
+
+    def __init__(self, db: Session, account_id: int, batch_size: int | None = None, flush_interval: float | None = None):
+        settings = get_settings()
+        self.db = db
+        self.account_id = account_id
+        self.seen_users = get_seen_users(account_id)
+        self.daily = settings.speak_daily_compact
+        self.seen_messages = get_seen_messages(account_id) if self.daily else None
+        self.tz = settings.tz
+        self.batch_size = max(1, batch_size or settings.ingest_batch_size)
+        self.flush_interval = flush_interval if flush_interval is not None else settings.ingest_flush_interval
+        self._users: Dict[int, dict] = {}
+        self._speaks: Dict[Tuple, dict] = {}
+        self._checkpoints: Dict[Tuple[int, int], dict] = {}
+        self._last_flush = time.monotonic()
+        self.new_speaks = 0
+        self.per_chat: Dict[int, int] = {}
+        self.flushes = 0
+
+    def __len__(self) -> int:
+        return len(self._speaks)
+
+    def add(
+        self,
+        chat_id: int,
+        tg_user_id: int,
+        username: str | None,
+        first_name: str | None,
+        last_name: str | None,
+        is_bot: bool,
+        message_id: int,
+        message_date: datetime,
+        autoflush: bool = True,
+    ) -> None:
+        """加入一条发言（及其用户）；autoflush 时达到阈值立即写入，否则由调用方决定何时 flush"""
+        prev = self._users.get(tg_user_id)
+        if prev is None:
+            self._users[tg_user_id] = {
+                "tg_user_id": tg_user_id,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+                "is_bot": is_bot,
+            }
+        else:
+            # 与 upsert_user 一致：保留最新的非空 username
+            if username:
+                prev["username"] = username
+            prev["is_bot"] = is_bot
+        speak = {
+            "account_id": self.account_id,
+            "chat_id": chat_id,
+            "tg_user_id": tg_user_id,
+            "message_id": message_id,
+            "message_date": message_date,
+        }
+        if self.daily:
+            if self.seen_messages.add(chat_id, message_id):
+                crud.merge_speak_day(self._speaks, crud.speak_day_row(speak, self.tz))
+        else:
+            self._speaks[(chat_id, tg_user_id, message_id)] = speak
+        if autoflush and self.should_flush():
+            self.flush()
+
+    def add_checkpoint(self, job_id: int, chat_id: int, last_message_id: int | None, state: str, is_done: bool = False) -> None:
+        """记录断点；必须在该断点覆盖的发言 add 之后调用"""
+        self._checkpoints[(job_id, chat_id)] = {
+            "job_id": job_id,
+            "account_id": self.account_id,
+            "chat_id": chat_id,
+            "last_message_id": last_message_id,
+            "state": state,
+            "is_done": is_done,
+        }
+
+    def has_pending(self) -> bool:
+        return bool(self._speaks or self._checkpoints)
+
+    def pending_chats(self) -> set[int]:
+        """缓冲中有发言或断点的群"""
+        return {int(s["chat_id"]) for s in self._speaks.values()} | {int(chat_id) for _, chat_id in self._checkpoints}
+
+    def should_flush(self) -> bool:
+        if not self.has_pending():
+            return False
+        if len(self._speaks) >= self.batch_size:
+            return True
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    def take(self) -> Tuple[list, list, list]:
+        """取出并清空当前缓冲，返回 (需要写库的用户, 发言, 断点)；未变化的用户在这里过滤掉"""
+        self._last_flush = time.monotonic()
+        users = [u for u in self._users.values() if self.seen_users.needs_write(u["tg_user_id"], u["username"], u["is_bot"])]
+        speaks = list(self._speaks.values())
+        checkpoints = list(self._checkpoints.values())
+        self._users.clear()
+        self._speaks.clear()
+        self._checkpoints.clear()
+        return users, speaks, checkpoints
+
+    def write(self, db: Session, users: list, speaks: list, checkpoints: list) -> Tuple[Dict[int, int], bool]:
+        """落库一批数据（可在写线程中执行），返回 ({chat_id: 新插入条数}, 是否批量写入成功)"""
+        try:
+            return crud.ingest_batch(db, users, speaks, checkpoints, daily=self.daily), True
+        except Exception as e:
+            print(f"⚠️ 批量写入失败，回退为逐条写入: {e}")
+            inserted = self._flush_rowwise(db, users, speaks)
+            crud.save_checkpoints(db, checkpoints)
+            return inserted, False
+
+    def record(self, users: list, inserted: Dict[int, int], batched: bool) -> int:
+        """写入完成后更新统计和已落库用户缓存，返回新插入的发言数"""
+        if batched:
+            self.seen_users.mark_persisted(users)
+        self.flushes += 1
+        count = 0
+        for chat_id, n in inserted.items():
+            self.per_chat[chat_id] = self.per_chat.get(chat_id, 0) + n
+            count += n
+        self.new_speaks += count
+        return count
+
+    def flush(self) -> int:
+        """同步写入当前缓冲，返回本次新插入的发言数"""
+        if not self.has_pending():
+            self._last_flush = time.monotonic()
+            return 0
+        users, speaks, checkpoints = self.take()
+        started = time.monotonic()
+        inserted, batched = self.write(self.db, users, speaks, checkpoints)
+        if batched:
+            record_write_latency(time.monotonic() - started)
+        return self.record(users, inserted, batched)
+
+    async def flush_async(self) -> int:
+        """交给单写线程（DB_WRITER 关闭时为线程池）写入，不阻塞事件循环
+
+        分片模式下发言写入各账号自己的库，不经过单写线程，多个账号并行写入。
+        """
+        if not self.has_pending():
+            self._last_flush = time.monotonic()
+            return 0
+        if not get_settings().db_writer or get_shards() is not None:
+            return await asyncio.to_thread(self.flush)
+        users, speaks, checkpoints = self.take()
+        started = time.monotonic()
+        inserted, batched = await db_writer.run(self.write, users, speaks, checkpoints, priority=BACKFILL)
+        if batched:
+            # 包含排队时间：写线程忙于实时写入时，采集并发随之下降
+            record_write_latency(time.monotonic() - started)
+        return self.record(users, inserted, batched)
+
+    def _flush_rowwise(self, db: Session, users: list[dict], speaks: list[dict]) -> Dict[int, int]:
+        inserted: Dict[int, int] = {}
+        for u in users:
+            try:
+                crud.upsert_user(db, **u)
+            except Exception:
+                db.rollback()
+        if self.daily:
+            for s in speaks:
+                try:
+                    for chat_id, n in crud.upsert_speak_days(db, [s]).items():
+                        inserted[chat_id] = inserted.get(chat_id, 0) + n
+                except IntegrityError as e:
+                    # 与 insert_speak 一致：违反约束的单行（如用户未能写入）跳过，其他错误照常抛出
+                    print(f"⚠️ 按日发言写入失败，跳过该行: {e.orig}")
+            return inserted
+        for s in speaks:
+            if crud.insert_speak(db, **s):
+                inserted[s["chat_id"]] = inserted.get(s["chat_id"], 0) + 1
+        return inserted
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .collectors import collect_multi
+from .models import async_session
+from . import async_crud, crud
+
+
+def make_dedup_key(account_ids: List[int], days: int) -> str:
+    raw = json.dumps({"accounts": sorted(set(account_ids)), "days": days})
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def summarize_result(data: dict) -> dict:
+    """把 collect_multi 的返回值压缩成任务结果摘要"""
+    accounts: Dict[str, dict] = {}
+    total_new_speaks = 0
+    failed: List[int] = []
+    for acc_id, res in (data.get("results") or {}).items():
+        if "error" in res:
+            failed.append(int(acc_id))
+            accounts[str(acc_id)] = {"error": res["error"]}
+            continue
+        per_group = res.get("per_group") or {}
+        accounts[str(acc_id)] = {
+            "new_speaks": res.get("new_speaks", 0),
+            "matched_messages": res.get("new_users", 0),
+            "groups": len(per_group),
+            "per_group": {str(k): v for k, v in per_group.items()},
+        }
+        total_new_speaks += res.get("new_speaks", 0)
+    return {
+        "total_new_speaks": total_new_speaks,
+        "failed_accounts": failed,
+        "accounts": accounts,
+        "plan": data.get("plan"),
+    }
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "is_paused": job.is_paused,
+        "account_ids": json.loads(job.account_ids),
+        "days": job.days,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class JobControl:
+    """运行中任务的暂停开关，采集在每页之前检查"""
+
+    def __init__(self, paused: bool = False):
+        self._resume = asyncio.Event()
+        if not paused:
+            self._resume.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resume.is_set()
+
+    def pause(self) -> None:
+        self._resume.clear()
+
+    def resume(self) -> None:
+        self._resume.set()
+
+    async def wait_if_paused(self) -> None:
+        await self._resume.wait()
+
+
+class JobManager:
+    """持久化的采集任务队列
+
+    任务写入 collection_jobs 表，由固定数量的 worker 认领执行：
+    - 相同账号集合 + 天数的任务在 queued/running 时去重，重复点击返回已有任务
+    - 账号有交集的任务不会同时运行，后来的任务排队等待
+    - 进程重启后，上次未完成的 running 任务重新排队，并从各群的采集断点继续
+    """
+
+    def __init__(self):
+        self._wakeup: asyncio.Event | None = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[int, Tuple[asyncio.Task, JobControl, set]] = {}
+
+    async def start(self, workers: int | None = None) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        async with async_session() as db:
+            for job in await async_crud.list_jobs_by_status(db, ["running"]):
+                print(f"♻️ 采集任务 {job.id} 在上次退出时未完成，重新排队")
+                await async_crud.update_job(db, job.id, status="queued")
+        count = max(1, workers or get_settings().job_workers)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(count)]
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        # 取消 worker 会连带取消它正在等待的采集任务，任务重新排队
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # 对外操作
+    async def enqueue(self, db: AsyncSession, account_ids: List[int], days: int) -> Tuple[object, bool]:
+        """入队；已有相同的待执行任务时返回该任务，第二个返回值表示是否被去重"""
+        key = make_dedup_key(account_ids, days)
+        existing = await async_crud.find_pending_job(db, key)
+        if existing is not None:
+            return existing, True
+        job = await async_crud.create_job(db, sorted(set(account_ids)), days, key)
+        self._notify()
+        return job, False
+
+    async def cancel(self, db: AsyncSession, job_id: int) -> Optional[object]:
+        job = await db.run_sync(crud.get_job, job_id)
+        if job is None or job.status not in crud.JOB_PENDING_STATUSES:
+            return job
+        running = self._running.get(job_id)
+        if running is not None:
+            # 由 worker 在任务退出后写入 cancelled
+            running[0].cancel()
+            return job
+        return await async_crud.update_job(db, job_id, status="cancelled", finished_at=datetime.now(timezone.utc))
+
+    async def set_paused(self, db: AsyncSession, job_id: int, paused: bool) -> Optional[object]:
+        job = await db.run_sync(crud.get_job, job_id)
+        if job is None or job.status not in crud.JOB_PENDING_STATUSES:
+            return job
+        job = await async_crud.update_job(db, job_id, is_paused=paused)
+        running = self._running.get(job_id)
+        if running is not None:
+            running[1].pause() if paused else running[1].resume()
+        if not paused:
+            self._notify()
+        return job
+
+    # worker
+    async def _claim(self) -> Optional[Tuple[int, List[int], int, bool]]:
+        busy: set = set()
+        for _, _, accs in self._running.values():
+            busy |= accs
+        async with async_session() as db:
+            for job in await async_crud.list_jobs_by_status(db, ["queued"]):
+                if job.is_paused:
+                    continue
+                accs = set(json.loads(job.account_ids))
+                if accs & busy:
+                    continue
+                await async_crud.update_job(db, job.id, status="running", started_at=datetime.now(timezone.utc), error=None)
+                return job.id, sorted(accs), job.days, job.is_paused
+        return None
+
+    async def _worker(self, idx: int) -> None:
+        while True:
+            claimed = await self._claim()
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*claimed)
+            self._notify()
+
+    async def _run(self, job_id: int, account_ids: List[int], days: int, paused: bool) -> None:
+        print(f"🚀 开始采集任务 {job_id}: 账号 {account_ids}, 天数 {days}")
+        control = JobControl(paused)
+        task = asyncio.create_task(collect_multi(account_ids, days, get_settings().max_concurrency, control=control, job_id=job_id))
+        self._running[job_id] = (task, control, set(account_ids))
+        fields: dict = {}
+        stopping = False
+        try:
+            data = await task
+            summary = summarize_result(data)
+            fields = {"status": "done", "result": json.dumps(summary, ensure_ascii=False)}
+            print(f"✅ 采集任务 {job_id} 完成: 新增发言 {summary['total_new_speaks']}，失败账号 {summary['failed_accounts']}")
+        except asyncio.CancelledError:
+            stopping = asyncio.current_task().cancelling() > 0
+            if stopping:
+                # worker 被取消（服务关闭）：任务重新排队，下次启动继续
+                fields = {"status": "queued"}
+            else:
+                fields = {"status": "cancelled"}
+                print(f"🛑 采集任务 {job_id} 已取消")
+        except Exception as e:
+            fields = {"status": "failed", "error": str(e)}
+            print(f"❌ 采集任务 {job_id} 失败: {e}")
+        finally:
+            self._running.pop(job_id, None)
+            if fields.get("status") != "queued":
+                fields["finished_at"] = datetime.now(timezone.utc)
+            async with async_session() as status_db:
+                await async_crud.update_job(status_db, job_id, **fields)
+                if fields.get("status") != "queued":
+                    # 任务结束后断点不再需要；重新排队的任务保留断点以便续跑
+                    await async_crud.delete_checkpoints(status_db, job_id)
+        if stopping:
+            raise asyncio.CancelledError()
+
+
+job_manager = JobManager()
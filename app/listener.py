@@ -5,11 +5,21 @@ import logging
 from datetime import datetime, timezone
 from typing import Dict, Optional, Set
 from telethon import events, types
+from telethon.utils import get_peer_id
 from telethon.tl.types import User, Channel, Chat
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from .tele_client import get_client_for_account
+from .senders import get_sender_resolver
+from .governor import get_governor
+from .ingest import get_seen_users, get_seen_messages
+from .writer import run_write, REALTIME
+from .admins import admin_cache
+from .peers import peer_store
 from .models import Account, get_db, User as UserModel, Speak
+from .shards import get_shards
+from .quarantine import quarantined_chat_ids
 from . import crud
 from .config import get_settings
 
@@ -17,6 +27,57 @@ from .config import get_settings
 active_listeners: Dict[int, Dict] = {}  # account_id -> listener_info
 listener_stats: Dict[int, Dict] = {}    # account_id -> stats
 
+def save_listener_message(
+    db: Session,
+    account_id: int,
+    chat_id: int,
+    user_id: int,
+    username: str,
+    message_id: int,
+    message_date: datetime,
+    write_user: bool = True,
+) -> None:
+    """在一个事务内保存监听到的用户和发言；分片模式下用户先在主库提交，发言写入账号的分片库
+
+    紧凑采集模式下发言累加到当天的 speak_days 行。
+    """
+    if write_user:
+        crud.upsert_user(
+            db,
+            tg_user_id=user_id,
+            username=username,
+            first_name=None,  # 不保存昵称
+            last_name=None,   # 不保存昵称
+            is_bot=False,     # 已经过滤了机器人
+        )
+    if get_settings().speak_daily_compact:
+        db.commit()
+        crud.upsert_speak_days(db, [crud.speak_day_row({
+            "account_id": account_id,
+            "chat_id": chat_id,
+            "tg_user_id": user_id,
+            "message_id": message_id,
+            "message_date": message_date,
+        })])
+        return
+    speak = Speak(
+        account_id=account_id,
+        chat_id=chat_id,
+        tg_user_id=user_id,
+        message_id=message_id,
+        message_date=message_date,
+    )
+    shards = get_shards()
+    if shards is None:
+        db.add(speak)
+        db.commit()
+        return
+    db.commit()
+    with shards.write_session(account_id) as shard_db:
+        shard_db.add(speak)
+        shard_db.commit()
+
+
 def get_listener_status(account_id: int) -> Dict:
     """获取监听器状态"""
     if account_id not in active_listeners:
@@ -34,12 +95,12 @@ def get_listener_status(account_id: int) -> Dict:
         "start_time": active_listeners[account_id].get("start_time")
     }
 
-async def start_listener_for_account(account_id: int, db: Session) -> dict:
+async def start_listener_for_account(account_id: int, db: AsyncSession) -> dict:
     """为指定账号启动实时监听器"""
     print(f"🎧 启动账号 {account_id} 的实时监听器")
     
     # 检查账号是否存在
-    acc = db.get(Account, account_id)
+    acc = await db.get(Account, account_id)
     if not acc:
         print(f"❌ 账号 {account_id} 不存在")
         return {"error": "account not found"}
@@ -52,17 +113,36 @@ async def start_listener_for_account(account_id: int, db: Session) -> dict:
     print(f"📱 账号信息: {acc.name} ({acc.phone})")
     
     # 获取选中的群组
-    selected_groups = crud.list_selected_groups(db, account_id)
+    selected_groups = await db.run_sync(crud.list_selected_groups, account_id)
     if not selected_groups:
         print(f"❌ 账号 {account_id} 没有选中的群组")
         return {"error": "no selected groups"}
     
     chat_ids = [int(s.chat_id) for s in selected_groups]
+    # 已隔离的群（账号已退出/被封禁/无法解析）不监听
+    quarantined = await db.run_sync(quarantined_chat_ids, account_id)
+    if quarantined:
+        chat_ids = [c for c in chat_ids if c not in quarantined]
+        print(f"🚫 跳过 {len(quarantined)} 个已隔离的群")
+        if not chat_ids:
+            return {"error": "all selected groups are quarantined"}
     print(f"📊 将监听 {len(chat_ids)} 个群组: {chat_ids}")
     
     try:
         # 获取Telegram客户端
         client = await get_client_for_account(acc)
+        resolver = get_sender_resolver(account_id, client)
+        governor = get_governor(account_id)
+        seen_users = get_seen_users(account_id)
+        seen_messages = get_seen_messages(account_id) if get_settings().speak_daily_compact else None
+        # 事件中的群ID（带标记）-> 库中保存的 chat_id
+        chat_map: Dict[int, int] = {}
+        # 实体表中已有的群直接用 InputPeer 注册，不需要联网解析
+        peers = {chat_id: await peer_store.lookup(account_id, chat_id) for chat_id in chat_ids}
+        
+        # 预热管理员缓存：已缓存的直接载入内存，缺失或过期的在后台获取
+        for chat_id in chat_ids:
+            await admin_cache.ensure(client, chat_id, governor, peers[chat_id])
         
         # 初始化统计信息
         listener_stats[account_id] = {
@@ -75,8 +155,8 @@ async def start_listener_for_account(account_id: int, db: Session) -> dict:
         async def handle_new_message(event):
             """处理新消息事件"""
             try:
-                # 获取消息发送者
-                sender = await event.get_sender()
+                # 获取消息发送者：优先使用更新自带的用户实体，缺失时走账号级缓存/批量解析
+                sender = await resolver.resolve_one(event.message)
                 if not sender or not isinstance(sender, types.User):
                     return
                 
@@ -84,10 +164,19 @@ async def start_listener_for_account(account_id: int, db: Session) -> dict:
                 if bool(getattr(sender, "bot", False)):
                     return
                 
+                # 跳过管理员（与采集共用管理员缓存）
+                chat_id = chat_map.get(event.chat_id, event.chat_id)
+                if admin_cache.is_admin(chat_id, int(sender.id)):
+                    return
+                
                 # 只处理有username的用户
                 if not sender.username:
                     return
                 
+                # 紧凑采集模式：采集已计数过的消息直接丢弃
+                if seen_messages is not None and not seen_messages.add(chat_id, event.message.id):
+                    return
+                
                 # 更新消息统计
                 listener_stats[account_id]["total_messages"] += 1
                 
@@ -104,28 +193,22 @@ async def start_listener_for_account(account_id: int, db: Session) -> dict:
                 if not username.startswith('@'):
                     username = '@' + username
                 
-                # 保存用户信息到数据库（只保存@username）
-                with next(get_db()) as db_session:
-                    u = crud.upsert_user(
-                        db_session,
-                        tg_user_id=user_id,
-                        username=username,
-                        first_name=None,  # 不保存昵称
-                        last_name=None,   # 不保存昵称
-                        is_bot=False,     # 已经过滤了机器人
-                    )
-                    
-                    # 保存发言记录
-                    speak_record = Speak(
-                        account_id=account_id,
-                        chat_id=chat_id,
-                        tg_user_id=user_id,
-                        message_id=event.message.id,
-                        message_date=event.message.date
-                    )
-                    db_session.add(speak_record)
-                    
-                    db_session.commit()
+                # 保存用户信息（只保存@username，与上次落库相同时跳过）和发言记录；
+                # 交给写线程的实时通道，排在历史采集的批量写入之前
+                write_user = seen_users.needs_write(user_id, username, False)
+                await run_write(
+                    save_listener_message,
+                    account_id,
+                    chat_id,
+                    user_id,
+                    username,
+                    event.message.id,
+                    event.message.date,
+                    write_user,
+                    priority=REALTIME,
+                )
+                if write_user:
+                    seen_users.mark_persisted([{"tg_user_id": user_id, "username": username, "is_bot": False}])
                 
                 # 更新统计
                 listener_stats[account_id]["new_users"] += 1
@@ -138,16 +221,20 @@ async def start_listener_for_account(account_id: int, db: Session) -> dict:
         # 注册事件处理器 - 监听指定群组的新消息
         for chat_id in chat_ids:
             try:
-                # 尝试不同的ID格式
-                entity_id = chat_id
-                if chat_id > 0:
-                    # 对于正数ID，尝试Channel格式
-                    entity_id = -1000000000000 - chat_id
+                peer = peers[chat_id]
+                if peer is not None:
+                    entity_id = get_peer_id(peer)
+                else:
+                    # 实体表中没有记录（群组尚未刷新），按旧规则猜测：正数ID按Channel格式
+                    entity_id = chat_id
+                    if chat_id > 0:
+                        entity_id = -1000000000000 - chat_id
                 
                 client.add_event_handler(
                     handle_new_message,
-                    events.NewMessage(chats=entity_id)
+                    events.NewMessage(chats=peer if peer is not None else entity_id)
                 )
+                chat_map[entity_id] = chat_id
                 print(f"✅ 已注册监听器: 群组 {chat_id} (实体ID: {entity_id})")
             except Exception as e:
                 print(f"⚠️ 注册群组 {chat_id} 监听器失败: {e}")
@@ -10,16 +10,26 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from .config import get_settings
-from .models import get_db, Account
-from . import crud
+from .models import get_db, get_async_db, get_read_db, dispose_async_engine, Account
+from . import crud, models
 from .tele_client import get_client_for_account, release_all_clients
-from .collectors import refresh_groups_for_account, collect_multi, get_progress
+from .governor import get_governor, get_all_governors_status
+from .quarantine import failure_to_dict, quarantined_chat_ids, recheck_chat
+from .concurrency import get_concurrency_status
+from .pipeline import get_pipeline_status
+from .ingest import get_seen_users_status, get_seen_messages_status, clear_seen_users
+from .writer import db_writer, get_writer_status
+from .shards import dispose_shards, get_shards
+from .speak_migration import start_background_migration
+from .collectors import refresh_groups_for_account, get_progress
+from .jobs import job_manager, job_to_dict
 from .listener import start_listener_for_account, stop_listener_for_account, get_listener_status, get_all_listeners_status, stop_all_listeners
 from .utils import parse_range_to_utc_window
-from .schemas import APIResponse, AccountCreate, AccountUpdate, GroupSelect, CollectRequest, SessionInitRequest, SessionVerifyRequest, LoginRequest, LoginResponse
+from .schemas import APIResponse, AccountCreate, AccountUpdate, GroupSelect, CollectRequest, QuarantineAction, SessionInitRequest, SessionVerifyRequest, LoginRequest, LoginResponse
 from .auth import authenticate_user, create_access_token, get_current_user
 from telethon import errors
 from telethon import TelegramClient
@@ -35,10 +45,29 @@ templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 _session_states: Dict[str, dict] = {}
 
 
+@app.on_event("startup")
+async def on_startup():
+    # 旧格式的 speaks（文本时间）在后台分批迁移；打开主库和已有分片，登记需要迁移的库
+    start_background_migration()
+    models._init_engine_and_session()
+    shards = get_shards()
+    if shards is not None:
+        for account_id in shards.account_ids():
+            shards.write_session(account_id).close()
+    if get_settings().db_writer:
+        db_writer.start()
+    await job_manager.start()
+
+
 @app.on_event("shutdown")
 async def on_shutdown():
+    await job_manager.stop()
     await stop_all_listeners()
     await release_all_clients()
+    # 最后停止写线程，已提交的写入全部落库
+    await db_writer.stop()
+    await dispose_async_engine()
+    dispose_shards()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -98,13 +127,13 @@ def api_delete_account(account_id: int, db: Session = Depends(get_db), current_u
 
 
 @app.post("/api/accounts/{account_id}/test-session", response_model=APIResponse)
-async def api_test_session(account_id: int, db: Session = Depends(get_db)):
-    acc = db.get(Account, account_id)
+async def api_test_session(account_id: int, db: AsyncSession = Depends(get_async_db)):
+    acc = await db.get(Account, account_id)
     if not acc:
         return APIResponse(ok=False, error="account not found")
     try:
         client = await get_client_for_account(acc)
-        authorized = await client.is_user_authorized()
+        authorized = await get_governor(account_id).call(client.is_user_authorized)
         return APIResponse(ok=True, data={"authorized": bool(authorized)})
     except Exception as e:
         return APIResponse(ok=False, error=str(e))
@@ -268,7 +297,7 @@ async def api_session_verify(payload: SessionVerifyRequest):
 
 # Groups
 @app.post("/api/accounts/{account_id}/refresh-groups", response_model=APIResponse)
-async def api_refresh_groups(account_id: int, db: Session = Depends(get_db)):
+async def api_refresh_groups(account_id: int, db: AsyncSession = Depends(get_async_db)):
     data = await refresh_groups_for_account(account_id, db)
     if "error" in data:
         return APIResponse(ok=False, error=data["error"])
@@ -297,52 +326,118 @@ def api_list_selected_groups(account_id: int, db: Session = Depends(get_db)):
 
 # Collect
 @app.post("/api/collect", response_model=APIResponse)
-async def api_collect(payload: CollectRequest, current_user: str = Depends(get_current_user)):
+async def api_collect(payload: CollectRequest, db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user)):
     try:
         print(f"🔍 收到采集请求: days={payload.days} accounts={payload.accounts}")
-        settings = get_settings()
         
-        # 确定要采集的账号ID
+        # 确定要采集的账号ID；未指定时在入队时取所有启用的账号
         account_ids = payload.accounts if payload.accounts and len(payload.accounts) > 0 else None
+        if account_ids is None:
+            account_ids = [a.id for a in await db.run_sync(crud.list_accounts) if a.is_enabled]
+        if not account_ids:
+            return APIResponse(ok=False, error="没有可采集的账号")
         
         print(f"📋 将要采集的账号ID: {account_ids}")
         print(f"📅 采集天数: {payload.days}")
         
-        # 启动后台任务，立即返回
-        asyncio.create_task(run_collection_task(account_ids, payload.days, settings.max_concurrency))
-        
-        return APIResponse(ok=True, data={"message": "采集任务已启动", "accounts": account_ids})
+        # 写入任务队列，立即返回；相同账号和天数的任务未完成时直接返回已有任务
+        job, deduplicated = await job_manager.enqueue(db, account_ids, payload.days)
+        message = "已有相同的采集任务在执行" if deduplicated else "采集任务已加入队列"
+        return APIResponse(ok=True, data={
+            "message": message,
+            "accounts": account_ids,
+            "job_id": job.id,
+            "status": job.status,
+            "deduplicated": deduplicated,
+        })
     except Exception as e:
         print(f"❌ 采集过程中出错: {e}")
         import traceback
         traceback.print_exc()
         return APIResponse(ok=False, error=str(e))
 
-async def run_collection_task(account_ids: Optional[List[int]], days: int, max_concurrency: int):
-    """后台运行采集任务"""
+
+# Jobs API
+@app.get("/api/jobs", response_model=APIResponse)
+def api_list_jobs(status: Optional[str] = None, limit: int = 50, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    """列出采集任务，最新的在前"""
     try:
-        print(f"🚀 开始后台采集任务: 账号 {account_ids}, 天数 {days}")
-        # 创建新的数据库会话用于后台任务
-        import app.models
-        from app.models import _init_engine_and_session
-        from . import crud
-        _init_engine_and_session()  # 确保数据库引擎已初始化
-        db = app.models.SessionLocal()
-        try:
-            # 如果没有指定账号，获取所有启用的账号
-            if account_ids is None:
-                accs = [a for a in crud.list_accounts(db) if a.is_enabled]
-                account_ids = [a.id for a in accs]
-                print(f"📋 获取到的账号ID: {account_ids}")
-            
-            data = await collect_multi(account_ids, days, db, max_concurrency)
-            print(f"✅ 后台采集完成: {data}")
-        finally:
-            db.close()
+        jobs = crud.list_jobs(db, status, limit)
+        return APIResponse(ok=True, data={"jobs": [job_to_dict(j) for j in jobs]})
     except Exception as e:
-        print(f"❌ 后台采集过程中出错: {e}")
-        import traceback
-        traceback.print_exc()
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.get("/api/jobs/{job_id}", response_model=APIResponse)
+def api_get_job(job_id: int, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    job = crud.get_job(db, job_id)
+    if not job:
+        return APIResponse(ok=False, error="job not found")
+    return APIResponse(ok=True, data=job_to_dict(job))
+
+
+@app.post("/api/jobs/{job_id}/cancel", response_model=APIResponse)
+async def api_cancel_job(job_id: int, db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user)):
+    job = await job_manager.cancel(db, job_id)
+    if not job:
+        return APIResponse(ok=False, error="job not found")
+    return APIResponse(ok=True, data=job_to_dict(job))
+
+
+@app.post("/api/jobs/{job_id}/pause", response_model=APIResponse)
+async def api_pause_job(job_id: int, db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user)):
+    job = await job_manager.set_paused(db, job_id, True)
+    if not job:
+        return APIResponse(ok=False, error="job not found")
+    return APIResponse(ok=True, data=job_to_dict(job))
+
+
+@app.post("/api/jobs/{job_id}/resume", response_model=APIResponse)
+async def api_resume_job(job_id: int, db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user)):
+    job = await job_manager.set_paused(db, job_id, False)
+    if not job:
+        return APIResponse(ok=False, error="job not found")
+    return APIResponse(ok=True, data=job_to_dict(job))
+
+
+# Quarantine API
+@app.get("/api/quarantine", response_model=APIResponse)
+def api_list_quarantine(account_id: Optional[int] = None, include_backoff: bool = False, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    """列出已隔离的群及最后一次错误；include_backoff 时同时列出仍在退避中的群"""
+    try:
+        rows = crud.list_chat_failures(db, account_id, quarantined_only=not include_backoff)
+        return APIResponse(ok=True, data={"chats": [failure_to_dict(r) for r in rows]})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.post("/api/quarantine/recheck", response_model=APIResponse)
+async def api_recheck_quarantine(payload: QuarantineAction, db: AsyncSession = Depends(get_async_db), current_user: str = Depends(get_current_user)):
+    """立即重试访问：成功的群解除隔离，失败的群保持隔离"""
+    acc = await db.run_sync(crud.get_account, payload.account_id)
+    if not acc:
+        return APIResponse(ok=False, error="account not found")
+    chat_ids = payload.chat_ids if payload.chat_ids is not None else sorted(await db.run_sync(quarantined_chat_ids, acc.id))
+    try:
+        client = await get_client_for_account(acc)
+        governor = get_governor(acc.id)
+        results = [await recheck_chat(client, db, acc.id, int(c), governor) for c in chat_ids]
+        return APIResponse(ok=True, data={"results": results})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.post("/api/quarantine/prune", response_model=APIResponse)
+def api_prune_quarantine(payload: QuarantineAction, db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+    """把已隔离的群从账号的选中群组中移除，并清除失败记录"""
+    try:
+        quarantined = quarantined_chat_ids(db, payload.account_id)
+        chat_ids = [int(c) for c in payload.chat_ids if int(c) in quarantined] if payload.chat_ids is not None else sorted(quarantined)
+        unselected = crud.unselect_groups(db, payload.account_id, chat_ids)
+        crud.delete_chat_failures(db, payload.account_id, chat_ids)
+        return APIResponse(ok=True, data={"pruned": chat_ids, "unselected": unselected})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
 
 
 # Progress API
@@ -356,9 +451,55 @@ def api_get_progress(account_id: int):
         return APIResponse(ok=False, error=str(e))
 
 
+@app.get("/api/governors", response_model=APIResponse)
+def api_get_governors():
+    """获取各账号请求速率调节器的状态"""
+    try:
+        return APIResponse(ok=True, data={"governors": get_all_governors_status()})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.get("/api/concurrency", response_model=APIResponse)
+def api_get_concurrency():
+    """获取跨账号采集并发的当前上限及每次调整的原因"""
+    try:
+        return APIResponse(ok=True, data=get_concurrency_status())
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.get("/api/pipeline", response_model=APIResponse)
+def api_get_pipeline():
+    """获取正在采集的账号流水线各阶段的队列深度与耗时"""
+    try:
+        return APIResponse(ok=True, data={"pipelines": get_pipeline_status()})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.get("/api/writer", response_model=APIResponse)
+def api_get_writer():
+    """获取写线程各优先级通道的排队数与平均等待/执行耗时"""
+    try:
+        return APIResponse(ok=True, data=get_writer_status())
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
+@app.get("/api/user-cache", response_model=APIResponse)
+def api_get_user_cache():
+    """获取各账号已落库用户缓存的大小与命中/未命中次数，用于调整 SEEN_USERS_CACHE_SIZE；
+    紧凑采集模式下 messages 为已计数消息缓存的状态（SEEN_MESSAGES_CACHE_SIZE）"""
+    try:
+        return APIResponse(ok=True, data={"accounts": get_seen_users_status(), "messages": get_seen_messages_status()})
+    except Exception as e:
+        return APIResponse(ok=False, error=str(e))
+
+
 # Statistics API
 @app.get("/api/stats", response_model=APIResponse)
-def api_get_stats(db: Session = Depends(get_db)):
+def api_get_stats(db: Session = Depends(get_read_db)):
     """获取采集统计信息"""
     try:
         from sqlalchemy import text
@@ -369,8 +510,11 @@ def api_get_stats(db: Session = Depends(get_db)):
         # 有用户名的用户数
         users_with_username = db.execute(text("SELECT COUNT(*) FROM users WHERE username IS NOT NULL AND username != ''")).scalar()
         
+        # 按账号的发言统计（分片模式下汇总各分片）
+        speak_stats = crud.speak_stats_by_account(db)
+        
         # 总发言数
-        total_speaks = db.execute(text("SELECT COUNT(*) FROM speaks")).scalar()
+        total_speaks = sum(speaks for _, speaks in speak_stats.values())
         
         # 最近采集的用户（最新10个）
         recent_users = db.execute(text("""
@@ -382,13 +526,11 @@ def api_get_stats(db: Session = Depends(get_db)):
         """)).fetchall()
         
         # 按账号统计
-        account_stats = db.execute(text("""
-            SELECT a.name, COUNT(DISTINCT s.tg_user_id) as user_count, COUNT(s.id) as speak_count
-            FROM accounts a
-            LEFT JOIN speaks s ON a.id = s.account_id
-            GROUP BY a.id, a.name
-            ORDER BY user_count DESC
-        """)).fetchall()
+        account_stats = sorted(
+            ((a.name, *speak_stats.get(a.id, (0, 0))) for a in crud.list_accounts(db)),
+            key=lambda row: row[1],
+            reverse=True,
+        )
         
         stats = {
             "total_users": total_users,
@@ -418,13 +560,16 @@ def api_get_stats(db: Session = Depends(get_db)):
 
 # Export TXT
 @app.get("/api/export/txt")
-def api_export_txt(range: str, account_id: Optional[int] = None, chat_id: Optional[int] = None, db: Session = Depends(get_db)):
+def api_export_txt(range: str, account_id: Optional[int] = None, chat_id: Optional[int] = None, db: Session = Depends(get_read_db)):
     settings = get_settings()
     try:
         start_utc, end_utc = parse_range_to_utc_window(range, settings.tz)
     except Exception as e:
         return PlainTextResponse(str(e), status_code=400)
-    usernames = crud.get_usernames_in_window(db, start_utc, end_utc, account_id=account_id, chat_id=chat_id)
+    try:
+        usernames = crud.get_usernames_in_window(db, start_utc, end_utc, account_id=account_id, chat_id=chat_id)
+    except Exception as e:
+        return PlainTextResponse(f"导出失败: {str(e)}", status_code=500)
     
     # 确保所有用户名都以@开头，并按单列格式输出
     formatted_usernames = []
@@ -444,7 +589,7 @@ def api_export_txt(range: str, account_id: Optional[int] = None, chat_id: Option
 
 # Export listener collected usernames
 @app.get("/api/export/listener-usernames/{account_id}")
-def api_export_listener_usernames(account_id: int, db: Session = Depends(get_db)):
+def api_export_listener_usernames(account_id: int, db: Session = Depends(get_read_db)):
     """下载指定账户监听器收集到的用户名"""
     from fastapi.responses import Response
     from datetime import datetime, timedelta
@@ -454,7 +599,10 @@ def api_export_listener_usernames(account_id: int, db: Session = Depends(get_db)
     start_time = end_time - timedelta(hours=24)
     
     # 获取该账户在指定时间范围内收集的用户名
-    usernames = crud.get_usernames_in_window(db, start_time, end_time, account_id=account_id)
+    try:
+        usernames = crud.get_usernames_in_window(db, start_time, end_time, account_id=account_id)
+    except Exception as e:
+        return PlainTextResponse(f"导出失败: {str(e)}", status_code=500)
     
     if not usernames:
         content = "# 暂无监听收集到的用户名\n"
@@ -479,10 +627,10 @@ def api_export_listener_usernames(account_id: int, db: Session = Depends(get_db)
 
 # Listener API endpoints
 @app.post("/api/accounts/{account_id}/start-listener", response_model=APIResponse)
-async def api_start_listener(account_id: int, db: Session = Depends(get_db)):
+async def api_start_listener(account_id: int, db: AsyncSession = Depends(get_async_db)):
     """启动指定账户的实时监听"""
     try:
-        account = crud.get_account(db, account_id)
+        account = await db.run_sync(crud.get_account, account_id)
         if not account:
             return APIResponse(ok=False, error="账户不存在")
         
@@ -544,6 +692,8 @@ def api_cleanup_database(db: Session = Depends(get_db), current_user: str = Depe
     """整理数据库：去重复、提取@username、删除无效数据"""
     try:
         result = crud.cleanup_database(db)
+        # 用户被删除或改写，已落库用户缓存作废
+        clear_seen_users()
         return APIResponse(ok=True, data={
             "message": "数据库整理完成",
             "details": result
@@ -553,7 +703,7 @@ def api_cleanup_database(db: Session = Depends(get_db), current_user: str = Depe
 
 
 @app.get("/api/export/cleaned-usernames")
-def api_export_cleaned_usernames(db: Session = Depends(get_db), current_user: str = Depends(get_current_user)):
+def api_export_cleaned_usernames(db: Session = Depends(get_read_db), current_user: str = Depends(get_current_user)):
     """下载整理后的@username列表"""
     from fastapi.responses import Response
     from datetime import datetime
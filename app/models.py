@@ -1,19 +1,26 @@
 from __future__ import annotations
 
+import math
+import os
+import time
 from datetime import datetime, timezone
 from sqlalchemy import (
     BigInteger,
     Boolean,
     Column,
     DateTime,
+    Float,
     ForeignKey,
     Integer,
     String,
     Text,
     UniqueConstraint,
     Index,
+    TypeDecorator,
     create_engine,
+    event,
 )
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
 from .config import get_settings
 
@@ -25,6 +32,39 @@ def utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
 
+class EpochDateTime(TypeDecorator):
+    """SQLite 中以整数 Unix 秒存储的 UTC 时间；其它数据库仍为 timestamptz
+
+    Python 一侧读写的都是带时区的 datetime。不带时区的值视为 UTC。写入时向上取整到秒：
+    消息时间本身是整秒，窗口查询的 >= start / < end 对取整后的边界仍然精确。
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(Integer())
+        return dialect.type_descriptor(DateTime(timezone=True))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        if isinstance(value, (int, float)):
+            return int(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return math.ceil(value.timestamp())
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        if isinstance(value, str):
+            # 尚未迁移的旧行（文本时间）
+            parsed = datetime.fromisoformat(value)
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
 class Account(Base):
     __tablename__ = "accounts"
 
@@ -85,17 +125,50 @@ class Speak(Base):
     chat_id = Column(BigInteger, nullable=False)
     tg_user_id = Column(BigInteger, ForeignKey("users.tg_user_id", ondelete="CASCADE"), nullable=False)
     message_id = Column(Integer, nullable=False)
-    message_date = Column(DateTime(timezone=True), nullable=False)
+    message_date = Column(EpochDateTime, nullable=False)
 
+    # 时间窗口导出（全部 / 按账号 / 按群）各有一个以时间为范围列的组合索引，前两个覆盖查询不回表；
+    # ix_speak_user 用于按用户删除
     __table_args__ = (
         UniqueConstraint("account_id", "chat_id", "tg_user_id", "message_id", name="uq_speak_unique"),
-        Index("ix_speak_account", "account_id"),
-        Index("ix_speak_chat", "chat_id"),
-        Index("ix_speak_date", "message_date"),
+        Index("ix_speak_date_user", "message_date", "tg_user_id"),
+        Index("ix_speak_account_date", "account_id", "message_date", "tg_user_id"),
+        Index("ix_speak_chat_date", "chat_id", "message_date"),
         Index("ix_speak_user", "tg_user_id"),
     )
 
 
+class SpeakDay(Base):
+    """紧凑采集模式（SPEAK_DAILY_COMPACT）的发言：每个 (账号, 群, 用户, 自然日) 一行
+
+    message_id / message_date 是当天最早的一条消息，message_count 为当天计入的消息数。
+    自然日按 TZ 时区划分，时间窗口按 day 过滤，与窗口有交集的自然日整天计入：
+    按整天划分的窗口与逐条记录的 speaks 结果相同，3d/7d 等窗口会扩展到起止时刻所在的整天。
+    """
+    __tablename__ = "speak_days"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    tg_user_id = Column(BigInteger, ForeignKey("users.tg_user_id", ondelete="CASCADE"), nullable=False)
+    day = Column(Integer, nullable=False)
+    message_id = Column(Integer, nullable=False)
+    message_date = Column(EpochDateTime, nullable=False)
+    message_count = Column(Integer, default=1, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "chat_id", "tg_user_id", "day", name="uq_speak_day_unique"),
+        Index("ix_speak_day_day_user", "day", "tg_user_id"),
+        Index("ix_speak_day_account_day", "account_id", "day", "tg_user_id"),
+        Index("ix_speak_day_chat_day", "chat_id", "day"),
+        Index("ix_speak_day_user", "tg_user_id"),
+    )
+
+
+# 旧版 speaks 的单列索引，已被上面的组合索引覆盖，迁移时删除
+LEGACY_SPEAK_INDEXES = ("ix_speak_account", "ix_speak_chat", "ix_speak_date")
+
+
 class CollectionProgress(Base):
     __tablename__ = "collection_progress"
 
@@ -115,8 +188,206 @@ class CollectionProgress(Base):
     )
 
 
+class PeerEntity(Base):
+    """账号可访问的会话实体（类型、ID、access_hash），重启后无需网络即可构造 InputPeer"""
+    __tablename__ = "peer_entities"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    peer_id = Column(BigInteger, nullable=False)  # 带标记的 ID：频道/超级群 -100xxx，普通群 -xxx
+    peer_type = Column(String(16), nullable=False)  # channel / chat / user
+    access_hash = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "peer_id", name="uq_peer_account_peer"),
+    )
+
+
+class ChatFailure(Base):
+    """账号访问群失败的记录：按失败次数指数退避，多次失败后隔离"""
+    __tablename__ = "chat_failures"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)  # 连续失败次数，成功后清除记录
+    last_error = Column(Text, nullable=True)
+    last_failure_at = Column(DateTime(timezone=True), nullable=False)
+    next_retry_at = Column(DateTime(timezone=True), nullable=True)  # 此前不再尝试；隔离且只允许手动重试时为空
+    is_quarantined = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "chat_id", name="uq_failure_account_chat"),
+        Index("ix_failure_quarantined", "is_quarantined"),
+    )
+
+
+class ChatMetadata(Base):
+    """群的规模与活跃度，刷新群组和采集时更新，用于估算采集耗时"""
+    __tablename__ = "chat_metadata"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, unique=True, index=True, nullable=False)
+    is_channel = Column(Boolean, default=False, nullable=False)  # 超级群：消息ID在群内全局一致
+    participants_count = Column(Integer, nullable=True)
+    top_message_id = Column(Integer, nullable=True)
+    top_message_date = Column(DateTime(timezone=True), nullable=True)
+    messages_per_day = Column(Float, nullable=True)  # 观测到的日消息量（滑动平均）
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+
+class ChatAdmins(Base):
+    """群管理员ID集合的缓存，超过 ADMIN_CACHE_TTL 后重新获取"""
+    __tablename__ = "chat_admins"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(BigInteger, unique=True, index=True, nullable=False)
+    admin_ids = Column(Text, nullable=False)  # JSON 数组
+    fetched_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+
+
+class CollectionCoverage(Base):
+    """每个 (账号, 群) 已完整采集过的连续消息区间"""
+    __tablename__ = "collection_coverage"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    min_message_id = Column(Integer, nullable=True)
+    max_message_id = Column(Integer, nullable=True)
+    covered_from = Column(DateTime(timezone=True), nullable=False)   # 区间起点（采集窗口开始时间）
+    covered_until = Column(DateTime(timezone=True), nullable=False)  # 区间终点（最近一次采集完成时间）
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("account_id", "chat_id", name="uq_coverage_account_chat"),
+    )
+
+
+class CollectionJob(Base):
+    """采集任务队列：queued -> running -> done / failed / cancelled"""
+    __tablename__ = "collection_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String(16), default="queued", nullable=False)
+    is_paused = Column(Boolean, default=False, nullable=False)
+    account_ids = Column(Text, nullable=False)  # JSON 数组，入队时已确定
+    days = Column(Integer, nullable=False)
+    dedup_key = Column(String(128), nullable=False)
+    result = Column(Text, nullable=True)  # JSON 结果摘要
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_job_status", "status"),
+        Index("ix_job_dedup", "dedup_key", "status"),
+    )
+
+
+class CollectionCheckpoint(Base):
+    """采集断点：每个 (任务, 账号, 群) 已落库的扫描进度，进程中断后任务从这里继续"""
+    __tablename__ = "collection_checkpoints"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, ForeignKey("collection_jobs.id", ondelete="CASCADE"), nullable=False)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    last_message_id = Column(Integer, nullable=True)  # 最后一条已落库的消息ID
+    state = Column(Text, nullable=True)  # JSON：各区间已扫描范围与已完成区间
+    is_done = Column(Boolean, default=False, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("job_id", "account_id", "chat_id", name="uq_checkpoint_job_account_chat"),
+    )
+
+
 _engine = None
 SessionLocal = None
+_async_engine = None
+AsyncSessionLocal = None
+_read_engine = None
+ReadSessionLocal = None
+
+# 同步驱动 -> 对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def sqlite_pragmas(settings, read_only: bool = False) -> list[str]:
+    """SQLite 每个新连接要执行的 PRAGMA；SQLITE_TUNING 关闭时为空
+
+    只读连接不修改日志模式（只读打开的文件无法切换），并禁止任何写入。
+    """
+    if read_only:
+        pragmas = ["PRAGMA query_only=1"]
+    else:
+        pragmas = []
+    if not settings.sqlite_tuning:
+        return pragmas
+    if not read_only:
+        pragmas += [
+            f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+            f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        ]
+    return pragmas + [
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}",
+        f"PRAGMA cache_size={int(settings.sqlite_cache_size)}",
+        f"PRAGMA temp_store={settings.sqlite_temp_store}",
+    ]
+
+
+def apply_sqlite_pragmas(engine, settings=None, read_only: bool = False) -> None:
+    """在 engine 的每个新连接上执行 SQLite PRAGMA；非 SQLite 数据库不做处理"""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = sqlite_pragmas(settings or get_settings(), read_only)
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for pragma in pragmas:
+                cur.execute(pragma)
+        finally:
+            cur.close()
+
+
+def engine_options(db_url: str, settings=None) -> dict:
+    """create_engine 的连接池参数；SQLite 保持 SQLAlchemy 默认"""
+    if make_url(db_url).get_backend_name() == "sqlite":
+        return {}
+    settings = settings or get_settings()
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+
+
+def async_engine_options(db_url: str, settings=None) -> dict:
+    """异步引擎的连接池参数：SQLite 按采集并发确定连接池大小，其他数据库同 engine_options
+
+    采集时每个并发账号的每个并发群都可能同时持有一个短暂的会话，默认的 5+10 个连接在账号较多时会耗尽。
+    """
+    settings = settings or get_settings()
+    if make_url(db_url).get_backend_name() != "sqlite":
+        return engine_options(db_url, settings)
+    accounts = max(1, settings.concurrency_max, settings.max_concurrency)
+    return {
+        "pool_size": max(5, accounts),
+        "max_overflow": accounts * max(1, settings.group_concurrency),
+    }
 
 
 def _init_engine_and_session():
@@ -124,9 +395,12 @@ def _init_engine_and_session():
     if _engine is not None:
         return
     settings = get_settings()
-    _engine = create_engine(settings.db_url, future=True)
+    _engine = create_engine(settings.db_url, future=True, **engine_options(settings.db_url, settings))
+    apply_sqlite_pragmas(_engine, settings)
     SessionLocal = sessionmaker(bind=_engine, autoflush=False, autocommit=False, future=True)
     Base.metadata.create_all(_engine)
+    from .speak_migration import register_speaks
+    register_speaks("主库", _engine)
 
 
 def get_db():
@@ -135,4 +409,131 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def read_db_url(settings) -> str | None:
+    """只读连接串：优先 DB_READ_URL；SQLite 文件库以 mode=ro 打开同一文件；内存库返回 None（与主库共用）"""
+    if settings.db_read_url:
+        return settings.db_read_url
+    url = make_url(settings.db_url)
+    if url.get_backend_name() != "sqlite":
+        return settings.db_url
+    database = url.database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return url.set(
+        database=f"file:{os.path.abspath(database)}",
+        query={**url.query, "mode": "ro", "uri": "true"},
+    ).render_as_string(hide_password=False)
+
+
+def apply_query_timeout(engine, seconds: float) -> None:
+    """限制 engine 上每条查询的执行时间，超时的查询被中断并抛出 OperationalError
+
+    SQLite 通过 progress handler 检查截止时间（含取结果的过程）；Postgres 使用 statement_timeout（见 _read_engine_options）。
+    """
+    if seconds <= 0 or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _install(dbapi_conn, record):
+        info = record.info
+
+        def _check():
+            deadline = info.get("query_deadline")
+            return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+        dbapi_conn.set_progress_handler(_check, 10000)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.connection.info["query_deadline"] = time.monotonic() + seconds
+
+    @event.listens_for(engine, "checkin")
+    def _clear(dbapi_conn, record):
+        record.info["query_deadline"] = None
+
+
+def _read_engine_options(db_url: str, settings) -> dict:
+    backend = make_url(db_url).get_backend_name()
+    if backend == "sqlite":
+        return {}
+    options = {**engine_options(db_url, settings), "pool_size": settings.db_read_pool_size}
+    if backend == "postgresql":
+        # 连接级只读事务 + 语句超时
+        flags = "-c default_transaction_read_only=on"
+        if settings.read_query_timeout > 0:
+            flags += f" -c statement_timeout={int(settings.read_query_timeout * 1000)}"
+        options["connect_args"] = {"options": flags}
+    return options
+
+
+def _init_read_engine():
+    """导出/统计使用的只读引擎与会话工厂；没有可用的只读连接时退回主库会话"""
+    global _read_engine, ReadSessionLocal
+    if ReadSessionLocal is not None:
+        return
+    # 确保表已由主引擎创建（SQLite 只读模式不能建库）
+    _init_engine_and_session()
+    settings = get_settings()
+    url = read_db_url(settings)
+    if url is None:
+        ReadSessionLocal = SessionLocal
+        return
+    _read_engine = create_engine(url, future=True, **_read_engine_options(url, settings))
+    apply_sqlite_pragmas(_read_engine, settings, read_only=True)
+    apply_query_timeout(_read_engine, settings.read_query_timeout)
+    ReadSessionLocal = sessionmaker(bind=_read_engine, autoflush=False, autocommit=False, future=True)
+
+
+def get_read_db():
+    """只读会话依赖：用于导出和统计接口"""
+    _init_read_engine()
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def async_db_url(db_url: str) -> str:
+    """由 DB_URL 推出异步驱动的连接串：sqlite -> aiosqlite，postgresql -> asyncpg"""
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise NotImplementedError(f"async engine not supported for database: {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def _init_async_engine():
+    """异步引擎与会话工厂；表结构仍由同步引擎创建"""
+    global _async_engine, AsyncSessionLocal
+    if _async_engine is not None:
+        return
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    _init_engine_and_session()
+    settings = get_settings()
+    _async_engine = create_async_engine(async_db_url(settings.db_url), **async_engine_options(settings.db_url, settings))
+    apply_sqlite_pragmas(_async_engine.sync_engine, settings)
+    # 提交后不过期：对象在会话之外读取属性时不会触发隐式 IO
+    AsyncSessionLocal = async_sessionmaker(bind=_async_engine, autoflush=False, expire_on_commit=False)
+
+
+def async_session():
+    """新建一个异步会话；每个并发任务各用一个，async with 结束时关闭"""
+    _init_async_engine()
+    return AsyncSessionLocal()
+
+
+async def get_async_db():
+    async with async_session() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    global _async_engine, AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = None
+    AsyncSessionLocal = None
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+from telethon import types
+from telethon.utils import get_peer_id, resolve_id
+
+from .models import async_session
+from .writer import write_in_background
+from . import async_crud, crud
+
+
+def canonical_peer_id(entity) -> int:
+    """带标记的会话ID：超级群/频道 -100xxx，普通群 -xxx，用户为正数"""
+    return int(get_peer_id(entity))
+
+
+def candidate_peer_ids(chat_id: int) -> List[int]:
+    """旧数据中保存的是未标记的正数ID，依次尝试超级群和普通群两种标记形式"""
+    chat_id = int(chat_id)
+    if chat_id < 0:
+        return [chat_id]
+    return [-1000000000000 - chat_id, -chat_id]
+
+
+def is_channel_peer(entity) -> bool:
+    """超级群/频道（消息ID在群内全局一致）；实体和 InputPeer 都可以判断"""
+    return isinstance(entity, (types.Channel, types.ChannelForbidden, types.InputPeerChannel, types.InputChannel))
+
+
+def peer_record(entity) -> dict | None:
+    """从实体或 InputPeer 提取需要持久化的字段；无法构造 InputPeer 的返回 None"""
+    if isinstance(entity, (types.Channel, types.ChannelForbidden, types.InputPeerChannel)):
+        peer_type, access_hash = "channel", getattr(entity, "access_hash", None)
+        if access_hash is None:
+            return None
+    elif isinstance(entity, (types.Chat, types.ChatForbidden, types.InputPeerChat)):
+        peer_type, access_hash = "chat", None
+    elif isinstance(entity, (types.User, types.InputPeerUser)):
+        peer_type, access_hash = "user", getattr(entity, "access_hash", None)
+        if access_hash is None:
+            return None
+    else:
+        return None
+    return {"peer_id": canonical_peer_id(entity), "peer_type": peer_type, "access_hash": access_hash}
+
+
+def to_input_peer(peer_id: int, peer_type: str, access_hash: int | None):
+    raw, _ = resolve_id(int(peer_id))
+    if peer_type == "channel":
+        return types.InputPeerChannel(channel_id=raw, access_hash=int(access_hash))
+    if peer_type == "chat":
+        return types.InputPeerChat(chat_id=raw)
+    return types.InputPeerUser(user_id=raw, access_hash=int(access_hash))
+
+
+class PeerStore:
+    """按账号持久化的会话实体表：内存 + peer_entities 表
+
+    access_hash 只对获取到它的账号有效，因此按 (账号, 带标记的ID) 存储。
+    刷新群组或首次联网解析成功时写入，之后解析群组只查本地，重启后仍然有效。
+    """
+
+    def __init__(self):
+        self._mem: Dict[Tuple[int, int], Tuple[str, int | None]] = {}
+        self.stats = {"hits": 0, "misses": 0, "saved": 0}
+
+    async def remember(self, account_id: int, entity) -> int | None:
+        """保存实体并返回带标记的ID；无法持久化的实体返回 None"""
+        rec = peer_record(entity)
+        if rec is None:
+            return None
+        await self.remember_many(account_id, [entity])
+        return rec["peer_id"]
+
+    async def remember_many(self, account_id: int, entities: Iterable) -> int:
+        """批量保存，一次写库；返回写入（新增或变化）的条数"""
+        rows: List[dict] = []
+        for entity in entities:
+            rec = peer_record(entity)
+            if rec is None:
+                continue
+            key = (account_id, rec["peer_id"])
+            value = (rec["peer_type"], rec["access_hash"])
+            if self._mem.get(key) == value:
+                continue
+            self._mem[key] = value
+            rows.append(rec)
+        if rows:
+            # 内存中已是最新值，落库交给写线程在后台完成
+            write_in_background(crud.upsert_peers, account_id, rows)
+            self.stats["saved"] += len(rows)
+        return len(rows)
+
+    async def _lookup(self, account_id: int, peer_ids: List[int]) -> Tuple[int, str, int | None] | None:
+        for peer_id in peer_ids:
+            value = self._mem.get((account_id, peer_id))
+            if value is not None:
+                return peer_id, value[0], value[1]
+        async with async_session() as db:
+            rows = await async_crud.get_peers(db, account_id, peer_ids)
+        for peer_id in peer_ids:
+            row = rows.get(peer_id)
+            if row is not None:
+                self._mem[(account_id, peer_id)] = (row.peer_type, row.access_hash)
+                return peer_id, row.peer_type, row.access_hash
+        return None
+
+    async def lookup(self, account_id: int, chat_id: int):
+        """本地取该账号可用的 InputPeer，不发网络请求；没有记录返回 None"""
+        found = await self._lookup(account_id, candidate_peer_ids(chat_id))
+        if found is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return to_input_peer(*found)
+
+    async def canonical_id(self, account_id: int, chat_id: int) -> int | None:
+        """旧的未标记ID换成带标记的ID；不认识的返回 None"""
+        found = await self._lookup(account_id, candidate_peer_ids(chat_id))
+        return found[0] if found is not None else None
+
+    def snapshot(self) -> dict:
+        return {"peers": len(self._mem), **self.stats}
+
+
+peer_store = PeerStore()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import csv
+import io
+from typing import Iterable, Sequence
+
+from sqlalchemy.orm import Session
+
+from .models import User, Speak, utcnow
+
+# 每个连接私有的临时暂存表：不写 WAL，事务提交时自动清空，多个写者之间互不干扰
+STAGE_USERS = "_stage_users"
+STAGE_SPEAKS = "_stage_speaks"
+USER_COLUMNS = ("tg_user_id", "username", "first_name", "last_name", "is_bot")
+SPEAK_COLUMNS = ("account_id", "chat_id", "tg_user_id", "message_id", "message_date")
+
+_CREATE_STAGING = (
+    f"CREATE TEMP TABLE IF NOT EXISTS {STAGE_USERS} ("
+    "tg_user_id bigint, username text, first_name text, last_name text, is_bot boolean"
+    ") ON COMMIT DELETE ROWS",
+    f"CREATE TEMP TABLE IF NOT EXISTS {STAGE_SPEAKS} ("
+    "account_id integer, chat_id bigint, tg_user_id bigint, message_id integer, message_date timestamptz"
+    ") ON COMMIT DELETE ROWS",
+)
+
+# 与 crud.bulk_upsert_users 语义一致：username 仅在非空时覆盖，昵称只在新建时写入，is_bot 总是更新
+_MERGE_USERS = f"""
+INSERT INTO {User.__tablename__} (tg_user_id, username, first_name, last_name, is_bot, created_at, updated_at)
+SELECT tg_user_id, username, first_name, last_name, is_bot, %(now)s, %(now)s FROM {STAGE_USERS}
+ON CONFLICT (tg_user_id) DO UPDATE SET
+    username = COALESCE(NULLIF(EXCLUDED.username, ''), {User.__tablename__}.username),
+    is_bot = EXCLUDED.is_bot,
+    updated_at = EXCLUDED.updated_at
+"""
+
+_MERGE_SPEAKS = f"""
+INSERT INTO {Speak.__tablename__} ({", ".join(SPEAK_COLUMNS)})
+SELECT {", ".join(SPEAK_COLUMNS)} FROM {STAGE_SPEAKS}
+ON CONFLICT DO NOTHING
+RETURNING chat_id
+"""
+
+
+def _csv_value(v):
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return "t" if v else "f"
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return v
+
+
+def _copy_rows(cur, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> None:
+    """COPY ... FROM STDIN (CSV) 写入暂存表；空字段按 NULL 处理。兼容 psycopg2 和 psycopg 3"""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    if hasattr(cur, "copy_expert"):
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        for row in rows:
+            writer.writerow([_csv_value(v) for v in row])
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+    else:
+        with cur.copy(sql.replace(" WITH (FORMAT csv)", "")) as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def copy_users_and_speaks(db: Session, users: Sequence[dict], speaks: Sequence[dict]) -> dict[int, int]:
+    """COPY 到暂存表后用 INSERT ... SELECT ... ON CONFLICT 合并到 users/speaks（不提交事务）
+
+    只用于 Postgres。在会话当前的事务内执行，调用方提交或回滚。返回 {chat_id: 实际新插入条数}。
+    """
+    raw = db.connection().connection.dbapi_connection
+    inserted: dict[int, int] = {}
+    cur = raw.cursor()
+    try:
+        # 建表放在同一事务内：事务回滚时临时表也随之消失，下次重新创建
+        for ddl in _CREATE_STAGING:
+            cur.execute(ddl)
+        if users:
+            # 同一条语句不能两次更新同一行：同一用户以最后一条为准
+            unique = {u["tg_user_id"]: u for u in users}.values()
+            _copy_rows(cur, STAGE_USERS, USER_COLUMNS, (
+                (u["tg_user_id"], u.get("username"), u.get("first_name"), u.get("last_name"), bool(u.get("is_bot", False)))
+                for u in unique
+            ))
+            cur.execute(_MERGE_USERS, {"now": utcnow()})
+        if speaks:
+            _copy_rows(cur, STAGE_SPEAKS, SPEAK_COLUMNS, (tuple(s[c] for c in SPEAK_COLUMNS) for s in speaks))
+            cur.execute(_MERGE_SPEAKS)
+            for (chat_id,) in cur.fetchall():
+                inserted[int(chat_id)] = inserted.get(int(chat_id), 0) + 1
+    finally:
+        cur.close()
+    return inserted
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+from .config import get_settings
+from .ingest import IngestBuffer
+
+# 页队列结束标记
+_DONE = object()
+
+
+class _Barrier:
+    """写入队列中的屏障：之前的批次全部写入后完成；chat_id 的发言写入失败时以该错误失败"""
+
+    __slots__ = ("future", "chat_id")
+
+    def __init__(self, future: asyncio.Future, chat_id: int):
+        self.future = future
+        self.chat_id = chat_id
+
+
+class StageStats:
+    """单个阶段的计数与耗时"""
+
+    def __init__(self):
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.errors = 0
+
+    def add(self, started: float, items: int = 1) -> None:
+        self.items += items
+        self.busy_seconds += time.monotonic() - started
+
+    def snapshot(self) -> dict:
+        avg_ms = self.busy_seconds * 1000 / self.items if self.items else 0.0
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "avg_ms": round(avg_ms, 2),
+            "errors": self.errors,
+        }
+
+
+class AccountPipeline:
+    """单个账号的采集流水线：抓取页 -> 过滤 -> 批量写入
+
+    - 抓取（fetch）：每个群一个任务预取历史页，放入该群的有界页队列
+    - 过滤（filter）：解析发送者并按 机器人/管理员/时间窗口 过滤，结果放入账号级有界写入队列
+    - 写入（persist）：账号内唯一的写入任务，把批次交给单写线程（见 writer.DBWriter）落库，不阻塞下一页的下载
+    队列有界：数据库跟不上时写入队列先满，过滤阶段阻塞，页队列随之填满，抓取阶段停止请求新页。
+    批量写入失败不会中止写入任务：失败批次涉及的群记下错误，之后不再记录它们的断点，
+    该群的 barrier 以此错误失败，调用方据此不记录覆盖区间。
+    """
+
+    def __init__(self, account_id: int, buffer: IngestBuffer, page_queue_size: int | None = None, write_queue_size: int | None = None):
+        settings = get_settings()
+        self.account_id = account_id
+        self.buffer = buffer
+        self.page_queue_size = max(1, page_queue_size or settings.pipeline_page_queue)
+        self.write_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, write_queue_size or settings.pipeline_write_queue))
+        self.page_queues: Dict[int, asyncio.Queue] = {}
+        self.stages = {"fetch": StageStats(), "filter": StageStats(), "persist": StageStats()}
+        self.max_depth = {"page": 0, "write": 0}
+        self._flush_lock = asyncio.Lock()
+        self._persist_task: asyncio.Task | None = None
+        self._failed: Dict[int, Exception] = {}  # 发言写入失败的群 -> 错误
+
+    # 写入阶段
+    def start(self) -> None:
+        if self._persist_task is None:
+            self._persist_task = asyncio.create_task(self._persist_loop())
+        active_pipelines[self.account_id] = self
+
+    async def close(self) -> None:
+        if self._persist_task is not None:
+            await self.write_queue.put(_DONE)
+            await self._persist_task
+            self._persist_task = None
+        if active_pipelines.get(self.account_id) is self:
+            del active_pipelines[self.account_id]
+
+    async def submit(self, rows: List[dict], checkpoint: dict | None = None) -> None:
+        """把过滤后的一批发言（及其之后的断点）交给写入阶段；队列满时等待（背压）"""
+        await self.write_queue.put((rows, checkpoint))
+        self.max_depth["write"] = max(self.max_depth["write"], self.write_queue.qsize())
+
+    async def barrier(self, chat_id: int) -> None:
+        """等待此前提交的所有发言落库；该群有发言写入失败时抛出当时的错误"""
+        fut = asyncio.get_running_loop().create_future()
+        await self.write_queue.put(_Barrier(fut, chat_id))
+        await fut
+
+    async def _flush(self) -> None:
+        """写入当前缓冲；失败时记下涉及的群而不抛出，写入任务继续处理后续批次"""
+        async with self._flush_lock:
+            if not self.buffer.has_pending():
+                return
+            started = time.monotonic()
+            rows = len(self.buffer)
+            chats = self.buffer.pending_chats()
+            try:
+                await self.buffer.flush_async()
+            except Exception as e:
+                self.stages["persist"].errors += 1
+                for chat_id in chats:
+                    self._failed.setdefault(chat_id, e)
+                print(f"❌ 账号 {self.account_id} 批量写入失败，{len(chats)} 个群本次不记录覆盖区间: {e}")
+                return
+            self.stages["persist"].add(started, rows)
+
+    async def _persist_loop(self) -> None:
+        while True:
+            try:
+                item = await asyncio.wait_for(self.write_queue.get(), timeout=self.buffer.flush_interval or None)
+            except asyncio.TimeoutError:
+                # 空闲时按时间阈值写入
+                await self._flush()
+                continue
+            if item is _DONE:
+                await self._flush()
+                return
+            if isinstance(item, _Barrier):
+                await self._flush()
+                error = self._failed.pop(item.chat_id, None)
+                if not item.future.done():
+                    if error is None:
+                        item.future.set_result(None)
+                    else:
+                        item.future.set_exception(error)
+                continue
+            rows, checkpoint = item
+            for row in rows:
+                self.buffer.add(**row, autoflush=False)
+            # 已有发言丢失的群不再前移断点，否则续跑时会跳过丢失的消息
+            if checkpoint is not None and checkpoint["chat_id"] not in self._failed:
+                self.buffer.add_checkpoint(**checkpoint)
+            if self.buffer.should_flush():
+                await self._flush()
+
+    # 抓取 + 过滤阶段
+    async def run_group(
+        self,
+        chat_id: int,
+        pages: AsyncIterator,
+        process_page: Callable[[object], Awaitable[List[dict] | None]],
+        checkpoint: Callable[[], dict | None] | None = None,
+    ) -> bool:
+        """运行一个群的 抓取 -> 过滤 两个阶段，过滤结果提交给写入阶段
+
+        checkpoint: 每页处理后调用，返回需要记录的断点（或 None），与该页发言一起提交。
+
+        返回 False 表示过滤阶段出错中止：出错页之后的页全部丢弃，避免覆盖区间出现空洞。
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_queue_size)
+        self.page_queues[chat_id] = queue
+        aborted = asyncio.Event()
+
+        async def fetch():
+            try:
+                while not aborted.is_set():
+                    started = time.monotonic()
+                    try:
+                        item = await pages.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    self.stages["fetch"].add(started)
+                    await queue.put(item)
+                    self.max_depth["page"] = max(self.max_depth["page"], queue.qsize())
+            finally:
+                await queue.put(_DONE)
+
+        async def filter_pages():
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if aborted.is_set():
+                    continue
+                if chat_id in self._failed:
+                    # 该群已有发言写入失败，本次不会记录覆盖区间，剩余页不再抓取
+                    aborted.set()
+                    continue
+                started = time.monotonic()
+                try:
+                    rows = await process_page(item)
+                except Exception as e:
+                    self.stages["filter"].errors += 1
+                    print(f"  ❌ 群 {chat_id} 处理消息页失败，停止该群本次采集: {e}")
+                    aborted.set()
+                    continue
+                self.stages["filter"].add(started)
+                cp = checkpoint() if checkpoint is not None else None
+                if rows or cp is not None:
+                    await self.submit(rows or [], cp)
+
+        try:
+            await asyncio.gather(fetch(), filter_pages())
+        finally:
+            self.page_queues.pop(chat_id, None)
+            await pages.aclose()
+        return not aborted.is_set()
+
+    def snapshot(self) -> dict:
+        return {
+            "account_id": self.account_id,
+            "queues": {
+                "page": {chat_id: q.qsize() for chat_id, q in self.page_queues.items()},
+                "page_max": self.max_depth["page"],
+                "write": self.write_queue.qsize(),
+                "write_max": self.max_depth["write"],
+                "buffered_rows": len(self.buffer),
+            },
+            "stages": {name: st.snapshot() for name, st in self.stages.items()},
+        }
+
+
+active_pipelines: Dict[int, AccountPipeline] = {}
+
+
+def get_pipeline_status() -> Dict:
+    return {account_id: p.snapshot() for account_id, p in active_pipelines.items()}
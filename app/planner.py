@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List
+
+from sqlalchemy.orm import Session
+
+from .utils import ensure_utc
+from . import crud
+
+# 用最近多少天的入库消息估算群的日消息量
+RATE_WINDOW_DAYS = 7
+# 没有历史数据的群按每天这么多条消息估算
+DEFAULT_DAILY_MESSAGES = 100.0
+# 每个群固定开销（获取实体、管理员列表），折算成消息条数
+PER_CHAT_OVERHEAD = 200.0
+# 只知道成员数时，按每个成员每天这么多条消息粗略估算
+MESSAGES_PER_MEMBER_DAY = 0.1
+
+
+class CollectionPlan:
+    """一次采集的群分配结果：每个群只分给一个账号"""
+
+    def __init__(self):
+        self.assignments: Dict[int, List[int]] = {}
+        self.load: Dict[int, float] = {}
+        self.chats: Dict[int, dict] = {}
+
+    def assign(self, chat_id: int, account_id: int, cost: float, candidates: Iterable[int], reason: str) -> None:
+        self.assignments.setdefault(account_id, []).append(chat_id)
+        self.load[account_id] = self.load.get(account_id, 0.0) + cost
+        self.chats[chat_id] = {
+            "account_id": account_id,
+            "candidates": sorted(candidates),
+            "cost": round(cost, 1),
+            "reason": reason,
+        }
+
+    def chats_for(self, account_id: int) -> List[int]:
+        return self.assignments.get(account_id, [])
+
+    def snapshot(self) -> dict:
+        shared = sum(1 for c in self.chats.values() if len(c["candidates"]) > 1)
+        return {
+            "chats": len(self.chats),
+            "shared_chats": shared,
+            "load": {acc: round(v, 1) for acc, v in self.load.items()},
+            "assignments": {acc: list(chats) for acc, chats in self.assignments.items()},
+        }
+
+
+def load_chat_rates(db: Session, chat_ids: List[int], now: datetime) -> tuple[Dict[int, float], Dict[int, object]]:
+    """估算各群日消息量：元数据中的观测值 > 最近入库的消息数 > 成员数 > 默认值；同时返回元数据"""
+    metadata = crud.get_chat_metadata(db, chat_ids)
+    counts = crud.count_recent_messages_by_chat(db, chat_ids, now - timedelta(days=RATE_WINDOW_DAYS))
+    rates: Dict[int, float] = {}
+    for c in chat_ids:
+        meta = metadata.get(c)
+        if meta is not None and meta.messages_per_day:
+            rates[c] = float(meta.messages_per_day)
+        elif counts.get(c):
+            rates[c] = counts[c] / RATE_WINDOW_DAYS
+        elif meta is not None and meta.participants_count:
+            rates[c] = max(1.0, meta.participants_count * MESSAGES_PER_MEMBER_DAY)
+        else:
+            rates[c] = DEFAULT_DAILY_MESSAGES
+    return rates, metadata
+
+
+def estimate_cost(rate: float, cov, start_utc: datetime, now: datetime, meta=None) -> float:
+    """估算某账号采集某群的消息条数：有覆盖区间时只需补采缺口
+
+    超级群已知最新消息ID时，向后增量部分直接用消息ID之差计算。
+    """
+    days = (now - start_utc).total_seconds() / 86400
+    if cov is None or cov.max_message_id is None or ensure_utc(cov.covered_until) < start_utc:
+        return PER_CHAT_OVERHEAD + rate * days
+    if meta is not None and meta.is_channel and meta.top_message_id and meta.top_message_date:
+        since_top = max(0.0, (now - ensure_utc(meta.top_message_date)).total_seconds() / 86400)
+        missing = max(0, meta.top_message_id - cov.max_message_id) + rate * since_top
+    else:
+        missing = rate * max(0.0, (now - ensure_utc(cov.covered_until)).total_seconds() / 86400)
+    covered_from = ensure_utc(cov.covered_from)
+    if start_utc < covered_from:
+        missing += rate * (covered_from - start_utc).total_seconds() / 86400
+    return PER_CHAT_OVERHEAD + missing
+
+
+def estimate_chat_costs(db: Session, account_id: int, chat_ids: List[int], days: int, now: datetime | None = None) -> Dict[int, float]:
+    """估算账号采集各群的消息条数，用于排序和进度"""
+    now = now or datetime.now(timezone.utc)
+    rates, metadata = load_chat_rates(db, chat_ids, now)
+    start_utc = now - timedelta(days=days)
+    return {c: estimate_cost(rates[c], crud.get_coverage(db, account_id, c), start_utc, now, metadata.get(c)) for c in chat_ids}
+
+
+def plan_collection(db: Session, account_ids: List[int], days: int, job_id: int | None = None, now: datetime | None = None) -> CollectionPlan:
+    """把各账号选中的群去重后分配给账号
+
+    - 候选账号：本次参与采集、且选中了该群或在该群中（groups 表）的账号；访问该群失败后处于退避/隔离中的账号除外
+    - 任务续跑时，已有断点的群留给原账号
+    - 其余按预计消息量从大到小（LPT）分给 当前负载 + 该账号采集成本 最小的候选账号；
+      已有覆盖区间的账号只需增量采集，成本低，因此同一个群倾向于留在原账号
+    """
+    now = now or datetime.now(timezone.utc)
+    start_utc = now - timedelta(days=days)
+    plan = CollectionPlan()
+    for acc_id in account_ids:
+        plan.load[acc_id] = 0.0
+    selected, members = crud.list_chat_candidates(db, account_ids)
+    chat_ids = list(selected)
+    if not chat_ids:
+        return plan
+
+    blocked = crud.list_blocked_chats(db, account_ids, now)
+    candidates = {c: {a for a in selected[c] | members.get(c, set()) if (a, c) not in blocked} for c in chat_ids}
+    chat_ids = [c for c in chat_ids if candidates[c]]
+    if not chat_ids:
+        return plan
+    rates, metadata = load_chat_rates(db, chat_ids, now)
+    coverage = {(int(cov.account_id), int(cov.chat_id)): cov for cov in crud.list_coverage_for_chats(db, chat_ids)}
+
+    def cost(acc_id: int, chat_id: int) -> float:
+        return estimate_cost(rates[chat_id], coverage.get((acc_id, chat_id)), start_utc, now, metadata.get(chat_id))
+
+    pending = set(chat_ids)
+    if job_id is not None:
+        for cp in crud.list_job_checkpoints(db, job_id):
+            chat_id, acc_id = int(cp.chat_id), int(cp.account_id)
+            if chat_id in pending and acc_id in candidates[chat_id]:
+                plan.assign(chat_id, acc_id, cost(acc_id, chat_id), candidates[chat_id], "checkpoint")
+                pending.discard(chat_id)
+
+    order = sorted(pending, key=lambda c: max(cost(a, c) for a in candidates[c]), reverse=True)
+    for chat_id in order:
+        best = min(
+            candidates[chat_id],
+            key=lambda a: (plan.load.get(a, 0.0) + cost(a, chat_id), (a, chat_id) not in coverage, a not in selected[chat_id], a),
+        )
+        reason = "covered" if (best, chat_id) in coverage else ("selected" if best in selected[chat_id] else "member")
+        plan.assign(chat_id, best, cost(best, chat_id), candidates[chat_id], reason)
+    return plan
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+
+from telethon import errors
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+from .utils import ensure_utc
+from . import crud
+
+# 账号已退出、被封禁、群不存在或无法解析：重试多次也不会成功的错误
+ACCESS_ERRORS = (
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.ChannelPublicGroupNaError,
+    errors.ChatIdInvalidError,
+    errors.ChatForbiddenError,
+    errors.PeerIdInvalidError,
+    errors.UserBannedInChannelError,
+    ValueError,  # Telethon 找不到实体时抛出
+)
+
+
+def is_access_error(e: BaseException) -> bool:
+    return isinstance(e, ACCESS_ERRORS)
+
+
+def retry_delay(failures: int) -> float:
+    """第 n 次失败后的等待秒数：CHAT_FAILURE_BACKOFF * 2^(n-1)，不超过自动重试间隔"""
+    settings = get_settings()
+    cap = settings.chat_quarantine_recheck or 7 * 86400
+    return min(settings.chat_failure_backoff * 2 ** max(0, failures - 1), max(cap, settings.chat_failure_backoff))
+
+
+def record_failure(db: Session, account_id: int, chat_id: int, error: str, now: datetime | None = None):
+    """记录一次访问失败；连续失败达到 CHAT_QUARANTINE_AFTER 次后隔离"""
+    settings = get_settings()
+    now = now or datetime.now(timezone.utc)
+    prev = crud.get_chat_failures(db, account_id, [chat_id]).get(chat_id)
+    failures = (prev.failures if prev is not None else 0) + 1
+    quarantined = failures >= max(1, settings.chat_quarantine_after)
+    if quarantined:
+        recheck = settings.chat_quarantine_recheck
+        next_retry = now + timedelta(seconds=recheck) if recheck > 0 else None
+        if prev is None or not prev.is_quarantined:
+            print(f"  🚫 账号 {account_id} 访问群 {chat_id} 连续失败 {failures} 次，已隔离: {error}")
+    else:
+        next_retry = now + timedelta(seconds=retry_delay(failures))
+        print(f"  ⏸️ 账号 {account_id} 访问群 {chat_id} 失败（第 {failures} 次），{next_retry.isoformat()} 前不再尝试: {error}")
+    return crud.save_chat_failure(
+        db,
+        account_id,
+        chat_id,
+        failures=failures,
+        last_error=error,
+        last_failure_at=now,
+        next_retry_at=next_retry,
+        is_quarantined=quarantined,
+    )
+
+
+def record_success(db: Session, account_id: int, chat_id: int) -> None:
+    if crud.delete_chat_failures(db, account_id, [chat_id]):
+        print(f"  ✅ 账号 {account_id} 恢复访问群 {chat_id}，清除失败记录")
+
+
+def filter_blocked(db: Session, account_id: int, chat_ids: Iterable[int], now: datetime | None = None) -> tuple[List[int], List[int]]:
+    """去掉仍在退避或隔离中的群；隔离到期的群放行一次作为自动重试。返回 (可采集, 被跳过)"""
+    now = now or datetime.now(timezone.utc)
+    blocked = {c for _, c in crud.list_blocked_chats(db, [account_id], now)}
+    allowed = [c for c in chat_ids if c not in blocked]
+    return allowed, [c for c in chat_ids if c in blocked]
+
+
+def quarantined_chat_ids(db: Session, account_id: int) -> set[int]:
+    return {int(f.chat_id) for f in crud.list_chat_failures(db, account_id, quarantined_only=True)}
+
+
+def failure_to_dict(row) -> dict:
+    return {
+        "account_id": row.account_id,
+        "chat_id": row.chat_id,
+        "failures": row.failures,
+        "last_error": row.last_error,
+        "last_failure_at": ensure_utc(row.last_failure_at).isoformat() if row.last_failure_at else None,
+        "next_retry_at": ensure_utc(row.next_retry_at).isoformat() if row.next_retry_at else None,
+        "is_quarantined": row.is_quarantined,
+    }
+
+
+async def recheck_chat(client, db: AsyncSession, account_id: int, chat_id: int, governor=None) -> dict:
+    """立即联网检查账号能否访问该群：成功清除记录，失败计入一次失败"""
+    from .collectors import resolve_group_entity
+    from .peers import peer_store
+    try:
+        entity = await resolve_group_entity(client, chat_id, governor, account_id)
+        if entity is None:
+            raise ValueError("无法解析群组实体")
+        # 本地实体表命中时只得到 InputPeer，再请求一次完整实体以确认仍有访问权限
+        entity = await (governor.call(client.get_entity, entity) if governor is not None else client.get_entity(entity))
+        if getattr(entity, "left", False):
+            raise ValueError("账号已退出该群")
+    except errors.FloodWaitError as e:
+        return {"chat_id": chat_id, "ok": False, "error": f"FloodWait {e.seconds}s，稍后再试"}
+    except Exception as e:
+        if not is_access_error(e):
+            # 临时错误不计入失败次数
+            return {"chat_id": chat_id, "ok": False, "error": f"{str(e) or type(e).__name__}，稍后再试"}
+        row = await db.run_sync(record_failure, account_id, chat_id, str(e) or type(e).__name__)
+        return {"chat_id": chat_id, "ok": False, "error": row.last_error, "is_quarantined": row.is_quarantined}
+    await peer_store.remember(account_id, entity)
+    await db.run_sync(record_success, account_id, chat_id)
+    return {"chat_id": chat_id, "ok": True}
@@ -32,6 +32,11 @@ class CollectRequest(BaseModel):
     accounts: Optional[List[int]] = None
 
 
+class QuarantineAction(BaseModel):
+    account_id: int
+    chat_ids: Optional[List[int]] = None  # 为空时作用于该账号全部已隔离的群
+
+
 class ExportQuery(BaseModel):
     range: str
     account_id: Optional[int] = None
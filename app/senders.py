@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+from telethon import errors, functions, types
+
+from .config import get_settings
+from .governor import get_governor
+
+# GetUsersRequest 单次最多接受的用户数
+GET_USERS_BATCH = 100
+
+
+class SenderResolver:
+    """消息发送者解析层（每个账号一个）
+
+    解析顺序：
+    1. 历史页/更新自带的 users（Telethon 已填入 msg.sender，且不是 min 用户）——无网络请求
+    2. 账号内有界 LRU 缓存
+    3. 仍缺失的发送者按最多 100 个合并成一次 users.GetUsers，
+       通过 InputUserFromMessage 引用消息获取，无需事先知道 access_hash
+    """
+
+    def __init__(self, client, max_size: int | None = None, governor=None):
+        self.client = client
+        self.governor = governor
+        self.max_size = max(1, max_size or get_settings().sender_cache_size)
+        self._cache: OrderedDict[int, types.User] = OrderedDict()
+        self.stats = {"page_hits": 0, "cache_hits": 0, "fetched": 0, "requests": 0, "unresolved": 0}
+
+    def remember(self, user) -> None:
+        """写入 LRU；min 用户信息不完整，不缓存"""
+        if not isinstance(user, types.User) or getattr(user, "min", False):
+            return
+        uid = int(user.id)
+        self._cache[uid] = user
+        self._cache.move_to_end(uid)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def get_cached(self, user_id: int) -> types.User | None:
+        user = self._cache.get(user_id)
+        if user is not None:
+            self._cache.move_to_end(user_id)
+        return user
+
+    async def resolve(self, messages: Iterable, input_chat=None) -> Dict[int, types.User]:
+        """解析一页消息的发送者，返回 {sender_id: User}；频道/匿名发送者不在结果中"""
+        resolved: Dict[int, types.User] = {}
+        missing: Dict[int, types.InputUserFromMessage] = {}
+        for msg in messages:
+            sender_id = getattr(msg, "sender_id", None)
+            if not sender_id or sender_id < 0 or sender_id in resolved:
+                continue
+            sender = getattr(msg, "sender", None)
+            if isinstance(sender, types.User) and not getattr(sender, "min", False):
+                self.stats["page_hits"] += 1
+                self.remember(sender)
+                resolved[sender_id] = sender
+                continue
+            cached = self.get_cached(sender_id)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                resolved[sender_id] = cached
+                continue
+            if sender_id not in missing:
+                peer = input_chat or getattr(msg, "input_chat", None)
+                if peer is not None:
+                    missing[sender_id] = types.InputUserFromMessage(peer=peer, msg_id=int(msg.id), user_id=int(sender_id))
+                elif isinstance(sender, types.User):
+                    # 拿不到会话的输入实体时，退而使用页内的 min 用户信息
+                    resolved[sender_id] = sender
+        if missing:
+            resolved.update(await self._fetch(list(missing.values())))
+        for msg in messages:
+            sender_id = getattr(msg, "sender_id", None)
+            if sender_id and sender_id > 0 and sender_id not in resolved:
+                # 批量请求失败时保留页内的 min 用户，避免整页丢失
+                sender = getattr(msg, "sender", None)
+                if isinstance(sender, types.User):
+                    resolved[sender_id] = sender
+                else:
+                    self.stats["unresolved"] += 1
+        return resolved
+
+    async def resolve_one(self, msg, input_chat=None) -> types.User | None:
+        resolved = await self.resolve([msg], input_chat)
+        return resolved.get(getattr(msg, "sender_id", None))
+
+    async def _fetch(self, input_users: List[types.InputUserFromMessage]) -> Dict[int, types.User]:
+        result: Dict[int, types.User] = {}
+        for i in range(0, len(input_users), GET_USERS_BATCH):
+            chunk = input_users[i:i + GET_USERS_BATCH]
+            try:
+                self.stats["requests"] += 1
+                request = functions.users.GetUsersRequest(id=chunk)
+                if self.governor is None:
+                    users = await self.client(request)
+                else:
+                    users = await self.governor.call(self.client, request, retries=0, flood_sleep_threshold=0)
+            except errors.FloodWaitError as e:
+                # 调节器已记录并暂停该账号；本页其余发送者退回页内的 min 用户信息，不中断整个群的采集
+                print(f"⚠️ 批量获取发送者触发 FloodWait {e.seconds} 秒，剩余 {len(input_users) - i} 个发送者暂不解析")
+                break
+            except Exception as e:
+                print(f"⚠️ 批量获取发送者失败: {e}")
+                continue
+            for u in users:
+                if isinstance(u, types.User):
+                    self.stats["fetched"] += 1
+                    self.remember(u)
+                    result[int(u.id)] = u
+        return result
+
+
+_resolvers: Dict[int, SenderResolver] = {}
+
+
+def get_sender_resolver(account_id: int, client) -> SenderResolver:
+    """获取账号的发送者解析器；客户端重建时换新的解析器"""
+    resolver = _resolvers.get(account_id)
+    if resolver is None or resolver.client is not client:
+        resolver = SenderResolver(client, governor=get_governor(account_id))
+        _resolvers[account_id] = resolver
+    return resolver
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List
+
+from sqlalchemy import BigInteger, Column, Index, Integer, MetaData, Table, UniqueConstraint, create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from .config import get_settings
+from .models import EpochDateTime, Speak, SpeakDay, apply_query_timeout, apply_sqlite_pragmas
+from .speak_migration import register_speaks
+
+# 分片库里只有 speaks 和 speak_days 两张表：列与主库相同，crud 中针对 Speak 的语句可以直接在分片会话上执行；
+# 没有外键（users/accounts 在主库），也不需要按账号的索引
+shard_metadata = MetaData()
+shard_speaks = Table(
+    Speak.__tablename__,
+    shard_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("account_id", Integer, nullable=False),
+    Column("chat_id", BigInteger, nullable=False),
+    Column("tg_user_id", BigInteger, nullable=False),
+    Column("message_id", Integer, nullable=False),
+    Column("message_date", EpochDateTime, nullable=False),
+    UniqueConstraint("account_id", "chat_id", "tg_user_id", "message_id", name="uq_speak_unique"),
+    Index("ix_speak_date_user", "message_date", "tg_user_id"),
+    Index("ix_speak_chat_date", "chat_id", "message_date"),
+    Index("ix_speak_user", "tg_user_id"),
+)
+shard_speak_days = Table(
+    SpeakDay.__tablename__,
+    shard_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("account_id", Integer, nullable=False),
+    Column("chat_id", BigInteger, nullable=False),
+    Column("tg_user_id", BigInteger, nullable=False),
+    Column("day", Integer, nullable=False),
+    Column("message_id", Integer, nullable=False),
+    Column("message_date", EpochDateTime, nullable=False),
+    Column("message_count", Integer, nullable=False, default=1),
+    UniqueConstraint("account_id", "chat_id", "tg_user_id", "day", name="uq_speak_day_unique"),
+    Index("ix_speak_day_day_user", "day", "tg_user_id"),
+    Index("ix_speak_day_chat_day", "chat_id", "day"),
+    Index("ix_speak_day_user", "tg_user_id"),
+)
+
+SHARD_FILE = re.compile(r"^speaks_(\d+)\.sqlite3$")
+# 主库以只读方式挂载到每个分片连接上，分片内的查询可以直接 JOIN users
+CENTRAL_SCHEMA = "central"
+
+
+def _sqlite_path(db_url: str) -> str | None:
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite":
+        return None
+    database = url.database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return os.path.abspath(database)
+
+
+class ShardSet:
+    """按账号分片的发言库：每个账号的 speaks 写入 SHARD_DIR/speaks_<账号ID>.sqlite3
+
+    用户、账号等共享数据留在主库。每个分片有独立的写锁，多个账号的采集写入不再互相等待。
+    写连接和只读连接（mode=ro，带 READ_QUERY_TIMEOUT）分开建池，两者都以只读方式挂载主库。
+    """
+
+    def __init__(self, directory: str, central_path: str):
+        self.directory = os.path.abspath(directory)
+        self.central_path = central_path
+        self._write: Dict[int, sessionmaker] = {}
+        self._read: Dict[int, sessionmaker] = {}
+        self._engines: List[Engine] = []
+        self._lock = threading.Lock()
+
+    def path(self, account_id: int) -> str:
+        return os.path.join(self.directory, f"speaks_{int(account_id)}.sqlite3")
+
+    def account_ids(self) -> List[int]:
+        """已有分片文件的账号"""
+        if not os.path.isdir(self.directory):
+            return []
+        ids = []
+        for name in os.listdir(self.directory):
+            m = SHARD_FILE.match(name)
+            if m:
+                ids.append(int(m.group(1)))
+        return sorted(ids)
+
+    def _engine(self, account_id: int, read_only: bool) -> Engine:
+        settings = get_settings()
+        mode = "&mode=ro" if read_only else ""
+        engine = create_engine(f"sqlite:///file:{self.path(account_id)}?uri=true{mode}", future=True)
+        apply_sqlite_pragmas(engine, settings, read_only=read_only)
+        if read_only:
+            apply_query_timeout(engine, settings.read_query_timeout)
+        central = f"file:{self.central_path}?mode=ro"
+
+        @event.listens_for(engine, "connect")
+        def _attach(dbapi_conn, _record):
+            dbapi_conn.execute(f"ATTACH DATABASE ? AS {CENTRAL_SCHEMA}", (central,))
+
+        self._engines.append(engine)
+        return engine
+
+    def write_session(self, account_id: int) -> Session:
+        """账号分片的读写会话；分片不存在时创建"""
+        factory = self._write.get(account_id)
+        if factory is None:
+            with self._lock:
+                factory = self._write.get(account_id)
+                if factory is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    engine = self._engine(account_id, read_only=False)
+                    shard_metadata.create_all(engine)
+                    register_speaks(f"分片 {account_id}", engine, shard_speaks)
+                    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+                    self._write[account_id] = factory
+        return factory()
+
+    def read_session(self, account_id: int) -> Session:
+        factory = self._read.get(account_id)
+        if factory is None:
+            # 只读连接不能建表：先经写连接建表（旧分片文件补建后来新增的表）
+            self.write_session(account_id).close()
+            with self._lock:
+                factory = self._read.get(account_id)
+                if factory is None:
+                    engine = self._engine(account_id, read_only=True)
+                    factory = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+                    self._read[account_id] = factory
+        return factory()
+
+    def map_read(self, fn: Callable[..., Any], *args, account_ids: Iterable[int] | None = None, **kwargs) -> List[Any]:
+        """在各分片的只读会话上并行执行 fn(db, *args, **kwargs)，按账号ID顺序返回结果
+
+        account_ids 为 None 时查询所有已有分片；没有分片文件的账号跳过。
+        """
+        existing = set(self.account_ids())
+        targets = [a for a in (account_ids if account_ids is not None else existing) if a in existing]
+        if not targets:
+            return []
+
+        def run(account_id: int):
+            with self.read_session(account_id) as db:
+                return fn(db, *args, **kwargs)
+
+        if len(targets) == 1:
+            return [run(targets[0])]
+        with ThreadPoolExecutor(max_workers=min(len(targets), get_settings().shard_read_workers)) as pool:
+            return list(pool.map(run, sorted(targets)))
+
+    def map_write(self, fn: Callable[..., Any], *args, account_ids: Iterable[int] | None = None, **kwargs) -> List[Any]:
+        """依次在各分片的读写会话上执行 fn(db, *args, **kwargs)（整理、迁移等维护操作）"""
+        existing = set(self.account_ids())
+        targets = [a for a in (account_ids if account_ids is not None else existing) if a in existing]
+        results = []
+        for account_id in sorted(targets):
+            with self.write_session(account_id) as db:
+                results.append(fn(db, *args, **kwargs))
+        return results
+
+    def dispose(self) -> None:
+        with self._lock:
+            for engine in self._engines:
+                engine.dispose()
+            self._engines.clear()
+            self._write.clear()
+            self._read.clear()
+
+
+_shard_set: ShardSet | None = None
+_shard_lock = threading.Lock()
+_unsupported_warned = False
+
+
+def get_shards() -> ShardSet | None:
+    """SPEAK_SHARDS 开启且主库是 SQLite 文件时返回分片集合，否则返回 None（发言写在主库）"""
+    global _shard_set, _unsupported_warned
+    settings = get_settings()
+    if not settings.speak_shards:
+        return None
+    if _shard_set is not None:
+        return _shard_set
+    with _shard_lock:
+        if _shard_set is None:
+            central = _sqlite_path(settings.db_url)
+            if central is None:
+                if not _unsupported_warned:
+                    print("⚠️ SPEAK_SHARDS 只支持 SQLite 文件数据库，发言仍写入主库")
+                    _unsupported_warned = True
+                return None
+            _shard_set = ShardSet(settings.shard_dir, central)
+    return _shard_set
+
+
+def dispose_shards() -> None:
+    global _shard_set
+    if _shard_set is not None:
+        _shard_set.dispose()
+    _shard_set = None
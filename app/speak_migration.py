@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Dict, Tuple
+
+from sqlalchemy import Table, inspect, text
+from sqlalchemy.engine import Engine
+
+from .models import LEGACY_SPEAK_INDEXES, Speak
+
+# 还有旧格式 speaks 的库：名称 -> (engine, table)；迁移完成后移除
+_pending: Dict[str, Tuple[Engine, Table]] = {}
+_pending_lock = threading.Lock()
+_queue: "queue.Queue[str]" = queue.Queue()
+_worker: threading.Thread | None = None
+_background = False
+
+
+def speaks_need_migration(engine: Engine, table: Table = Speak.__table__) -> bool:
+    """SQLite 的 speaks 表是否还是旧格式（文本时间或旧的单列索引）
+
+    迁移从最新的行往前转换，最早一行是整数即说明时间列已全部转换；只读一行，开销很小。
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect() as conn:
+        insp = inspect(conn)
+        if not insp.has_table(table.name):
+            return False
+        if {ix["name"] for ix in insp.get_indexes(table.name)} & set(LEGACY_SPEAK_INDEXES):
+            return True
+        first = conn.execute(text(f"SELECT typeof(message_date) FROM {table.name} ORDER BY id LIMIT 1")).scalar()
+        return first == "text"
+
+
+def migrate_speaks(
+    engine: Engine,
+    table: Table = Speak.__table__,
+    batch_size: int = 20000,
+    pause: float = 0.05,
+    vacuum: bool = False,
+) -> dict:
+    """把 SQLite speaks 表的文本时间原地转换为整数 Unix 秒，并重建索引（可在服务运行时执行）
+
+    按 id 区间分批，从最新的行往前，每批一个短事务，批间休眠 pause 秒让出写锁；
+    新写入的行已经是整数，不受影响；转换完成前查询经 legacy_speaks_pending() 同时匹配文本时间。
+    时间列转换完后建新索引（建索引期间持有写锁）、删除旧的单列索引；vacuum=True 时最后 VACUUM 回收空间（期间锁库）。
+    """
+    result = {"converted": 0, "created_indexes": [], "dropped_indexes": [], "seconds": 0.0}
+    if engine.dialect.name != "sqlite":
+        return result
+    t0 = time.perf_counter()
+    name = table.name
+    with engine.connect() as conn:
+        lo_id, hi_id = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {name}")).one()
+
+    if hi_id is not None:
+        hi = hi_id
+        while hi >= lo_id:
+            lo = hi - batch_size
+            with engine.begin() as conn:
+                res = conn.execute(
+                    text(
+                        f"UPDATE {name} SET message_date = CAST(strftime('%s', message_date) AS INTEGER) "
+                        "WHERE id > :lo AND id <= :hi AND typeof(message_date) = 'text'"
+                    ),
+                    {"lo": lo, "hi": hi},
+                )
+                result["converted"] += res.rowcount or 0
+            hi = lo
+            if pause > 0:
+                time.sleep(pause)
+
+    with engine.begin() as conn:
+        existing = {ix["name"] for ix in inspect(conn).get_indexes(name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn, checkfirst=True)
+                result["created_indexes"].append(index.name)
+        for index_name in LEGACY_SPEAK_INDEXES:
+            if index_name in existing:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+                result["dropped_indexes"].append(index_name)
+
+    if vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    result["seconds"] = time.perf_counter() - t0
+    return result
+
+
+def legacy_speaks_pending() -> bool:
+    """是否还有库的 speaks 没迁移完；为真时时间窗口查询同时匹配整数和旧的文本时间"""
+    return bool(_pending)
+
+
+def register_speaks(name: str, engine: Engine, table: Table = Speak.__table__) -> bool:
+    """打开库时调用：speaks 仍是旧格式时记为待迁移，已开启后台迁移时排入队列。返回是否需要迁移"""
+    if not speaks_need_migration(engine, table):
+        return False
+    with _pending_lock:
+        if name in _pending:
+            return True
+        _pending[name] = (engine, table)
+    if _background:
+        _queue.put(name)
+    print(f"⚠️ {name} speaks 表仍是旧格式（文本时间），迁移完成前导出查询同时匹配文本时间")
+    return True
+
+
+def start_background_migration() -> None:
+    """在后台线程中逐个迁移已登记和之后打开的旧格式库（服务启动时调用）
+
+    与 scripts/migrate_compact_speaks.py 相同的分批短事务，迁移期间照常采集和导出。
+    """
+    global _worker, _background
+    with _pending_lock:
+        if _background:
+            return
+        _background = True
+        names = list(_pending)
+        _worker = threading.Thread(target=_run_migrations, name="speak-migration", daemon=True)
+    for name in names:
+        _queue.put(name)
+    _worker.start()
+
+
+def _run_migrations() -> None:
+    while True:
+        name = _queue.get()
+        entry = _pending.get(name)
+        if entry is None:
+            continue
+        engine, table = entry
+        try:
+            result = migrate_speaks(engine, table)
+        except Exception as e:
+            print(f"⚠️ {name} speaks 表后台迁移失败，导出查询继续兼容文本时间: {e}")
+            continue
+        with _pending_lock:
+            _pending.pop(name, None)
+        print(f"✅ {name} speaks 表已迁移为紧凑格式：转换 {result['converted']} 行，耗时 {result['seconds']:.1f} 秒")
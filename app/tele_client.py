@@ -1,12 +1,11 @@
 from __future__ import annotations
 
-import asyncio
 from typing import Dict
 from telethon import TelegramClient
 from telethon.sessions import StringSession
-from telethon.errors import FloodWaitError
 from .config import get_settings
 from .models import Account
+from .governor import get_governor
 
 
 _clients: Dict[int, TelegramClient] = {}
@@ -16,17 +15,20 @@ async def get_client_for_account(account: Account) -> TelegramClient:
     settings = get_settings()
     client = _clients.get(account.id)
     if client is None:
-        client = TelegramClient(StringSession(account.session_string), settings.api_id, settings.api_hash)
+        client = TelegramClient(
+            StringSession(account.session_string),
+            settings.api_id,
+            settings.api_hash,
+            flood_sleep_threshold=settings.tg_flood_sleep_threshold,
+        )
         _clients[account.id] = client
     if not client.is_connected():
         await client.connect()
     # ensure authorized
-    try:
-        if not await client.is_user_authorized():
-            # Session string should be authorized; if not, raise
-            raise RuntimeError("Session not authorized. Please re-generate StringSession.")
-    except FloodWaitError as e:
-        await asyncio.sleep(e.seconds + 1)
+    # FloodWait 时调节器等待后重试一次，仍失败则抛出，不返回未确认授权的客户端
+    if not await get_governor(account.id).call(client.is_user_authorized):
+        # Session string should be authorized; if not, raise
+        raise RuntimeError("Session not authorized. Please re-generate StringSession.")
     return client
 
 
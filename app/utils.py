@@ -1,9 +1,21 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
 
+def ensure_utc(dt: datetime) -> datetime:
+    """SQLite 读出的 DateTime 不带时区，统一视为 UTC"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def local_day(dt: datetime, tz: str) -> int:
+    """dt 在 tz 时区下的自然日序号（1970-01-01 为 0）"""
+    return (ensure_utc(dt).astimezone(ZoneInfo(tz)).date() - date(1970, 1, 1)).days
+
+
 def parse_range_to_utc_window(range_key: str, tz: str) -> tuple[datetime, datetime]:
     tzinfo = ZoneInfo(tz)
     now_local = datetime.now(tzinfo)
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from sqlalchemy.orm import Session
+
+from .config import get_settings
+
+# 写入优先级（数值小的先执行）：实时监听 > 历史采集 > 进度等后台状态
+REALTIME = 0
+BACKFILL = 1
+BACKGROUND = 2
+LANES = {REALTIME: "realtime", BACKFILL: "backfill", BACKGROUND: "background"}
+
+# 停止标记排在所有写入之后，停止前已提交的写入都会执行完
+_STOP_PRIORITY = max(LANES) + 1
+
+
+def _new_session() -> Session:
+    from . import models
+    models._init_engine_and_session()
+    return models.SessionLocal()
+
+
+class LaneStats:
+    def __init__(self):
+        self.submitted = 0
+        self.done = 0
+        self.errors = 0
+        self.wait_seconds = 0.0
+        self.exec_seconds = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "done": self.done,
+            "pending": self.submitted - self.done - self.errors,
+            "errors": self.errors,
+            "avg_wait_ms": round(self.wait_seconds * 1000 / (self.done + self.errors), 2) if self.done + self.errors else 0.0,
+            "avg_exec_ms": round(self.exec_seconds * 1000 / (self.done + self.errors), 2) if self.done + self.errors else 0.0,
+        }
+
+
+class DBWriter:
+    """单写线程：独占一个线程和一个数据库会话，按优先级从队列取写入任务执行
+
+    写入函数的签名与 crud 一致，第一个参数是会话：fn(db, *args, **kwargs)。
+    submit 返回 asyncio.Future，结果（或异常）由写线程回填到提交方的事件循环。
+    同一优先级内按提交顺序执行；SQLite 只允许一个写者，所有写入串行后不再争抢写锁，也不阻塞事件循环。
+    """
+
+    def __init__(self):
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.lanes: Dict[int, LaneStats] = {p: LaneStats() for p in LANES}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._thread.start()
+
+    async def stop(self) -> None:
+        """执行完已提交的写入后退出写线程"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put((_STOP_PRIORITY, next(self._seq), None))
+        await asyncio.to_thread(thread.join)
+        self._thread = None
+
+    def submit(self, fn: Callable[..., Any], *args, priority: int = BACKFILL, **kwargs) -> asyncio.Future:
+        """提交一次写入，返回可 await 的 Future"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.lanes[priority].submitted += 1
+        self._queue.put((priority, next(self._seq), (fn, args, kwargs, loop, fut, time.monotonic())))
+        return fut
+
+    async def run(self, fn: Callable[..., Any], *args, priority: int = BACKFILL, **kwargs) -> Any:
+        return await self.submit(fn, *args, priority=priority, **kwargs)
+
+    def _loop(self) -> None:
+        db = _new_session()
+        try:
+            while True:
+                priority, _, item = self._queue.get()
+                if item is None:
+                    return
+                fn, args, kwargs, loop, fut, enqueued = item
+                lane = self.lanes[priority]
+                started = time.monotonic()
+                lane.wait_seconds += started - enqueued
+                try:
+                    result = fn(db, *args, **kwargs)
+                except BaseException as e:
+                    db.rollback()
+                    lane.errors += 1
+                    lane.exec_seconds += time.monotonic() - started
+                    loop.call_soon_threadsafe(_set_exception, fut, e)
+                    continue
+                lane.done += 1
+                lane.exec_seconds += time.monotonic() - started
+                loop.call_soon_threadsafe(_set_result, fut, result)
+        finally:
+            db.close()
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "lanes": {name: self.lanes[p].snapshot() for p, name in LANES.items()},
+        }
+
+
+def _set_result(fut: asyncio.Future, result: Any) -> None:
+    if not fut.done():
+        fut.set_result(result)
+
+
+def _set_exception(fut: asyncio.Future, exc: BaseException) -> None:
+    if not fut.done():
+        fut.set_exception(exc)
+
+
+def _call_with_session(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    db = _new_session()
+    try:
+        return fn(db, *args, **kwargs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+db_writer = DBWriter()
+
+
+async def run_write(fn: Callable[..., Any], *args, priority: int = BACKFILL, **kwargs) -> Any:
+    """执行一次写入：DB_WRITER 开启时交给单写线程，否则在线程池中用临时会话执行"""
+    if get_settings().db_writer:
+        return await db_writer.run(fn, *args, priority=priority, **kwargs)
+    return await asyncio.to_thread(_call_with_session, fn, *args, **kwargs)
+
+
+async def run_read(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在线程池中用临时同步会话执行查询；用于会阻塞较久的读取（如分片模式下并行查询各分片）"""
+    return await asyncio.to_thread(_call_with_session, fn, *args, **kwargs)
+
+
+def write_in_background(fn: Callable[..., Any], *args, priority: int = BACKGROUND, **kwargs) -> None:
+    """提交不需要等待结果的写入（如进度）；失败只记录日志
+
+    DB_WRITER 关闭或没有运行中的事件循环时同步执行，保持与调用顺序一致。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _call_with_session(fn, *args, **kwargs)
+        return
+    if not get_settings().db_writer:
+        _call_with_session(fn, *args, **kwargs)
+        return
+    db_writer.submit(fn, *args, priority=priority, **kwargs).add_done_callback(_log_background_error)
+
+
+def _log_background_error(fut: asyncio.Future) -> None:
+    if not fut.cancelled() and fut.exception() is not None:
+        print(f"❌ 后台写入失败: {fut.exception()}")
+
+
+def get_writer_status() -> dict:
+    return db_writer.snapshot()
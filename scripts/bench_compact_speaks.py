@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+紧凑发言存储基准：同一份数据分别写入
+  1) 旧格式 speaks（文本时间 + 5 个单列索引）
+  2) 紧凑格式 speaks（整数 Unix 秒 + 组合索引，新建库即为此格式）
+  3) 旧格式库经 scripts/migrate_compact_speaks.py 同样的在线迁移（含 VACUUM）得到的库
+对比库文件大小和 get_usernames_in_window 各种窗口的查询耗时，并校验三者结果一致。
+另外在未迁移的旧格式库上经 crud 查询（迁移完成前同时匹配整数和文本时间），校验结果相同。校验失败时退出码为 1。
+
+用法: python scripts/bench_compact_speaks.py [--rows 10000000] [--users 200000] [--days 90] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base, apply_sqlite_pragmas
+from app.speak_migration import migrate_speaks, register_speaks
+from app import crud
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+ACCOUNTS = 4
+CHATS = 200
+
+# 迁移前 models.Speak 生成的表结构
+LEGACY_DDL = (
+    """CREATE TABLE speaks (
+    id INTEGER NOT NULL,
+    account_id INTEGER NOT NULL,
+    chat_id BIGINT NOT NULL,
+    tg_user_id BIGINT NOT NULL,
+    message_id INTEGER NOT NULL,
+    message_date DATETIME NOT NULL,
+    PRIMARY KEY (id),
+    CONSTRAINT uq_speak_unique UNIQUE (account_id, chat_id, tg_user_id, message_id),
+    FOREIGN KEY(account_id) REFERENCES accounts (id) ON DELETE CASCADE,
+    FOREIGN KEY(tg_user_id) REFERENCES users (tg_user_id) ON DELETE CASCADE
+)""",
+    "CREATE INDEX ix_speak_account ON speaks (account_id)",
+    "CREATE INDEX ix_speak_chat ON speaks (chat_id)",
+    "CREATE INDEX ix_speak_date ON speaks (message_date)",
+    "CREATE INDEX ix_speak_user ON speaks (tg_user_id)",
+)
+
+
+def generate(args):
+    """按时间顺序生成发言：(account_id, chat_id, tg_user_id, message_id, 秒偏移)，用户活跃度呈长尾分布"""
+    rnd = random.Random(args.seed)
+    span = args.days * 86400
+    next_msg = {}
+    for i in range(args.rows):
+        chat = rnd.randint(1, CHATS)
+        msg_id = next_msg.get(chat, 0) + 1
+        next_msg[chat] = msg_id
+        yield (
+            (chat % ACCOUNTS) + 1,
+            -1000000000000 - chat,
+            max(1, int(args.users ** rnd.random())),  # 长尾：少数用户发言最多
+            msg_id,
+            i * span // args.rows,
+        )
+
+
+def build(path: str, args, legacy: bool) -> float:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    start_ts = int(START.timestamp())
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany("INSERT INTO accounts (id, name, session_string, is_enabled, created_at, updated_at) VALUES (?, ?, '', 1, '2024-01-01', '2024-01-01')",
+                     [(a, f"bench{a}") for a in range(1, ACCOUNTS + 1)])
+    conn.executemany("INSERT INTO users (tg_user_id, username, is_bot, created_at, updated_at) VALUES (?, ?, 0, '2024-01-01', '2024-01-01')",
+                     ((u, f"@user{u}") for u in range(1, args.users + 1)))
+    if legacy:
+        conn.execute("DROP TABLE speaks")
+        conn.execute(LEGACY_DDL[0])
+        rows = ((a, c, u, m, (START + timedelta(seconds=s)).strftime("%Y-%m-%d %H:%M:%S.%f")) for a, c, u, m, s in generate(args))
+        conn.executemany("INSERT INTO speaks (account_id, chat_id, tg_user_id, message_id, message_date) VALUES (?, ?, ?, ?, ?)", rows)
+        for ddl in LEGACY_DDL[1:]:
+            conn.execute(ddl)
+    else:
+        rows = ((a, c, u, m, start_ts + s) for a, c, u, m, s in generate(args))
+        conn.executemany("INSERT INTO speaks (account_id, chat_id, tg_user_id, message_id, message_date) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return time.perf_counter() - t0
+
+
+def speaks_bytes(path: str) -> int:
+    """speaks 表及其索引占用的字节数（dbstat 虚表）"""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'speaks')"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def queries(args) -> list:
+    end = START + timedelta(days=args.days)
+    return [
+        ("最近 24 小时", end - timedelta(hours=24), end, None, None),
+        ("最近 7 天", end - timedelta(days=7), end, None, None),
+        ("最近 7 天 单账号", end - timedelta(days=7), end, 1, None),
+        ("最近 30 天 单群", end - timedelta(days=30), end, None, -1000000000001),
+        ("全部", START, end, None, None),
+    ]
+
+
+def run_queries(path: str, args, legacy: bool = False) -> list:
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    apply_sqlite_pragmas(engine)
+    if legacy:
+        # 与服务启动时相同：登记为待迁移，之后的查询同时匹配文本时间
+        register_speaks(os.path.basename(path), engine)
+    Session = sessionmaker(bind=engine, autoflush=False, future=True)
+    out = []
+    with Session() as db:
+        for name, start, end, account_id, chat_id in queries(args):
+            times, names = [], None
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                names = crud.get_usernames_in_window(db, start, end, account_id, chat_id)
+                times.append(time.perf_counter() - t0)
+            out.append((name, statistics.median(times) * 1000, names))
+    engine.dispose()
+    return out
+
+
+def run_legacy_queries(path: str, args) -> list:
+    """旧格式库上的同一查询：时间以文本比较（与迁移前 SQLAlchemy 生成的 SQL 相同）"""
+    conn = sqlite3.connect(path)
+    fmt = "%Y-%m-%d %H:%M:%S.%f"
+    out = []
+    for name, start, end, account_id, chat_id in queries(args):
+        sql = ("SELECT users.username FROM speaks JOIN users ON speaks.tg_user_id = users.tg_user_id "
+               "WHERE speaks.message_date >= ? AND speaks.message_date < ?")
+        params = [start.strftime(fmt), end.strftime(fmt)]
+        if account_id is not None:
+            sql += " AND speaks.account_id = ?"
+            params.append(account_id)
+        if chat_id is not None:
+            sql += " AND speaks.chat_id = ?"
+            params.append(chat_id)
+        times, names = [], None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            names = sorted({r for (r,) in conn.execute(sql, params) if r})
+            times.append(time.perf_counter() - t0)
+        out.append((name, statistics.median(times) * 1000, names))
+    conn.close()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"发言: {args.rows}  用户: {args.users}  账号: {ACCOUNTS}  群: {CHATS}  时间跨度: {args.days} 天")
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "legacy.sqlite3")
+        compact = os.path.join(tmp, "compact.sqlite3")
+        migrated = os.path.join(tmp, "migrated.sqlite3")
+        print(f"🔧 生成旧格式库... {build(legacy, args, legacy=True):.1f} 秒")
+        print(f"🔧 生成紧凑格式库... {build(compact, args, legacy=False):.1f} 秒")
+        shutil.copyfile(legacy, migrated)
+        engine = create_engine(f"sqlite:///{migrated}", future=True)
+        apply_sqlite_pragmas(engine)
+        result = migrate_speaks(engine, pause=0, vacuum=True)
+        engine.dispose()
+        print(f"🔧 在线迁移旧格式库: 转换 {result['converted']} 行，{result['seconds']:.1f} 秒")
+
+        paths = (legacy, compact, migrated)
+        print(f"\n{'':14} {'旧格式 MB':>10} {'紧凑 MB':>10} {'迁移后 MB':>10} {'缩小':>6}")
+        for name, sizes in (("库文件", [os.path.getsize(p) for p in paths]), ("speaks 表+索引", [speaks_bytes(p) for p in paths])):
+            mb = [n / 1024 / 1024 for n in sizes]
+            print(f"{name:14} {mb[0]:10.1f} {mb[1]:10.1f} {mb[2]:10.1f} {1 - sizes[1] / sizes[0]:6.1%}")
+
+        old = run_legacy_queries(legacy, args)
+        new = run_queries(compact, args)
+        mig = run_queries(migrated, args)
+        pending = run_queries(legacy, args, legacy=True)
+        ok = True
+        print(f"\n{'查询':16} {'用户名数':>8} {'旧格式 ms':>10} {'迁移中 ms':>10} {'紧凑 ms':>10} {'迁移后 ms':>10} {'加速':>6} {'结果一致':>8}")
+        for (name, old_ms, old_names), (_, new_ms, new_names), (_, mig_ms, mig_names), (_, pend_ms, pend_names) in zip(old, new, mig, pending):
+            same = old_names == new_names == mig_names == pend_names
+            ok = ok and same
+            print(f"{name:16} {len(new_names):8d} {old_ms:10.1f} {pend_ms:10.1f} {new_ms:10.1f} {mig_ms:10.1f} {old_ms / new_ms:6.2f} {'是' if same else '否':>8}")
+    if not ok:
+        print("❌ 校验失败: 不同格式的查询结果不一致")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
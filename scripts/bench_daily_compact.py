@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+紧凑采集基准：同一批消息（含一定比例的重复消息）经 IngestBuffer 分别以
+  1) 逐条记录（speaks，默认模式）
+  2) SPEAK_DAILY_COMPACT=1（speak_days，每个 账号/群/用户/自然日 一行）
+写入，对比写入的行数、库文件大小和写入耗时，并校验各种窗口下 get_usernames_in_window 的结果完全一致：
+按日模式把窗口扩展到起止时刻所在的整天，起止不在零点的窗口与逐条模式在扩展后窗口上的结果比较。
+校验失败时退出码为 1。
+
+每种模式在单独的子进程中运行（配置在导入 app 时读取）。
+
+用法: python scripts/bench_daily_compact.py [--messages 500000] [--days 14] [--users 20000] [--members 500] [--dup 0.05] [--tz Asia/Shanghai]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ACCOUNTS = 2
+CHATS = 50
+
+
+def day_start(args, offset: int) -> datetime:
+    """TZ 时区下第 offset 天的零点（UTC）"""
+    local = datetime(2024, 1, 1, tzinfo=ZoneInfo(args.tz)) + timedelta(days=offset)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0).astimezone(timezone.utc)
+
+
+def generate(args):
+    """按时间顺序生成消息 (account_id, chat_id, tg_user_id, message_id, message_date)；dup 比例的消息是之前消息的重复"""
+    rnd = random.Random(args.seed)
+    start = day_start(args, 0)
+    span = args.days * 86400
+    next_msg: dict = {}
+    recent: list = []
+    for i in range(args.messages):
+        if recent and rnd.random() < args.dup:
+            yield recent[rnd.randrange(len(recent))]
+            continue
+        chat = rnd.randint(1, CHATS)
+        msg_id = next_msg.get(chat, 0) + 1
+        next_msg[chat] = msg_id
+        msg = (
+            chat % ACCOUNTS + 1,
+            -1000000000000 - chat,
+            # 每个群有 members 个活跃成员，发言次数呈长尾：少数成员发言最多
+            (chat * 7919 + int(args.members ** rnd.random())) % args.users + 1,
+            msg_id,
+            start + timedelta(seconds=i * span // args.messages),
+        )
+        recent.append(msg)
+        if len(recent) > 1000:
+            recent.pop(0)
+        yield msg
+
+
+def whole_days(args, start: datetime, end: datetime) -> tuple[datetime, datetime]:
+    """把窗口扩展到起止时刻所在的整天（TZ 时区）"""
+    tz = ZoneInfo(args.tz)
+    first = start.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    last = (end - timedelta(microseconds=1)).astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    return first.astimezone(timezone.utc), (last + timedelta(days=1)).astimezone(timezone.utc)
+
+
+def windows(args) -> list:
+    """按整天划分的窗口：每一天、每 7 天、全部，以及按账号和按群的过滤；另有起止在 15 点的 3 天窗口（如 3d 导出）"""
+    out = [(day_start(args, d), day_start(args, d + 1), None, None) for d in range(args.days)]
+    out += [(day_start(args, d), day_start(args, d + 7), None, None) for d in range(0, args.days, 7)]
+    out += [(day_start(args, 0), day_start(args, args.days), a, None) for a in range(1, ACCOUNTS + 1)]
+    out += [(day_start(args, d), day_start(args, d + 1), None, -1000000000001) for d in range(args.days)]
+    out += [(day_start(args, d) + timedelta(hours=15), day_start(args, d + 3) + timedelta(hours=15), None, None) for d in range(args.days - 3)]
+    return out
+
+
+def child(args) -> None:
+    from sqlalchemy import func, select
+    from sqlalchemy.engine import make_url
+    from app import models, crud
+    from app.config import get_settings
+    from app.ingest import IngestBuffer
+
+    daily = get_settings().speak_daily_compact
+
+    models._init_engine_and_session()
+    with models.SessionLocal() as db:
+        for a in range(1, ACCOUNTS + 1):
+            db.add(models.Account(id=a, name=f"bench{a}", session_string=""))
+        db.commit()
+
+    t0 = time.perf_counter()
+    with models.SessionLocal() as db:
+        buffers = {a: IngestBuffer(db, a, batch_size=args.batch_size, flush_interval=3600) for a in range(1, ACCOUNTS + 1)}
+        for account_id, chat_id, uid, msg_id, date in generate(args):
+            buffers[account_id].add(chat_id, uid, f"@user{uid}", None, None, False, msg_id, date)
+        for buffer in buffers.values():
+            buffer.flush()
+    elapsed = time.perf_counter() - t0
+
+    with models.SessionLocal() as db:
+        speaks = db.execute(select(func.count()).select_from(models.Speak)).scalar()
+        days = db.execute(select(func.count()).select_from(models.SpeakDay)).scalar()
+        counted = db.execute(select(func.coalesce(func.sum(models.SpeakDay.message_count), 0))).scalar()
+        digest = hashlib.sha1()
+        total = 0
+        t1 = time.perf_counter()
+        for start, end, account_id, chat_id in windows(args):
+            if not daily:
+                start, end = whole_days(args, start, end)
+            names = crud.get_usernames_in_window(db, start, end, account_id, chat_id)
+            total += len(names)
+            digest.update(("\n".join(names) + "\f").encode())
+        query_ms = (time.perf_counter() - t1) * 1000
+    # 关闭所有连接时 WAL 合并回主库文件
+    models._engine.dispose()
+    size = os.path.getsize(make_url(os.environ["DB_URL"]).database)
+    print(json.dumps({
+        "rows": speaks + days,
+        "messages": speaks + counted,
+        "seconds": elapsed,
+        "size_mb": size / 1024 / 1024,
+        "query_ms": query_ms,
+        "usernames": total,
+        "checksum": digest.hexdigest(),
+    }))
+
+
+def run_mode(args, daily: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DB_URL": f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}",
+            "SPEAK_DAILY_COMPACT": "1" if daily else "0",
+            "SPEAK_SHARDS": "0",
+            "TZ": args.tz,
+        }
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--child",
+            "--messages", str(args.messages), "--days", str(args.days), "--users", str(args.users), "--members", str(args.members),
+            "--dup", str(args.dup), "--tz", args.tz, "--batch-size", str(args.batch_size), "--seed", str(args.seed),
+        ]
+        out = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--members", type=int, default=500, help="每个群的活跃成员数")
+    parser.add_argument("--dup", type=float, default=0.05, help="重复消息的比例")
+    parser.add_argument("--tz", default="Asia/Shanghai", help="划分自然日的时区（TZ）")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    print(f"消息: {args.messages}（重复 {args.dup:.0%}）  天数: {args.days}  用户: {args.users}  每群活跃成员: {args.members}  账号: {ACCOUNTS}  群: {CHATS}  TZ: {args.tz}")
+    full = run_mode(args, daily=False)
+    daily = run_mode(args, daily=True)
+    print(f"{'':10} {'行数':>10} {'计入消息':>10} {'库 MB':>8} {'写入 秒':>8} {'窗口查询 ms':>12}")
+    for name, r in (("逐条", full), ("按日", daily)):
+        print(f"{name:10} {r['rows']:10d} {r['messages']:10d} {r['size_mb']:8.1f} {r['seconds']:8.1f} {r['query_ms']:12.1f}")
+    print(f"行数缩小 {full['rows'] / max(1, daily['rows']):.1f} 倍，库文件缩小 {full['size_mb'] / daily['size_mb']:.1f} 倍")
+    if daily["checksum"] != full["checksum"] or daily["messages"] != full["messages"]:
+        print("❌ 校验失败: 窗口查询结果或消息数不一致")
+        sys.exit(1)
+    print(f"✅ 校验通过: {len(windows(args))} 个窗口的用户名结果一致（共 {full['usernames']} 个），消息计数一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+只读连接池基准：采集写入进行时，导出查询分别
+  1) 不运行（基线）
+  2) 与写入共用主引擎（原来的 /api/export/txt）
+  3) 走只读引擎（SQLite mode=ro + query_only，带 READ_QUERY_TIMEOUT）
+对比写入吞吐量和导出耗时。写入与导出各用一个线程，模拟采集与导出同时进行。
+
+用法: python scripts/bench_read_engine.py [--batches 300] [--batch-size 200] [--preload 200000] [--window-hours 24]
+"""
+import argparse
+import dataclasses
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.config import get_settings
+from app.models import Base, apply_sqlite_pragmas, apply_query_timeout, read_db_url
+from app import crud
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_batch(rnd: random.Random, users: int, msg_id: int, size: int):
+    speaks, seen = [], {}
+    for i in range(size):
+        uid = rnd.randint(1, users)
+        seen[uid] = {"tg_user_id": uid, "username": f"@user{uid}", "is_bot": False}
+        speaks.append({
+            "account_id": 1,
+            "chat_id": -1000000000000 - rnd.randint(1, 20),
+            "tg_user_id": uid,
+            "message_id": msg_id + i,
+            "message_date": START + timedelta(seconds=msg_id + i),
+        })
+    return list(seen.values()), speaks
+
+
+def run(name: str, mode: str, args) -> dict:
+    settings = get_settings()
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        engine = create_engine(url, future=True)
+        apply_sqlite_pragmas(engine, settings)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False, future=True)
+        ReadSession = Session
+        read_engine = None
+        if mode == "read":
+            read_url = read_db_url(dataclasses.replace(settings, db_url=url, db_read_url=""))
+            read_engine = create_engine(read_url, future=True)
+            apply_sqlite_pragmas(read_engine, settings, read_only=True)
+            apply_query_timeout(read_engine, settings.read_query_timeout)
+            ReadSession = sessionmaker(bind=read_engine, autoflush=False, future=True)
+
+        rnd = random.Random(args.seed)
+        msg_id = 1
+        with Session() as db:
+            while msg_id <= args.preload:
+                users, speaks = make_batch(rnd, args.users, msg_id, 5000)
+                crud.ingest_batch(db, users, speaks)
+                msg_id += 5000
+
+        stop = threading.Event()
+        export_times: list[float] = []
+        export_errors = [0]
+
+        def exporter():
+            with ReadSession() as db:
+                while not stop.is_set():
+                    t0 = time.perf_counter()
+                    try:
+                        crud.get_usernames_in_window(db, START, START + timedelta(hours=args.window_hours))
+                        export_times.append(time.perf_counter() - t0)
+                    except OperationalError:
+                        export_errors[0] += 1
+                    db.rollback()
+
+        t = None
+        if mode != "none":
+            t = threading.Thread(target=exporter, daemon=True)
+            t.start()
+        rows = 0
+        t0 = time.perf_counter()
+        with Session() as db:
+            for _ in range(args.batches):
+                users, speaks = make_batch(rnd, args.users, msg_id, args.batch_size)
+                msg_id += args.batch_size
+                crud.ingest_batch(db, users, speaks)
+                rows += len(speaks)
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        if t is not None:
+            t.join()
+        engine.dispose()
+        if read_engine is not None:
+            read_engine.dispose()
+
+    return {
+        "name": name,
+        "rows_per_sec": rows / elapsed if elapsed else 0.0,
+        "exports": len(export_times),
+        "export_p50_ms": statistics.median(export_times) * 1000 if export_times else 0.0,
+        "export_errors": export_errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--preload", type=int, default=200000)
+    parser.add_argument("--window-hours", type=float, default=24, help="导出查询的时间窗口")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"批次: {args.batches} x {args.batch_size}  预置发言: {args.preload}  导出窗口: {args.window_hours} 小时")
+    results = [
+        run("无导出", "none", args),
+        run("导出走主引擎", "shared", args),
+        run("导出走只读引擎", "read", args),
+    ]
+    print(f"{'':14} {'写入 行/秒':>10} {'导出次数':>8} {'导出 p50 ms':>12} {'导出失败':>8}")
+    for r in results:
+        print(f"{r['name']:14} {r['rows_per_sec']:10.0f} {r['exports']:8d} {r['export_p50_ms']:12.1f} {r['export_errors']:8d}")
+
+
+if __name__ == "__main__":
+    main()
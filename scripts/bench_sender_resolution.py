@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+发送者解析基准：对比逐条 get_sender 与按页解析（页内实体 + LRU + 批量 GetUsers）
+每 1000 条消息产生的网络往返次数。使用假客户端，不连接 Telegram。
+
+用法: python scripts/bench_sender_resolution.py [--messages 10000] [--users 2000] [--min-ratio 0.3]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl import functions, types
+
+from app.senders import SenderResolver
+
+PAGE_SIZE = 100
+
+
+class FakeMessage:
+    """模拟 Telethon 消息：sender 为页内实体，min 用户或缺失时 get_sender 需要一次往返"""
+
+    def __init__(self, client, msg_id: int, sender: types.User):
+        self._client = client
+        self.id = msg_id
+        self.sender_id = sender.id
+        self.sender = sender
+        self.input_chat = types.InputPeerChannel(channel_id=1, access_hash=1)
+
+    async def get_sender(self):
+        if self.sender is None or getattr(self.sender, "min", False):
+            self._client.round_trips += 1
+            return self._client.full_users[self.sender_id]
+        return self.sender
+
+
+class FakeClient:
+    def __init__(self, users: int):
+        self.round_trips = 0
+        self.full_users = {
+            uid: types.User(id=uid, username=f"user{uid}", bot=False, access_hash=uid)
+            for uid in range(1, users + 1)
+        }
+
+    async def __call__(self, request):
+        assert isinstance(request, functions.users.GetUsersRequest)
+        assert len(request.id) <= 100
+        self.round_trips += 1
+        return [self.full_users[u.user_id] for u in request.id]
+
+
+def make_pages(client: FakeClient, messages: int, min_ratio: float, seed: int):
+    rnd = random.Random(seed)
+    # 活跃度呈长尾分布：少数用户发言很多
+    weights = [1.0 / (i + 1) for i in range(len(client.full_users))]
+    uids = rnd.choices(list(client.full_users), weights=weights, k=messages)
+    msgs = []
+    for i, uid in enumerate(uids, start=1):
+        full = client.full_users[uid]
+        if rnd.random() < min_ratio:
+            sender = types.User(id=uid, min=True, bot=False)
+        else:
+            sender = full
+        msgs.append(FakeMessage(client, i, sender))
+    return [msgs[i:i + PAGE_SIZE] for i in range(0, len(msgs), PAGE_SIZE)]
+
+
+async def run_before(pages, client: FakeClient) -> int:
+    client.round_trips = 0
+    for page in pages:
+        for msg in page:
+            await msg.get_sender()
+    return client.round_trips
+
+
+async def run_after(pages, client: FakeClient) -> tuple[int, dict]:
+    client.round_trips = 0
+    resolver = SenderResolver(client, max_size=10000)
+    for page in pages:
+        await resolver.resolve(page)
+    return client.round_trips, resolver.stats
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--min-ratio", type=float, default=0.3, help="页内只有 min 用户信息的消息比例")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    client = FakeClient(args.users)
+    pages = make_pages(client, args.messages, args.min_ratio, args.seed)
+    before = await run_before(pages, client)
+    after, stats = await run_after(pages, client)
+    per_k = 1000 / args.messages
+    print(f"消息数: {args.messages}  用户数: {args.users}  min 比例: {args.min_ratio}")
+    print(f"逐条 get_sender : {before:6d} 次往返  ({before * per_k:.1f} / 1000 条)")
+    print(f"按页批量解析     : {after:6d} 次往返  ({after * per_k:.1f} / 1000 条)")
+    print(f"解析统计: {stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+发言分片基准：N 个账号各用一个线程同时写入发言，对比
+  1) 单个 SQLite 文件（所有账号共用一个写锁）
+  2) SPEAK_SHARDS=1（每个账号一个分片库，用户和断点仍写主库）
+的总写入吞吐量，并检查两种模式下 get_usernames_in_window 的结果一致。
+
+每种模式在单独的子进程中运行（配置在导入 app 时读取）。多核机器上分片模式的吞吐量随账号数增长。
+
+用法: python scripts/bench_shards.py [--accounts 1 4 8] [--batches 100] [--batch-size 500]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def child(args) -> None:
+    from app import models, crud
+
+    models._init_engine_and_session()
+    with models.SessionLocal() as db:
+        for a in range(1, args.accounts + 1):
+            db.add(models.Account(id=a, name=f"bench{a}", session_string=""))
+        db.commit()
+
+    def writer(account_id: int, counts: list):
+        rnd = random.Random(args.seed + account_id)
+        msg_id = 1
+        with models.SessionLocal() as db:
+            for _ in range(args.batches):
+                users, speaks = {}, []
+                for _ in range(args.batch_size):
+                    uid = rnd.randint(1, args.users)
+                    users[uid] = {"tg_user_id": uid, "username": f"@user{uid}", "is_bot": False}
+                    speaks.append({
+                        "account_id": account_id,
+                        "chat_id": -1000000000000 - rnd.randint(1, 20),
+                        "tg_user_id": uid,
+                        "message_id": msg_id,
+                        "message_date": START + timedelta(seconds=msg_id),
+                    })
+                    msg_id += 1
+                counts.append(sum(crud.ingest_batch(db, list(users.values()), speaks).values()))
+
+    counts: list = []
+    threads = [threading.Thread(target=writer, args=(a, counts)) for a in range(1, args.accounts + 1)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with models.SessionLocal() as db:
+        t1 = time.perf_counter()
+        names = crud.get_usernames_in_window(db, START, START + timedelta(days=365))
+        query_ms = (time.perf_counter() - t1) * 1000
+    print(json.dumps({
+        "rows": sum(counts),
+        "rows_per_sec": sum(counts) / elapsed,
+        "query_ms": query_ms,
+        "usernames": len(names),
+        "checksum": hashlib.sha1("\n".join(names).encode()).hexdigest(),
+    }))
+
+
+def run_mode(args, shards: bool, accounts: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DB_URL": f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}",
+            "SPEAK_SHARDS": "1" if shards else "0",
+            "SHARD_DIR": os.path.join(tmp, "shards"),
+        }
+        cmd = [
+            sys.executable, os.path.abspath(__file__), "--child",
+            "--accounts", str(accounts), "--batches", str(args.batches),
+            "--batch-size", str(args.batch_size), "--users", str(args.users), "--seed", str(args.seed),
+        ]
+        out = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--batches", type=int, default=100, help="每个账号写入的批次数")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.accounts = args.accounts[0]
+        child(args)
+        return
+
+    print(f"每账号 {args.batches} x {args.batch_size} 条  CPU: {os.cpu_count()}")
+    print(f"{'账号数':>6} {'单库 行/秒':>12} {'分片 行/秒':>12} {'倍数':>6} {'单库导出 ms':>12} {'分片导出 ms':>12} {'结果一致':>8}")
+    for n in args.accounts:
+        single = run_mode(args, False, n)
+        sharded = run_mode(args, True, n)
+        same = single["checksum"] == sharded["checksum"] and single["rows"] == sharded["rows"]
+        print(
+            f"{n:6d} {single['rows_per_sec']:12.0f} {sharded['rows_per_sec']:12.0f} "
+            f"{sharded['rows_per_sec'] / single['rows_per_sec']:6.2f} {single['query_ms']:12.1f} {sharded['query_ms']:12.1f} {'是' if same else '否':>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+SQLite 连接参数基准：对比 SQLite 默认设置（回滚日志 + synchronous=FULL）与 SQLITE_* 调优参数
+（WAL、synchronous=NORMAL、busy_timeout、mmap、cache、temp_store）下的写入速度，
+以及写入进行时导出查询（get_usernames_in_window）的延迟和 database is locked 次数。
+
+每种设置使用临时目录中的新数据库文件，写入与查询各用一个线程和独立连接，模拟采集与导出同时进行。
+
+用法: python scripts/bench_sqlite_pragmas.py [--batches 300] [--batch-size 200] [--users 5000] [--preload 200000] [--window-hours 1] [--dir ./data]
+"""
+import argparse
+import dataclasses
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.config import get_settings
+from app.models import Base, apply_sqlite_pragmas, sqlite_pragmas
+from app import crud
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_batch(rnd: random.Random, users: int, msg_id: int, size: int):
+    speaks, seen = [], {}
+    for i in range(size):
+        uid = rnd.randint(1, users)
+        seen[uid] = {"tg_user_id": uid, "username": f"@user{uid}", "is_bot": False}
+        speaks.append({
+            "account_id": 1,
+            "chat_id": -1000000000000 - rnd.randint(1, 20),
+            "tg_user_id": uid,
+            "message_id": msg_id + i,
+            "message_date": START + timedelta(seconds=msg_id + i),
+        })
+    return list(seen.values()), speaks
+
+
+def run_profile(name: str, tuned: bool, args) -> dict:
+    settings = dataclasses.replace(get_settings(), sqlite_tuning=tuned)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}", future=True)
+        apply_sqlite_pragmas(engine, settings)
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False, future=True)
+        rnd = random.Random(args.seed)
+
+        # 预先写入历史数据，让导出查询有真实的扫描量
+        msg_id = 1
+        with Session() as db:
+            while msg_id <= args.preload:
+                users, speaks = make_batch(rnd, args.users, msg_id, 5000)
+                crud.ingest_batch(db, users, speaks)
+                msg_id += 5000
+
+        stop = threading.Event()
+        latencies: list[float] = []
+        locked = [0]
+
+        def reader():
+            read_rnd = random.Random(args.seed + 1)
+            with Session() as db:
+                while not stop.is_set():
+                    start = START + timedelta(seconds=read_rnd.randint(0, max(1, args.preload)))
+                    t0 = time.perf_counter()
+                    try:
+                        crud.get_usernames_in_window(db, start, start + timedelta(hours=args.window_hours))
+                        latencies.append(time.perf_counter() - t0)
+                    except OperationalError:
+                        locked[0] += 1
+                    db.rollback()
+
+        t = threading.Thread(target=reader, daemon=True)
+        t.start()
+        write_errors = 0
+        rows = 0
+        t0 = time.perf_counter()
+        with Session() as db:
+            for _ in range(args.batches):
+                users, speaks = make_batch(rnd, args.users, msg_id, args.batch_size)
+                msg_id += args.batch_size
+                try:
+                    crud.ingest_batch(db, users, speaks)
+                    rows += len(speaks)
+                except OperationalError:
+                    write_errors += 1
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        t.join()
+        engine.dispose()
+
+    lat = sorted(latencies) or [0.0]
+    return {
+        "name": name,
+        "rows_per_sec": rows / elapsed if elapsed else 0.0,
+        "write_errors": write_errors,
+        "reads": len(latencies),
+        "read_p50_ms": statistics.median(lat) * 1000,
+        "read_p95_ms": lat[int(len(lat) * 0.95) - 1 if len(lat) > 1 else 0] * 1000,
+        "read_max_ms": lat[-1] * 1000,
+        "read_locked": locked[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=300, help="写入批次数（每批一个事务）")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--preload", type=int, default=200000, help="测试前预先写入的发言数")
+    parser.add_argument("--window-hours", type=float, default=1, help="导出查询的时间窗口")
+    parser.add_argument("--dir", default=None, help="数据库文件所在目录，应与生产数据库在同一块磁盘（默认系统临时目录）")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    settings = get_settings()
+    print(f"批次: {args.batches} x {args.batch_size}  预置发言: {args.preload}  用户数: {args.users}")
+    tuned = sqlite_pragmas(dataclasses.replace(settings, sqlite_tuning=True))
+    print("调优参数: " + ", ".join(p.replace("PRAGMA ", "") for p in tuned))
+    results = [run_profile("默认设置", False, args), run_profile("调优参数", True, args)]
+    print(f"{'':8} {'写入 行/秒':>10} {'写入失败':>8} {'查询次数':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'locked':>7}")
+    for r in results:
+        print(
+            f"{r['name']:8} {r['rows_per_sec']:10.0f} {r['write_errors']:8d} {r['reads']:8d} "
+            f"{r['read_p50_ms']:8.1f} {r['read_p95_ms']:8.1f} {r['read_max_ms']:8.1f} {r['read_locked']:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+把 SQLite speaks 表迁移到紧凑格式：message_date 由文本改为整数 Unix 秒，
+索引改为 (message_date, tg_user_id)、(chat_id, message_date)、(tg_user_id) 三个组合索引，删除旧的单列索引。
+主库和 SHARD_DIR 下已有的分片库都会迁移；可以在服务运行时执行（分批短事务，批间让出写锁）。
+服务启动时也会在后台自动迁移；本脚本用于不启动服务时迁移，或迁移后 VACUUM 回收空间。
+
+用法: python scripts/migrate_compact_speaks.py [--batch-size 20000] [--pause 0.05] [--vacuum]
+"""
+import argparse
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import get_settings
+from app import models
+from app.shards import ShardSet, shard_speaks, _sqlite_path
+from app.speak_migration import migrate_speaks
+
+
+def report(name: str, result: dict) -> None:
+    print(
+        f"✅ {name}: 转换 {result['converted']} 行，新建索引 {result['created_indexes'] or '无'}，"
+        f"删除索引 {result['dropped_indexes'] or '无'}，耗时 {result['seconds']:.1f} 秒"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=20000, help="每个事务转换的 id 区间大小")
+    parser.add_argument("--pause", type=float, default=0.05, help="批间休眠秒数")
+    parser.add_argument("--vacuum", action="store_true", help="迁移后 VACUUM 回收空间（期间锁库）")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    models._init_engine_and_session()
+    if models._engine.dialect.name != "sqlite":
+        print("ℹ️ 主库不是 SQLite，message_date 仍为 timestamptz，无需迁移")
+        return
+
+    print("🔧 迁移主库 speaks 表...")
+    report("主库", migrate_speaks(models._engine, batch_size=args.batch_size, pause=args.pause, vacuum=args.vacuum))
+
+    central = _sqlite_path(settings.db_url)
+    if central is None:
+        return
+    shards = ShardSet(settings.shard_dir, central)
+    try:
+        for account_id in shards.account_ids():
+            with shards.write_session(account_id) as db:
+                engine = db.get_bind()
+            result = migrate_speaks(engine, shard_speaks, batch_size=args.batch_size, pause=args.pause, vacuum=args.vacuum)
+            report(f"分片 {account_id}", result)
+    finally:
+        shards.dispose()
+
+
+if __name__ == "__main__":
+    main()